@@ -1,13 +1,26 @@
 from django.contrib import admin
+from django.utils.translation import gettext_lazy as _
 
 from api.models import Meme, MemeTemplate
 
 
 @admin.register(MemeTemplate)
 class MemeTemplateAdmin(admin.ModelAdmin):
-    list_display = ("name", "image_url", "default_top_text", "default_bottom_text")
+    list_display = (
+        "name",
+        "image_url",
+        "default_top_text",
+        "default_bottom_text",
+        "status",
+    )
     search_fields = ("name", "image_url", "default_top_text", "default_bottom_text")
-    list_filter = ("name", "image_url", "default_top_text", "default_bottom_text")
+    list_filter = (
+        "name",
+        "image_url",
+        "default_top_text",
+        "default_bottom_text",
+        "status",
+    )
     ordering = ("name", "image_url", "default_top_text", "default_bottom_text")
     fieldsets = (
         (
@@ -21,6 +34,29 @@ class MemeTemplateAdmin(admin.ModelAdmin):
                 )
             },
         ),
+        (
+            _("Health"),
+            {
+                "fields": (
+                    "status",
+                    "content_length",
+                    "width",
+                    "height",
+                    "last_checked_at",
+                    "check_failures",
+                    "next_check_at",
+                )
+            },
+        ),
+    )
+    readonly_fields = (
+        "status",
+        "content_length",
+        "width",
+        "height",
+        "last_checked_at",
+        "check_failures",
+        "next_check_at",
     )
 
 
@@ -0,0 +1,95 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpRequest, JsonResponse
+from rest_framework.request import Request
+
+from api.models import Meme
+from api.pagination import AsyncPageNumberPagination, MemeCursorPagination
+from api.registry import template_registry
+from api.serializers import (
+    MemeSerializer,
+    MemeTemplateSerializer,
+    RatedMemeSerializer,
+    ShortMemeSerializer,
+    SurpriseMemeSerializer,
+)
+from api.services import SurpriseMeMemeService
+from core.async_views import AsyncAPIView
+from core.exceptions import BadRequestError, NotFoundError
+
+
+class AsyncListTemplatesView(AsyncAPIView):
+    async def get(self, request: HttpRequest, *args, **kwargs) -> JsonResponse:
+        templates = await sync_to_async(template_registry.all)()
+        return self.json(
+            MemeTemplateSerializer(
+                templates, many=True, context={"request": request}
+            ).data
+        )
+
+
+class AsyncMemesView(AsyncAPIView):
+    """
+    Lists the memes in the same order and with the same pagination modes as MemesView.
+    Only the page number mode counts the memes.
+    """
+
+    async def get(self, request: HttpRequest, *args, **kwargs) -> JsonResponse:
+        queryset = Meme.objects.all_with_joins()
+        if MemeCursorPagination.is_requested(drf_request := Request(request)):
+            paginator = MemeCursorPagination()
+            memes = await sync_to_async(paginator.paginate_queryset)(
+                queryset, drf_request
+            )
+            serializer = MemeSerializer(memes, many=True, context={"request": request})
+            return self.json(paginator.get_paginated_response(serializer.data).data)
+
+        paginator = AsyncPageNumberPagination()
+        memes = await paginator.paginate_queryset(queryset, request)
+        serializer = MemeSerializer(memes, many=True, context={"request": request})
+        return self.json(paginator.get_paginated_data(serializer.data))
+
+
+class AsyncMemeView(AsyncAPIView):
+    async def get(self, request: HttpRequest, *args, **kwargs) -> JsonResponse:
+        meme = await Meme.objects.all_with_joins().filter(id=kwargs["id"]).afirst()
+        if meme is None:
+            raise NotFoundError()
+        return self.json(MemeSerializer(meme, context={"request": request}).data)
+
+
+class AsyncRandomMemeView(AsyncAPIView):
+    @staticmethod
+    def _get_count(request: HttpRequest) -> int:
+        try:
+            count = int(request.GET["count"])
+        except ValueError:
+            raise BadRequestError()
+        if not 1 <= count <= settings.RANDOM_MEMES_MAX_COUNT:
+            raise BadRequestError()
+        return count
+
+    async def get(self, request: HttpRequest, *args, **kwargs) -> JsonResponse:
+        if "count" not in request.GET:
+            meme = await Meme.objects.aget_random_meme()
+            return self.json(
+                ShortMemeSerializer(meme, context={"request": request}).data
+            )
+        memes = await Meme.objects.aget_random_memes(self._get_count(request))
+        return self.json(
+            ShortMemeSerializer(memes, many=True, context={"request": request}).data
+        )
+
+
+class AsyncTopMemesView(AsyncAPIView):
+    async def get(self, request: HttpRequest, *args, **kwargs) -> JsonResponse:
+        memes = [meme async for meme in Meme.objects.get_top_memes()]
+        return self.json(
+            RatedMemeSerializer(memes, many=True, context={"request": request}).data
+        )
+
+
+class AsyncSurpriseMeMemeView(AsyncAPIView):
+    async def get(self, request: HttpRequest, *args, **kwargs) -> JsonResponse:
+        meme_data = await SurpriseMeMemeService(user_id=request.user.id).aexecute()
+        return self.json(SurpriseMemeSerializer(meme_data).data)
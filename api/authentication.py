@@ -0,0 +1,88 @@
+import time
+from typing import Optional, Union
+
+from django.conf import settings
+from django.contrib.auth.base_user import AbstractBaseUser
+from django.core.cache import cache
+from rest_framework_simplejwt.authentication import (
+    JWTAuthentication,
+    JWTStatelessUserAuthentication,
+)
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import Token
+
+REVOKED_USER_CACHE_KEY = "revoked_user:{user_id}"
+
+
+def revoke_user_tokens(user_id: int) -> None:
+    """
+    This function is used to reject the access tokens of the user that have been
+    issued so far. The time of the revocation is kept in the shared cache for the
+    lifetime of access tokens, after which the old tokens have expired anyway.
+    """
+    cache.set(
+        REVOKED_USER_CACHE_KEY.format(user_id=user_id),
+        int(time.time()),
+        timeout=int(api_settings.ACCESS_TOKEN_LIFETIME.total_seconds()),
+    )
+
+
+def _is_revoked(validated_token: Token, revoked_at: Optional[int]) -> bool:
+    # The issue time has a resolution of seconds, so tokens issued in the second of
+    # the revocation are accepted, otherwise a new login would be rejected as well.
+    return revoked_at is not None and validated_token.get("iat", 0) < revoked_at
+
+
+class StatelessJWTAuthentication(JWTStatelessUserAuthentication):
+    """
+    Authenticates requests by their access token without loading the user from the
+    database. The user is a TokenUser built from the claims of the token: the id and
+    the staff flag, which is added to the tokens when they are issued. Tokens issued
+    before the user was changed or deleted are rejected when the revocation checks are
+    enabled, which costs a lookup in the shared cache instead of a database query.
+    """
+
+    def get_user(self, validated_token: Token) -> TokenUser:
+        user = super().get_user(validated_token)
+        if settings.JWT_REVOCATION_CHECKS and _is_revoked(
+            validated_token, cache.get(REVOKED_USER_CACHE_KEY.format(user_id=user.id))
+        ):
+            raise InvalidToken("Token has been revoked.")
+        return user
+
+    async def aget_user(self, validated_token: Token) -> TokenUser:
+        user = super().get_user(validated_token)
+        if settings.JWT_REVOCATION_CHECKS and _is_revoked(
+            validated_token,
+            await cache.aget(REVOKED_USER_CACHE_KEY.format(user_id=user.id)),
+        ):
+            raise InvalidToken("Token has been revoked.")
+        return user
+
+
+class ConfiguredJWTAuthentication(StatelessJWTAuthentication):
+    """
+    Authenticates requests statelessly when settings.STATELESS_JWT_AUTHENTICATION is
+    enabled, and by loading the user from the database otherwise. The setting is read
+    on every request, because DRF views pick their authentication classes when they're
+    imported.
+    """
+
+    def get_user(self, validated_token: Token) -> Union[AbstractBaseUser, TokenUser]:
+        if settings.STATELESS_JWT_AUTHENTICATION:
+            return super().get_user(validated_token)
+        return JWTAuthentication.get_user(self, validated_token)
+
+    async def aget_user(
+        self, validated_token: Token
+    ) -> Union[AbstractBaseUser, TokenUser]:
+        if settings.STATELESS_JWT_AUTHENTICATION:
+            return await super().aget_user(validated_token)
+        user = await self.user_model.objects.filter(
+            **{api_settings.USER_ID_FIELD: validated_token[api_settings.USER_ID_CLAIM]}
+        ).afirst()
+        if user is None or not user.is_active:
+            raise InvalidToken("User not found or inactive.")
+        return user
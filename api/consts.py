@@ -24,3 +24,29 @@ BOTTOM_TEXTS = [
     "…but end up binge-watching Netflix instead.",
     "…and then everything goes horribly wrong.",
 ]
+
+
+# Images of memes are served in several sizes (the maximum width in pixels) and formats,
+# which are generated from the rendered image on demand.
+IMAGE_VARIANT_SIZES = {"thumbnail": 320, "medium": 640, "full": None}
+IMAGE_VARIANT_FORMATS = {
+    "jpeg": {
+        "content_type": "image/jpeg",
+        "save_options": {
+            "format": "JPEG",
+            "quality": 80,
+            "progressive": True,
+            "optimize": True,
+        },
+    },
+    "webp": {
+        "content_type": "image/webp",
+        "save_options": {"format": "WEBP", "quality": 75, "method": 4},
+    },
+    "png": {
+        "content_type": "image/png",
+        "save_options": {"format": "PNG", "optimize": True},
+    },
+}
+DEFAULT_IMAGE_VARIANT_SIZE = "full"
+DEFAULT_IMAGE_VARIANT_FORMAT = "jpeg"
@@ -1,4 +1,4 @@
-from django.db.models import IntegerChoices
+from django.db.models import IntegerChoices, TextChoices
 
 
 class Score(IntegerChoices):
@@ -7,3 +7,9 @@ class Score(IntegerChoices):
     THREE = 3
     FOUR = 4
     FIVE = 5
+
+
+class TemplateStatus(TextChoices):
+    UNKNOWN = "unknown"
+    HEALTHY = "healthy"
+    UNHEALTHY = "unhealthy"
@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from rest_framework.request import Request
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.authentication import StatelessJWTAuthentication
+from api.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures the cost of authenticating a request by its access token, loading "
+        "the user from the database (JWTAuthentication) or building it from the "
+        "claims of the token (StatelessJWTAuthentication)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=2000,
+            help="Number of authentications per class.",
+        )
+
+    def handle(self, *args, **options):
+        if not (user := User.objects.order_by("id").first()):
+            raise CommandError("At least one user is required.")
+
+        request = Request(
+            RequestFactory().get(
+                "/api/memes/", HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(user)}"
+            )
+        )
+        requests = options["requests"]
+        self.stdout.write(f"{'class':<28} {'us/request':>12} {'queries/request':>16}")
+        for authentication_class in (JWTAuthentication, StatelessJWTAuthentication):
+            authentication = authentication_class()
+            authentication.authenticate(request)
+            with CaptureQueriesContext(connections[DEFAULT_DB_ALIAS]) as queries:
+                started_at = time.perf_counter()
+                for _ in range(requests):
+                    if authentication.authenticate(request) is None:
+                        raise CommandError("The request wasn't authenticated.")
+                elapsed = time.perf_counter() - started_at
+            self.stdout.write(
+                f"{authentication_class.__name__:<28} "
+                f"{elapsed / requests * 1_000_000:>12.1f} "
+                f"{len(queries) / requests:>16.2f}"
+            )
@@ -0,0 +1,104 @@
+import statistics
+import time
+from typing import Any, Optional
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections
+from django.test import Client
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.models import Meme, User
+
+POOL_OPTIONS = {"min_size": 1, "max_size": 4}
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures the latency of /api/memes/<id>/ with a new database connection per "
+        "request, with persistent connections and with a pool of connections. The "
+        "requests are handled in this process, and the connections are closed after "
+        "every request as a server does, so the difference between the modes is the "
+        "cost of opening connections."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=500,
+            help="Number of requests per mode.",
+        )
+        parser.add_argument(
+            "--meme-id", type=int, help="Meme to request, the first one by default."
+        )
+
+    def _configure(self, conn_max_age: int, pool: Optional[dict[str, Any]]) -> None:
+        connection = connections[DEFAULT_DB_ALIAS]
+        connection.close()
+        connection.close_pool()
+        connection.settings_dict["CONN_MAX_AGE"] = conn_max_age
+        options = connection.settings_dict.setdefault("OPTIONS", {})
+        options.pop("pool", None)
+        if pool is not None:
+            options["pool"] = pool
+
+    def _measure(self, client: Client, path: str, requests: int) -> list[float]:
+        client.get(path)
+        latencies = []
+        for _ in range(requests):
+            started_at = time.perf_counter()
+            # The test client doesn't close the connections at the start and the end
+            # of requests, as the request handler of a server does, so we do it.
+            close_old_connections()
+            response = client.get(path)
+            close_old_connections()
+            latencies.append((time.perf_counter() - started_at) * 1000)
+            if response.status_code != 200:
+                raise CommandError(f"{path} responded with {response.status_code}.")
+        return latencies
+
+    def handle(self, *args, **options):
+        if connections[DEFAULT_DB_ALIAS].vendor != "postgresql":
+            raise CommandError("The benchmark requires PostgreSQL.")
+        if not (user := User.objects.order_by("id").first()):
+            raise CommandError("At least one user is required.")
+        meme_id = (
+            options["meme_id"] or Meme.objects.values_list("id", flat=True).first()
+        )
+        if meme_id is None:
+            raise CommandError("At least one meme is required.")
+
+        path = f"/api/memes/{meme_id}/"
+        client = Client(
+            HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(user)}",
+            HTTP_HOST="localhost",
+        )
+        settings_dict = connections[DEFAULT_DB_ALIAS].settings_dict
+        initial = (
+            settings_dict["CONN_MAX_AGE"],
+            settings_dict.get("OPTIONS", {}).get("pool"),
+        )
+        modes = {
+            "new connection": (0, None),
+            "persistent": (60, None),
+            "pool": (0, POOL_OPTIONS),
+        }
+
+        self.stdout.write(
+            f"{'mode':<16} {'mean ms':>10} {'p50 ms':>10} {'p99 ms':>10} "
+            f"{'delta ms':>10}"
+        )
+        baseline = None
+        try:
+            for mode, (conn_max_age, pool) in modes.items():
+                self._configure(conn_max_age, pool)
+                latencies = self._measure(client, path, options["requests"])
+                mean = statistics.fmean(latencies)
+                percentiles = statistics.quantiles(latencies, n=100)
+                baseline = mean if baseline is None else baseline
+                self.stdout.write(
+                    f"{mode:<16} {mean:>10.3f} {percentiles[49]:>10.3f} "
+                    f"{percentiles[98]:>10.3f} {mean - baseline:>+10.3f}"
+                )
+        finally:
+            self._configure(*initial)
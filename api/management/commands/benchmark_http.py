@@ -0,0 +1,114 @@
+import asyncio
+import statistics
+import time
+
+import httpx
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks the synchronous and the asynchronous versions of the read "
+        "endpoints of a running server. Every path is requested by the given number "
+        "of concurrent clients, first under /api/ and then under /api/async/, and the "
+        "throughput, the latency percentiles and the errors are reported."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--base-url",
+            default="http://127.0.0.1:8080",
+            help="URL of the server to benchmark.",
+        )
+        parser.add_argument(
+            "--paths",
+            default="memes/,memes/1/,memes/random/,memes/top/,templates/",
+            help="Comma-separated paths to benchmark, relative to /api/.",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=100,
+            help="Number of concurrent clients.",
+        )
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=2000,
+            help="Number of requests per path and version.",
+        )
+        parser.add_argument("--email", required=True, help="Email of a user.")
+        parser.add_argument("--password", required=True, help="Password of the user.")
+
+    async def _get_access_token(
+        self, client: httpx.AsyncClient, email: str, password: str
+    ) -> str:
+        response = await client.post(
+            "/api/token/", data={"email": email, "password": password}
+        )
+        if response.status_code != 200:
+            raise CommandError(f"Couldn't obtain a token: {response.status_code}.")
+        return response.json()["access"]
+
+    async def _measure(
+        self, client: httpx.AsyncClient, path: str, concurrency: int, requests: int
+    ) -> tuple[float, list[float], int]:
+        latencies: list[float] = []
+        errors = 0
+        remaining = iter(range(requests))
+
+        async def worker() -> None:
+            nonlocal errors
+            for _ in remaining:
+                started_at = time.perf_counter()
+                try:
+                    response = await client.get(path)
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - started_at)
+                if response.status_code != 200:
+                    errors += 1
+
+        started_at = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return time.perf_counter() - started_at, latencies, errors
+
+    @staticmethod
+    def _get_percentiles(latencies: list[float]) -> tuple[float, float]:
+        if len(latencies) < 2:
+            return 0.0, 0.0
+        percentiles = statistics.quantiles(latencies, n=100)
+        return percentiles[49] * 1000, percentiles[98] * 1000
+
+    async def _benchmark(self, options: dict) -> None:
+        async with httpx.AsyncClient(
+            base_url=options["base_url"],
+            timeout=30,
+            limits=httpx.Limits(max_connections=options["concurrency"]),
+        ) as client:
+            token = await self._get_access_token(
+                client, options["email"], options["password"]
+            )
+            client.headers["Authorization"] = f"Bearer {token}"
+
+            self.stdout.write(
+                f"{'path':<30} {'rps':>10} {'p50 ms':>10} {'p99 ms':>10} "
+                f"{'errors':>8}"
+            )
+            for path in options["paths"].split(","):
+                for prefix in ("/api/", "/api/async/"):
+                    seconds, latencies, errors = await self._measure(
+                        client,
+                        f"{prefix}{path}",
+                        options["concurrency"],
+                        options["requests"],
+                    )
+                    p50, p99 = self._get_percentiles(latencies)
+                    self.stdout.write(
+                        f"{prefix + path:<30} {options['requests'] / seconds:>10.1f} "
+                        f"{p50:>10.2f} {p99:>10.2f} {errors:>8}"
+                    )
+
+    def handle(self, *args, **options):
+        asyncio.run(self._benchmark(options))
@@ -0,0 +1,95 @@
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.transaction import atomic
+
+from api.managers import RANDOM_MEME_ID_RANGE_CACHE_KEY
+from api.models import Meme, MemeTemplate, User
+
+TABLESAMPLE_QUERY = """
+    (
+        SELECT * FROM {table} TABLESAMPLE SYSTEM (1) LIMIT 1
+    )
+    UNION ALL
+    (
+        SELECT * FROM {table}
+        WHERE NOT EXISTS (SELECT * FROM {table} TABLESAMPLE SYSTEM (1) LIMIT 1)
+        ORDER BY RANDOM()
+        LIMIT 1
+    )
+    LIMIT 1
+"""
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the random meme selection with the former TABLESAMPLE query on "
+        "tables of different sizes. The memes are created inside a transaction that "
+        "is rolled back at the end, so the database is left untouched."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            default="1000,10000,100000",
+            help="Comma-separated numbers of memes to benchmark with.",
+        )
+        parser.add_argument(
+            "--iterations",
+            type=int,
+            default=200,
+            help="Number of random picks per method and size.",
+        )
+
+    def _measure(self, pick, iterations: int) -> float:
+        started_at = time.perf_counter()
+        for _ in range(iterations):
+            pick()
+        return (time.perf_counter() - started_at) / iterations * 1000
+
+    def _benchmark_size(self, size: int, iterations: int) -> None:
+        template = MemeTemplate.objects.create(
+            name="benchmark", image_url="https://example.com/benchmark.jpg"
+        )
+        user = User.objects.create(email=f"benchmark_{size}@example.com")
+        existing = Meme.objects.count()
+        Meme.objects.bulk_create(
+            (
+                Meme(template=template, created_by=user, top_text="", bottom_text="")
+                for _ in range(max(size - existing, 0))
+            ),
+            batch_size=5000,
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(f"ANALYZE {Meme._meta.db_table}")
+        cache.delete(RANDOM_MEME_ID_RANGE_CACHE_KEY)
+
+        query = TABLESAMPLE_QUERY.format(table=Meme._meta.db_table)
+        results = {
+            "tablesample": self._measure(
+                lambda: list(Meme.objects.raw(query)), iterations
+            ),
+            "id range": self._measure(Meme.objects.get_random_meme, iterations),
+            "id range, count=10": self._measure(
+                lambda: Meme.objects.get_random_memes(10), iterations
+            ),
+        }
+        for method, milliseconds in results.items():
+            self.stdout.write(f"{size:>10} {method:<20} {milliseconds:>8.3f} ms")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'memes':>10} {'method':<20} {'per pick':>11}")
+        for size in sorted(int(size) for size in options["sizes"].split(",")):
+            try:
+                with atomic():
+                    self._benchmark_size(size, options["iterations"])
+                    raise Rollback()
+            except Rollback:
+                pass
+        cache.delete(RANDOM_MEME_ID_RANGE_CACHE_KEY)
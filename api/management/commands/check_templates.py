@@ -0,0 +1,51 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.services import CheckTemplatesService
+
+
+class Command(BaseCommand):
+    help = (
+        "Probes the images of the meme templates that are due for a check and records "
+        "their health, dimensions and size."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Check all the templates, not only the ones that are due.",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=settings.TEMPLATE_CHECK_CONCURRENCY,
+            help="Number of images that are probed at the same time.",
+        )
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep checking the templates until the process is stopped.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=settings.TEMPLATE_CHECK_POLL_SECONDS,
+            help="Seconds to wait between checks when running in a loop.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            counts = CheckTemplatesService(
+                concurrency=options["concurrency"], check_all=options["all"]
+            ).execute()
+            self.stdout.write(
+                f"Checked {sum(counts.values())} templates: "
+                + ", ".join(f"{count} {status}" for status, count in counts.items())
+                + "."
+            )
+            if not options["loop"]:
+                return
+            time.sleep(options["interval"])
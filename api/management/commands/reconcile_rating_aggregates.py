@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api.services import ReconcileRatingAggregatesService
+
+
+class Command(BaseCommand):
+    help = "Recomputes the rating aggregates of the memes and fixes the drifted ones."
+
+    def handle(self, *args, **options):
+        fixed = ReconcileRatingAggregatesService().execute()
+        self.stdout.write(f"Fixed the rating aggregates of {fixed} memes.")
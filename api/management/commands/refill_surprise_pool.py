@@ -0,0 +1,31 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.services import RefillSurprisePoolService
+
+
+class Command(BaseCommand):
+    help = "Refills the pool of prerendered memes used by the surprise-me feature."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep refilling the pool until the process is stopped.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=settings.SURPRISE_POOL_REFILL_INTERVAL_SECONDS,
+            help="Seconds to wait between refills when running in a loop.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            rendered = RefillSurprisePoolService().execute()
+            self.stdout.write(f"Rendered {rendered} memes.")
+            if not options["loop"]:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,47 @@
+import argparse
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.warmup import UnappliedMigrationsError, close_connections, run_startup_checks
+
+
+class Command(BaseCommand):
+    help = (
+        "Checks that the container can serve requests: runs the system checks, opens "
+        "the database connections, fails fast if there are unapplied migrations, and "
+        "reports the time of every step. The remaining arguments are the command of "
+        "the server, which then replaces this process, e.g. `manage.py warmup poe "
+        "serve`. Nothing loaded here survives the replacement, so the application is "
+        "preloaded by the master process of gunicorn instead."
+    )
+    # The system checks are a measured step of the startup.
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "server_command",
+            nargs=argparse.REMAINDER,
+            help="Command to run once the warmup has succeeded.",
+        )
+
+    def _report(self, name: str, seconds: float) -> None:
+        self.stdout.write(f"{name:<12} {seconds * 1000:>10.1f} ms")
+
+    def handle(self, *args, **options):
+        started_at = time.perf_counter()
+        self.check()
+        self._report("checks", time.perf_counter() - started_at)
+        try:
+            timings = run_startup_checks()
+        except UnappliedMigrationsError as error:
+            raise CommandError(f"{error}. Run the migrations before the server.")
+        for name, seconds in timings.items():
+            self._report(name, seconds)
+        self._report("total", time.perf_counter() - started_at)
+
+        if server_command := options["server_command"]:
+            close_connections()
+            self.stdout.flush()
+            os.execvp(server_command[0], server_command)
@@ -1,10 +1,20 @@
+import random
+import uuid
+from datetime import datetime
+from typing import Optional
+
+from django.conf import settings
 from django.contrib.auth.base_user import BaseUserManager
+from django.core.cache import cache
 from django.db import IntegrityError
-from django.db.models import Avg, FloatField, Manager, Value
-from django.db.models.functions.comparison import Coalesce
+from django.db.models import Count, Manager, Max, Min
+from django.utils import timezone
 
 from core.exceptions import BadRequestError, NotFoundError
 
+RANDOM_MEME_ID_RANGE_CACHE_KEY = "random_meme_id_range"
+MEMES_LIST_VERSION_CACHE_KEY = "memes_list_version"
+
 
 class UserManager(BaseUserManager):
     def create_user(self, email: str, password: str, **extra_fields):
@@ -26,6 +36,9 @@ class UserManager(BaseUserManager):
 
 
 class MemeManager(Manager):
+    RANDOM_PICK_ATTEMPTS = 3
+    RANDOM_PICK_OVERSAMPLING = 4
+
     def all_with_joins(self):
         """
         This method is used to perform joins with the created_by and template tables,
@@ -44,50 +57,155 @@ class MemeManager(Manager):
             raise NotFoundError()
         return meme
 
+    def get_meme_for_update_or_404(self, meme_id: int):
+        if not (meme := self.select_for_update().filter(id=meme_id).first()):
+            raise NotFoundError()
+        return meme
+
+    def _get_id_range(self) -> Optional[tuple[int, int]]:
+        """
+        This method is used to get the range of the meme ids. The range is cached for a
+        short time, so most of the random picks don't need to aggregate the table.
+        Memes created after the range has been cached can't be picked until it expires.
+        """
+        if (id_range := cache.get(RANDOM_MEME_ID_RANGE_CACHE_KEY)) is not None:
+            return id_range
+        aggregates = self.aggregate(min_id=Min("id"), max_id=Max("id"))
+        if aggregates["min_id"] is None:
+            return None
+        id_range = (aggregates["min_id"], aggregates["max_id"])
+        cache.set(
+            RANDOM_MEME_ID_RANGE_CACHE_KEY,
+            id_range,
+            settings.RANDOM_MEME_ID_RANGE_TTL_SECONDS,
+        )
+        return id_range
+
+    def _draw_candidates(
+        self, id_range: tuple[int, int], needed: int, picked: dict
+    ) -> list[int]:
+        min_id, max_id = id_range
+        return [
+            candidate
+            for candidate in random.sample(
+                range(min_id, max_id + 1),
+                min(max_id - min_id + 1, needed * self.RANDOM_PICK_OVERSAMPLING),
+            )
+            if candidate not in picked
+        ]
+
+    @staticmethod
+    def _pick_found(
+        memes: dict, candidates: list[int], found: dict, count: int
+    ) -> None:
+        for candidate in candidates:
+            if candidate in found and len(memes) < count:
+                memes[candidate] = found[candidate]
+
+    def get_random_memes(self, count: int = 1) -> list:
+        """
+        This method is used to get distinct random memes, every meme having the same
+        chance to be picked. We draw random ids from the range of the meme ids and
+        fetch the ones that exist with a single primary key lookup. To make up for the
+        gaps left by deleted memes, we draw more ids than we need and retry a few times.
+        If the ids are still too sparse, we fall back to random ordering.
+        """
+        if (id_range := self._get_id_range()) is None:
+            return []
+        memes = {}
+        for _ in range(self.RANDOM_PICK_ATTEMPTS):
+            candidates = self._draw_candidates(id_range, count - len(memes), memes)
+            self._pick_found(memes, candidates, self.in_bulk(candidates), count)
+            if len(memes) == count:
+                return list(memes.values())
+
+        rest = self.exclude(id__in=memes).order_by("?")[: count - len(memes)]
+        return [*memes.values(), *rest]
+
+    async def _aget_id_range(self) -> Optional[tuple[int, int]]:
+        if (id_range := await cache.aget(RANDOM_MEME_ID_RANGE_CACHE_KEY)) is not None:
+            return id_range
+        aggregates = await self.aaggregate(min_id=Min("id"), max_id=Max("id"))
+        if aggregates["min_id"] is None:
+            return None
+        id_range = (aggregates["min_id"], aggregates["max_id"])
+        await cache.aset(
+            RANDOM_MEME_ID_RANGE_CACHE_KEY,
+            id_range,
+            settings.RANDOM_MEME_ID_RANGE_TTL_SECONDS,
+        )
+        return id_range
+
+    async def aget_random_memes(self, count: int = 1) -> list:
+        """
+        This method is the asynchronous counterpart of get_random_memes.
+        """
+        if (id_range := await self._aget_id_range()) is None:
+            return []
+        memes = {}
+        for _ in range(self.RANDOM_PICK_ATTEMPTS):
+            candidates = self._draw_candidates(id_range, count - len(memes), memes)
+            self._pick_found(memes, candidates, await self.ain_bulk(candidates), count)
+            if len(memes) == count:
+                return list(memes.values())
+
+        rest = self.exclude(id__in=memes).order_by("?")[: count - len(memes)]
+        return [*memes.values(), *[meme async for meme in rest]]
+
+    async def aget_random_meme(self):
+        if not (memes := await self.aget_random_memes()):
+            raise NotFoundError()
+        return memes[0]
+
     def get_random_meme(self):
+        if not (memes := self.get_random_memes()):
+            raise NotFoundError()
+        return memes[0]
+
+    def get_list_version(self) -> tuple[str, datetime]:
         """
-        This method is used to get a random meme from the database in efficient way.
-        It uses a feature that is available in PostgreSQL, which is the TABLESAMPLE
-        clause. The clause is used to get a random sample of the table, which is
-        useful when we want to get a random row from a large table. If the table is
-        small, we use regular random ordering.
+        This method is used to get a version marker of the memes list and the time of
+        its last change. Both are kept in the shared cache and replaced whenever a meme,
+        or a user or a template shown with the memes, changes, so no query is needed. If the cache
+        has lost them, a new version starts now.
         """
-        table = self.model._meta.db_table
-        large_table_query = f"SELECT * FROM {table} TABLESAMPLE SYSTEM (1) LIMIT 1"
-        try:
-            return self.raw(
-                f"""
-                    (
-                        {large_table_query}
-                    )
-                    UNION ALL
-                    (
-                        SELECT * FROM {table}
-                        WHERE NOT EXISTS ({large_table_query})
-                        ORDER BY RANDOM()
-                        LIMIT 1
-                    )
-                    LIMIT 1
-                """
-            )[0]
-        except IndexError:
+        cache.add(
+            MEMES_LIST_VERSION_CACHE_KEY,
+            (uuid.uuid4().hex, timezone.now()),
+            timeout=None,
+        )
+        return cache.get(MEMES_LIST_VERSION_CACHE_KEY)
+
+    def invalidate_list_version(self) -> None:
+        cache.set(
+            MEMES_LIST_VERSION_CACHE_KEY,
+            (uuid.uuid4().hex, timezone.now()),
+            timeout=None,
+        )
+
+    def get_meme_version_or_404(self, meme_id: int) -> datetime:
+        if not (
+            updated_at := self.filter(id=meme_id)
+            .values_list("updated_at", flat=True)
+            .first()
+        ):
             raise NotFoundError()
+        return updated_at
+
+    def get_top_memes_version(self) -> list[tuple[int, float, datetime]]:
+        return list(
+            self.order_by("-average_score", "-id").values_list(
+                "id", "average_score", "updated_at"
+            )[:10]
+        )
 
     def get_top_memes(self):
         """
         This method is used to get the top 10 memes based on the average score of their
-        ratings. We annotate the queryset with the average score of the ratings and
-        then order the queryset by the average score in descending order.
+        ratings. The average score is maintained on the meme itself, so the query is
+        just a scan of the first entries of the index on the average score.
         """
-        return (
-            self.all_with_joins()
-            .annotate(
-                average_score=Coalesce(
-                    Avg("ratings__score"), Value(0), output_field=FloatField()
-                )
-            )
-            .order_by("-average_score")[:10]
-        )
+        return self.all_with_joins().order_by("-average_score", "-id")[:10]
 
 
 class MemeTemplateManager(Manager):
@@ -98,3 +216,21 @@ class MemeTemplateManager(Manager):
 
     def get_random_order_templates(self):
         return self.all().order_by("?")
+
+
+class PrerenderedMemeManager(Manager):
+    def pop(self):
+        """
+        This method is used to take a random prerendered meme out of the pool. The row
+        is locked with SKIP LOCKED, so that concurrent requests don't wait for each
+        other and never get the same image. It must be called inside a transaction,
+        and the caller is responsible for deleting the returned row.
+        """
+        return self.select_for_update(skip_locked=True).order_by("?").first()
+
+    def count_by_template(self) -> dict[int, int]:
+        return dict(
+            self.values("template_id")
+            .annotate(count=Count("id"))
+            .values_list("template_id", "count")
+        )
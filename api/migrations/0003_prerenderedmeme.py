@@ -0,0 +1,48 @@
+# Generated by Django 5.1.15 on 2026-10-18 18:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0002_meme_image"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PrerenderedMeme",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("top_text", models.CharField(max_length=100, verbose_name="Top text")),
+                (
+                    "bottom_text",
+                    models.CharField(max_length=100, verbose_name="Bottom text"),
+                ),
+                ("image", models.ImageField(upload_to="memes/", verbose_name="Image")),
+                (
+                    "template",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="prerendered_memes",
+                        to="api.memetemplate",
+                        verbose_name="Template",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Prerendered meme",
+                "verbose_name_plural": "Prerendered memes",
+            },
+        ),
+    ]
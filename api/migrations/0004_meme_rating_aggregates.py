@@ -0,0 +1,55 @@
+# Generated by Django 5.1.15 on 2026-10-18 18:18
+
+from django.db import migrations, models
+from django.db.models import Avg, Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_rating_aggregates(apps, schema_editor):
+    Meme = apps.get_model("api", "Meme")
+    Rating = apps.get_model("api", "Rating")
+    ratings = Rating.objects.filter(meme_id=OuterRef("id")).values("meme_id")
+    Meme.objects.update(
+        rating_count=Coalesce(
+            Subquery(ratings.annotate(value=Count("id")).values("value")), Value(0)
+        ),
+        rating_sum=Coalesce(
+            Subquery(ratings.annotate(value=Sum("score")).values("value")), Value(0)
+        ),
+        average_score=Coalesce(
+            Subquery(ratings.annotate(value=Avg("score")).values("value")),
+            Value(0.0),
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0003_prerenderedmeme"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="meme",
+            name="average_score",
+            field=models.FloatField(default=0, verbose_name="Average score"),
+        ),
+        migrations.AddField(
+            model_name="meme",
+            name="rating_count",
+            field=models.PositiveIntegerField(default=0, verbose_name="Rating count"),
+        ),
+        migrations.AddField(
+            model_name="meme",
+            name="rating_sum",
+            field=models.PositiveIntegerField(default=0, verbose_name="Rating sum"),
+        ),
+        migrations.AddIndex(
+            model_name="meme",
+            index=models.Index(fields=["-average_score", "-id"], name="meme_top_idx"),
+        ),
+        migrations.RunPython(
+            backfill_rating_aggregates, reverse_code=migrations.RunPython.noop
+        ),
+    ]
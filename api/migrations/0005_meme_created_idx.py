@@ -0,0 +1,17 @@
+# Generated by Django 5.1.15 on 2026-10-18 18:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0004_meme_rating_aggregates"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="meme",
+            index=models.Index(fields=["-created_at", "-id"], name="meme_created_idx"),
+        ),
+    ]
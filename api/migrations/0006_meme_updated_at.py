@@ -0,0 +1,29 @@
+# Generated by Django 5.1.15 on 2026-10-18 18:27
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def set_updated_at_to_created_at(apps, schema_editor):
+    Meme = apps.get_model("api", "Meme")
+    Meme.objects.update(updated_at=F("created_at"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0005_meme_created_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="meme",
+            name="updated_at",
+            field=models.DateTimeField(
+                auto_now=True, db_index=True, verbose_name="Updated at"
+            ),
+        ),
+        migrations.RunPython(
+            set_updated_at_to_created_at, reverse_code=migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.1.15 on 2026-10-18 18:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0006_meme_updated_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="memetemplate",
+            name="check_failures",
+            field=models.PositiveIntegerField(default=0, verbose_name="Check failures"),
+        ),
+        migrations.AddField(
+            model_name="memetemplate",
+            name="content_length",
+            field=models.PositiveIntegerField(
+                blank=True, null=True, verbose_name="Content length"
+            ),
+        ),
+        migrations.AddField(
+            model_name="memetemplate",
+            name="height",
+            field=models.PositiveIntegerField(
+                blank=True, null=True, verbose_name="Height"
+            ),
+        ),
+        migrations.AddField(
+            model_name="memetemplate",
+            name="last_checked_at",
+            field=models.DateTimeField(
+                blank=True, null=True, verbose_name="Last checked at"
+            ),
+        ),
+        migrations.AddField(
+            model_name="memetemplate",
+            name="next_check_at",
+            field=models.DateTimeField(
+                blank=True, null=True, verbose_name="Next check at"
+            ),
+        ),
+        migrations.AddField(
+            model_name="memetemplate",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("unknown", "Unknown"),
+                    ("healthy", "Healthy"),
+                    ("unhealthy", "Unhealthy"),
+                ],
+                default="unknown",
+                max_length=20,
+                verbose_name="Status",
+            ),
+        ),
+        migrations.AddField(
+            model_name="memetemplate",
+            name="width",
+            field=models.PositiveIntegerField(
+                blank=True, null=True, verbose_name="Width"
+            ),
+        ),
+    ]
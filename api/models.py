@@ -5,16 +5,24 @@ from django.db.models import (
     CharField,
     DateTimeField,
     EmailField,
+    FloatField,
     ImageField,
+    Index,
     IntegerField,
     Model,
+    PositiveIntegerField,
     URLField,
 )
 from django.db.models.fields.related import ForeignKey
 from django.utils.translation import gettext_lazy as _
 
-from api.enums import Score
-from api.managers import MemeManager, MemeTemplateManager, UserManager
+from api.enums import Score, TemplateStatus
+from api.managers import (
+    MemeManager,
+    MemeTemplateManager,
+    PrerenderedMemeManager,
+    UserManager,
+)
 
 
 class TimeStampedModel(Model):
@@ -47,6 +55,30 @@ class MemeTemplate(Model):
     default_bottom_text = CharField(
         _("Default bottom text"), max_length=100, blank=True
     )
+    # The health of the image, which is probed by the check_templates management
+    # command. Templates with unhealthy images are not used by the surprise-me feature.
+    status = CharField(
+        _("Status"),
+        max_length=20,
+        choices=TemplateStatus.choices,
+        default=TemplateStatus.UNKNOWN,
+    )
+    content_length = PositiveIntegerField(_("Content length"), null=True, blank=True)
+    width = PositiveIntegerField(_("Width"), null=True, blank=True)
+    height = PositiveIntegerField(_("Height"), null=True, blank=True)
+    last_checked_at = DateTimeField(_("Last checked at"), null=True, blank=True)
+    check_failures = PositiveIntegerField(_("Check failures"), default=0)
+    next_check_at = DateTimeField(_("Next check at"), null=True, blank=True)
+
+    HEALTH_FIELDS = (
+        "status",
+        "content_length",
+        "width",
+        "height",
+        "last_checked_at",
+        "check_failures",
+        "next_check_at",
+    )
 
     objects = MemeTemplateManager()
 
@@ -54,23 +86,91 @@ class MemeTemplate(Model):
         verbose_name = _("Meme template")
         verbose_name_plural = _("Meme templates")
 
+    def _has_image_url_changed(self) -> bool:
+        if self._state.adding:
+            return False
+        stored_image_url = (
+            MemeTemplate.objects.filter(pk=self.pk)
+            .values_list("image_url", flat=True)
+            .first()
+        )
+        return stored_image_url is not None and stored_image_url != self.image_url
+
+    def _reset_health(self) -> None:
+        self.status = TemplateStatus.UNKNOWN
+        self.content_length = self.width = self.height = None
+        self.last_checked_at = self.next_check_at = None
+        self.check_failures = 0
+
+    def save(self, *args, **kwargs):
+        """
+        The health belongs to the image, so it's reset when the image URL changes. The
+        template is then used again right away and probed on the next check, instead of
+        staying unhealthy until its backoff ends.
+        """
+        update_fields = kwargs.get("update_fields")
+        if (
+            update_fields is None or "image_url" in update_fields
+        ) and self._has_image_url_changed():
+            self._reset_health()
+            if update_fields is not None:
+                kwargs["update_fields"] = {*update_fields, *self.HEALTH_FIELDS}
+        super().save(*args, **kwargs)
+
 
 class Meme(TimeStampedModel):
     template = ForeignKey(MemeTemplate, verbose_name=_("Template"), on_delete=CASCADE)
     top_text = CharField(_("Top text"), max_length=100)
     bottom_text = CharField(_("Bottom text"), max_length=100)
     created_by = ForeignKey(User, verbose_name=_("Created by"), on_delete=CASCADE)
+    # This field is used as a version marker for conditional requests. It changes when
+    # the meme is saved, but not when only its rating aggregates are updated.
+    updated_at = DateTimeField(_("Updated at"), auto_now=True, db_index=True)
 
     # This field is used to store the image of the meme. In a real-world application,
     # we would store the image in a cloud storage service like AWS S3, and store the
     # URL of the image in the database.
     image = ImageField(_("Image"), upload_to="memes/", blank=True, null=True)
 
+    # These fields are denormalized aggregates of the ratings of the meme. They are
+    # maintained by the rating services, so that the top memes can be read from an
+    # index instead of aggregating the whole ratings table.
+    rating_count = PositiveIntegerField(_("Rating count"), default=0)
+    rating_sum = PositiveIntegerField(_("Rating sum"), default=0)
+    average_score = FloatField(_("Average score"), default=0)
+
     objects = MemeManager()
 
     class Meta:
         verbose_name = _("Meme")
         verbose_name_plural = _("Memes")
+        indexes = (
+            Index(fields=("-average_score", "-id"), name="meme_top_idx"),
+            Index(fields=("-created_at", "-id"), name="meme_created_idx"),
+        )
+
+
+class PrerenderedMeme(TimeStampedModel):
+    """
+    A meme image that has been rendered in advance for the surprise-me feature. The
+    pool of such images is filled by the refill_surprise_pool management command.
+    """
+
+    template = ForeignKey(
+        MemeTemplate,
+        verbose_name=_("Template"),
+        on_delete=CASCADE,
+        related_name="prerendered_memes",
+    )
+    top_text = CharField(_("Top text"), max_length=100)
+    bottom_text = CharField(_("Bottom text"), max_length=100)
+    image = ImageField(_("Image"), upload_to="memes/")
+
+    objects = PrerenderedMemeManager()
+
+    class Meta:
+        verbose_name = _("Prerendered meme")
+        verbose_name_plural = _("Prerendered memes")
 
 
 class Rating(TimeStampedModel):
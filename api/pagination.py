@@ -0,0 +1,180 @@
+import base64
+import binascii
+import json
+import math
+from datetime import datetime
+from typing import Any, Optional
+
+from django.conf import settings
+from django.db.models import Q, QuerySet
+from django.http import HttpRequest
+from rest_framework.pagination import BasePagination
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from core.exceptions import BadRequestError, NotFoundError
+
+
+class MemeCursorPagination(BasePagination):
+    """
+    Keyset pagination over the (created_at, id) pair. Instead of an offset, the client
+    sends an opaque cursor with the position of the last (or the first) meme it has
+    seen, so every page is a range scan of the index on these fields, no matter how
+    deep it is. The total count is only calculated when the client asks for it.
+    """
+
+    mode_query_param = "pagination"
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    count_query_param = "with_count"
+    ordering = ("-created_at", "-id")
+
+    def __init__(self):
+        self._request: Optional[Request] = None
+        self._next_cursor: Optional[str] = None
+        self._previous_cursor: Optional[str] = None
+        self._count: Optional[int] = None
+
+    @classmethod
+    def is_requested(cls, request: Request) -> bool:
+        return (
+            request.query_params.get(cls.mode_query_param) == "cursor"
+            or cls.cursor_query_param in request.query_params
+        )
+
+    @staticmethod
+    def _encode_cursor(is_reversed: bool, created_at: datetime, meme_id: int) -> str:
+        position = json.dumps([is_reversed, created_at.isoformat(), meme_id])
+        return base64.urlsafe_b64encode(position.encode()).decode()
+
+    def _decode_cursor(self) -> Optional[tuple[bool, datetime, int]]:
+        if not (cursor := self._request.query_params.get(self.cursor_query_param)):
+            return None
+        try:
+            is_reversed, created_at, meme_id = json.loads(
+                base64.urlsafe_b64decode(cursor.encode())
+            )
+            return bool(is_reversed), datetime.fromisoformat(created_at), int(meme_id)
+        except (binascii.Error, TypeError, ValueError):
+            raise BadRequestError()
+
+    def _get_page_size(self) -> int:
+        try:
+            page_size = int(
+                self._request.query_params.get(
+                    self.page_size_query_param, settings.REST_FRAMEWORK["PAGE_SIZE"]
+                )
+            )
+        except ValueError:
+            raise BadRequestError()
+        if page_size < 1:
+            raise BadRequestError()
+        return min(page_size, settings.MEMES_MAX_PAGE_SIZE)
+
+    def _get_url(self, cursor: Optional[str]) -> Optional[str]:
+        if cursor is None:
+            return None
+        url = self._request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def paginate_queryset(
+        self, queryset: QuerySet, request: Request, view: Any = None
+    ) -> list:
+        self._request = request
+        page_size = self._get_page_size()
+        if request.query_params.get(self.count_query_param) in ("1", "true"):
+            self._count = queryset.count()
+
+        cursor = self._decode_cursor()
+        is_reversed = cursor is not None and cursor[0]
+        if cursor is not None:
+            _, created_at, meme_id = cursor
+            lookup = "gt" if is_reversed else "lt"
+            queryset = queryset.filter(
+                Q(**{f"created_at__{lookup}": created_at})
+                | Q(created_at=created_at, **{f"id__{lookup}": meme_id})
+            )
+        ordering = (
+            [field.lstrip("-") for field in self.ordering]
+            if is_reversed
+            else self.ordering
+        )
+        memes = list(queryset.order_by(*ordering)[: page_size + 1])
+        has_more = len(memes) > page_size
+        memes = memes[:page_size]
+        if is_reversed:
+            memes.reverse()
+
+        has_next = cursor is not None if is_reversed else has_more
+        has_previous = has_more if is_reversed else cursor is not None
+        if memes and has_next:
+            self._next_cursor = self._encode_cursor(
+                False, memes[-1].created_at, memes[-1].id
+            )
+        if memes and has_previous:
+            self._previous_cursor = self._encode_cursor(
+                True, memes[0].created_at, memes[0].id
+            )
+        return memes
+
+    def get_paginated_response(self, data: list) -> Response:
+        response_data = {
+            "next": self._get_url(self._next_cursor),
+            "previous": self._get_url(self._previous_cursor),
+            "results": data,
+        }
+        if self._count is not None:
+            response_data = {"count": self._count, **response_data}
+        return Response(response_data)
+
+
+class AsyncPageNumberPagination:
+    """
+    Page number pagination for the asynchronous views, which queries the page with the
+    async ORM. The pages and the response are the same as the ones of the page number
+    pagination of DRF.
+    """
+
+    page_query_param = "page"
+
+    def __init__(self):
+        self._page_size = settings.REST_FRAMEWORK["PAGE_SIZE"]
+        self._request: Optional[HttpRequest] = None
+        self._count = 0
+        self._page = 1
+
+    async def paginate_queryset(self, queryset: QuerySet, request: HttpRequest) -> list:
+        self._request = request
+        try:
+            self._page = int(request.GET.get(self.page_query_param, 1))
+        except ValueError:
+            raise NotFoundError()
+        self._count = await queryset.acount()
+        if not 1 <= self._page <= max(1, math.ceil(self._count / self._page_size)):
+            raise NotFoundError()
+
+        offset = (self._page - 1) * self._page_size
+        return [item async for item in queryset[offset : offset + self._page_size]]
+
+    def _get_next_link(self) -> Optional[str]:
+        if self._page * self._page_size >= self._count:
+            return None
+        url = self._request.build_absolute_uri()
+        return replace_query_param(url, self.page_query_param, self._page + 1)
+
+    def _get_previous_link(self) -> Optional[str]:
+        if self._page == 1:
+            return None
+        url = self._request.build_absolute_uri()
+        if self._page == 2:
+            return remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.page_query_param, self._page - 1)
+
+    def get_paginated_data(self, data: list) -> dict[str, Any]:
+        return {
+            "count": self._count,
+            "next": self._get_next_link(),
+            "previous": self._get_previous_link(),
+            "results": data,
+        }
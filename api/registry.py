@@ -0,0 +1,108 @@
+import random
+import threading
+import time
+import uuid
+from typing import Iterable, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+
+from api.enums import TemplateStatus
+from api.models import MemeTemplate
+from core.exceptions import NotFoundError
+
+TEMPLATE_REGISTRY_VERSION_CACHE_KEY = "template_registry_version"
+
+
+class TemplateRegistry:
+    """
+    In-process registry of the meme templates. Templates are a small set that rarely
+    changes, so every worker loads them once and serves them from memory. The version
+    of the templates is kept in the shared cache: when a template is saved or deleted,
+    the version changes, and every worker reloads its templates the next time it checks
+    the version, which happens at most once per the check interval.
+    """
+
+    def __init__(self, check_interval: Optional[float] = None):
+        self._check_interval = (
+            settings.TEMPLATE_REGISTRY_CHECK_INTERVAL_SECONDS
+            if check_interval is None
+            else check_interval
+        )
+        self._templates: Optional[dict[int, MemeTemplate]] = None
+        self._version: Optional[str] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _get_shared_version() -> str:
+        cache.add(TEMPLATE_REGISTRY_VERSION_CACHE_KEY, uuid.uuid4().hex, timeout=None)
+        return cache.get(TEMPLATE_REGISTRY_VERSION_CACHE_KEY)
+
+    def _get_templates(self) -> dict[int, MemeTemplate]:
+        """
+        This method is used to get the loaded templates, reloading them if their version
+        has changed. The version is read before the templates are loaded, so a change
+        made while we are loading them is never mistaken for the loaded state.
+        """
+        now = time.monotonic()
+        templates = self._templates
+        if templates is not None and now - self._checked_at < self._check_interval:
+            return templates
+        with self._lock:
+            version = self._get_shared_version()
+            if self._templates is None or version != self._version:
+                self._templates = {
+                    template.id: template
+                    for template in MemeTemplate.objects.order_by("id")
+                }
+                self._version = version
+            self._checked_at = now
+            return self._templates
+
+    @property
+    def version(self) -> str:
+        self._get_templates()
+        return self._version
+
+    def all(self) -> list[MemeTemplate]:
+        return list(self._get_templates().values())
+
+    def get_or_404(self, template_id: int) -> MemeTemplate:
+        if not (template := self._get_templates().get(template_id)):
+            raise NotFoundError()
+        return template
+
+    def get_many(self, template_ids: Iterable[int]) -> dict[int, MemeTemplate]:
+        templates = self._get_templates()
+        return {
+            template_id: templates[template_id]
+            for template_id in template_ids
+            if template_id in templates
+        }
+
+    def get_random_order_templates(self) -> list[MemeTemplate]:
+        """
+        This method is used to get the templates that can be served, in random order.
+        Templates whose images were found unhealthy by the last check are left out,
+        while the ones that haven't been checked yet are given a chance.
+        """
+        templates = [
+            template
+            for template in self.all()
+            if template.status != TemplateStatus.UNHEALTHY
+        ]
+        random.shuffle(templates)
+        return templates
+
+    def invalidate(self) -> None:
+        cache.set(TEMPLATE_REGISTRY_VERSION_CACHE_KEY, uuid.uuid4().hex, timeout=None)
+        self.clear()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._templates = None
+            self._version = None
+
+
+template_registry = TemplateRegistry()
@@ -0,0 +1,337 @@
+import hashlib
+import json
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import Any, Callable, Optional
+
+from django.conf import settings
+from PIL import Image, ImageDraw, ImageOps
+
+from api.text_layout import (
+    MAX_CAPTION_HEIGHT_RATIO,
+    TextLayout,
+    get_font,
+    get_font_path,
+    get_text_layout,
+)
+from core.cache import DiskLRUCache, MemoryLRUCache
+from core.exceptions import ServiceUnavailableError
+
+# Everything that affects the output of render_meme_image. The parameters are a part
+# of the content key of rendered images, so they must be updated whenever the
+# rendering changes, otherwise previously rendered images would be reused.
+RENDER_PARAMS = {"version": 4, "format": "JPEG"}
+# Caption boxes are rounded down to a multiple of this number of pixels, so that
+# templates of similar sizes share caption overlays.
+OVERLAY_SIZE_BUCKET = 32
+
+
+def get_render_params() -> dict[str, Any]:
+    return {
+        **RENDER_PARAMS,
+        "font": get_font_path(),
+        "max_dimension": settings.TEMPLATE_MAX_DIMENSION,
+    }
+
+
+def get_meme_image_name(template_digest: str, top_text: str, bottom_text: str) -> str:
+    """
+    This function is used to get the storage name of a rendered meme image. The name
+    is derived from everything the image depends on, so the same meme is stored only
+    once no matter how many times it's requested.
+    """
+    key = hashlib.sha256(
+        json.dumps(
+            [template_digest, top_text, bottom_text, get_render_params()]
+        ).encode()
+    ).hexdigest()
+    return f"memes/{key[:2]}/{key}.jpeg"
+
+
+def open_template_image(template_content: bytes) -> Image.Image:
+    """
+    This function is used to open a template image without decoding it. Images with
+    more pixels than allowed are rejected before they are decoded, which protects the
+    workers from decompression bombs.
+    """
+    img = Image.open(BytesIO(template_content))
+    if img.width * img.height > settings.TEMPLATE_MAX_PIXELS:
+        raise Image.DecompressionBombError(
+            f"Template image has {img.width * img.height} pixels, "
+            f"the limit is {settings.TEMPLATE_MAX_PIXELS}."
+        )
+    return img
+
+
+def _normalize_template_image(template_content: bytes) -> Image.Image:
+    img = open_template_image(template_content)
+    max_dimension = settings.TEMPLATE_MAX_DIMENSION
+    if max(img.size) > max_dimension:
+        scale = max_dimension / max(img.size)
+        size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        # JPEG images are decoded at the smallest DCT scale that isn't smaller than
+        # the target size, the rest is reduced by an integer factor and resampled.
+        img.draft("RGB", size)
+        img.thumbnail(size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+    img = ImageOps.exif_transpose(img)
+
+    if img.mode == "RGB":
+        return img
+    if img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info:
+        rgba_img = img.convert("RGBA")
+        img = Image.new("RGB", rgba_img.size, "white")
+        img.paste(rgba_img, mask=rgba_img)
+        return img
+    return img.convert("RGB")
+
+
+def get_normalized_template_image(template_content: bytes) -> Image.Image:
+    """
+    This function is used to get the template image downscaled to the maximum
+    dimension and converted to RGB. Normalized images are cached in memory, so hot
+    templates are not decoded at all, and the memory used by a render is bounded by
+    the maximum dimension rather than by the size of the original image. The cached
+    image is shared, so it must be copied before drawing on it.
+    """
+    key = hashlib.sha256(template_content).hexdigest()
+    if (img := normalized_template_cache.get(key)) is None:
+        img = _normalize_template_image(template_content)
+        normalized_template_cache.set(key, img)
+    return img
+
+
+def _draw_caption_overlay(
+    layout: TextLayout, font_path: Optional[str], width: int
+) -> Image.Image:
+    overlay = Image.new("RGBA", (width, layout.height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+    font = get_font(layout.font_size, font_path)
+    for index, (line, line_width) in enumerate(zip(layout.lines, layout.line_widths)):
+        draw.text(
+            (
+                (width - line_width) // 2 + layout.stroke_width,
+                index * layout.line_height + layout.stroke_width,
+            ),
+            line,
+            fill="white",
+            font=font,
+            stroke_width=layout.stroke_width,
+            stroke_fill="black",
+        )
+    return overlay
+
+
+def get_caption_overlay(
+    text: str, image_width: int, image_height: int, font_path: Optional[str]
+) -> Optional[Image.Image]:
+    """
+    This function is used to get a transparent layer with the stroked caption, which
+    is cached in memory. Glyph rasterization with a stroke is the most expensive part
+    of rendering, and captions come from a small set, so the box of the caption is
+    rounded down to a bucket of widths and heights to make the cache hits likely.
+    """
+    margin = max(1, image_width // 50)
+    width = max(
+        OVERLAY_SIZE_BUCKET,
+        (image_width - 2 * margin) // OVERLAY_SIZE_BUCKET * OVERLAY_SIZE_BUCKET,
+    )
+    height = max(
+        OVERLAY_SIZE_BUCKET,
+        int(image_height * MAX_CAPTION_HEIGHT_RATIO)
+        // OVERLAY_SIZE_BUCKET
+        * OVERLAY_SIZE_BUCKET,
+    )
+    layout = get_text_layout(text, width, height, font_path)
+    if not layout.lines:
+        return None
+
+    key = (text, width, layout.font_size, font_path)
+    if (overlay := caption_overlay_cache.get(key)) is None:
+        overlay = _draw_caption_overlay(layout, font_path, width)
+        caption_overlay_cache.set(key, overlay)
+    return overlay
+
+
+def render_meme_image(
+    template_content: bytes, top_text: str, bottom_text: str
+) -> bytes:
+    """
+    This function is used to composite the captions onto the normalized template
+    image and encode the result as JPEG. Captions are wrapped and scaled to fit the
+    top and the bottom of the image. It only depends on its arguments and the
+    settings, so that it can be executed in a separate process.
+    """
+    img = get_normalized_template_image(template_content).copy()
+    margin = max(1, img.width // 50)
+    font_path = get_font_path()
+
+    top_overlay = get_caption_overlay(top_text, img.width, img.height, font_path)
+    if top_overlay is not None:
+        img.paste(
+            top_overlay, ((img.width - top_overlay.width) // 2, margin), top_overlay
+        )
+
+    bottom_overlay = get_caption_overlay(bottom_text, img.width, img.height, font_path)
+    if bottom_overlay is not None:
+        img.paste(
+            bottom_overlay,
+            (
+                (img.width - bottom_overlay.width) // 2,
+                img.height - margin - bottom_overlay.height,
+            ),
+            bottom_overlay,
+        )
+
+    meme_img_io = BytesIO()
+    img.save(meme_img_io, format="JPEG")
+    return meme_img_io.getvalue()
+
+
+def render_image_variant(
+    image_content: bytes, max_width: Optional[int], save_options: dict[str, Any]
+) -> bytes:
+    """
+    This function is used to downscale an image to the maximum width and encode it with
+    the given options of Image.save. JPEG images are decoded at a reduced scale right
+    away, so a thumbnail doesn't require decoding the image at its full size.
+    """
+    img = Image.open(BytesIO(image_content))
+    if max_width is not None and img.width > max_width:
+        size = (max_width, img.height * max_width // img.width)
+        img.draft("RGB", size)
+        img.thumbnail(size, Image.Resampling.LANCZOS)
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGB")
+
+    variant_io = BytesIO()
+    img.save(variant_io, **save_options)
+    return variant_io.getvalue()
+
+
+class RenderEngine:
+    """
+    Renders meme images in a pool of worker processes, so that CPU-heavy renders don't
+    hold the GIL of the request worker. The number of jobs that are running or waiting
+    in the queue is bounded: when the queue is full, or when a job doesn't finish in
+    time, we raise a ServiceUnavailableError instead of piling up requests. A job that
+    doesn't finish in time can't be cancelled once it's running, so the pool is
+    recycled to free its worker and its slot. Setting the number of workers to 0
+    renders the images in the calling thread.
+    """
+
+    def __init__(
+        self,
+        *,
+        workers: Optional[int] = None,
+        queue_size: Optional[int] = None,
+        timeout: Optional[float] = None,
+    ):
+        self._workers = settings.RENDER_POOL_WORKERS if workers is None else workers
+        self._timeout = settings.RENDER_TIMEOUT_SECONDS if timeout is None else timeout
+        queue_size = settings.RENDER_QUEUE_SIZE if queue_size is None else queue_size
+        self._slots = threading.BoundedSemaphore(self._workers + queue_size)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """
+        The pool is created lazily with the spawn start method, because forking a
+        multithreaded server process with open database connections is not safe.
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self._workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._executor
+
+    def _reset_executor(self, executor: ProcessPoolExecutor) -> None:
+        """
+        This method is used to replace a pool that can't run jobs anymore. The workers
+        are terminated, so that a stuck job doesn't keep its process, and the pending
+        jobs fail with a BrokenProcessPool, which releases their slots. The next job
+        creates a new pool.
+        """
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        # The executor doesn't provide a public way to stop running jobs.
+        processes = list((executor._processes or {}).values())
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.terminate()
+
+    def run(self, function: Callable[..., bytes], *args: Any) -> bytes:
+        """
+        This method is used to run an image processing function in the pool. The
+        function and its arguments must be picklable.
+        """
+        if self._workers == 0:
+            return function(*args)
+
+        if not self._slots.acquire(blocking=False):
+            raise ServiceUnavailableError()
+        # The slot of a stuck job is released as soon as its pool is recycled, before
+        # the pool reports the job as failed, so it must only be released once.
+        slot = threading.Lock()
+
+        def release_slot(*_) -> None:
+            if slot.acquire(blocking=False):
+                self._slots.release()
+
+        try:
+            executor = self._get_executor()
+            future = executor.submit(function, *args)
+        except BrokenProcessPool:
+            release_slot()
+            self._reset_executor(executor)
+            raise ServiceUnavailableError()
+        except BaseException:
+            release_slot()
+            raise
+        future.add_done_callback(release_slot)
+
+        try:
+            return future.result(timeout=self._timeout)
+        except FutureTimeoutError:
+            if not future.cancel():
+                self._reset_executor(executor)
+                release_slot()
+            raise ServiceUnavailableError()
+        except BrokenProcessPool:
+            self._reset_executor(executor)
+            raise ServiceUnavailableError()
+
+    def render(self, template_content: bytes, top_text: str, bottom_text: str) -> bytes:
+        return self.run(render_meme_image, template_content, top_text, bottom_text)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+
+render_engine = RenderEngine()
+
+# Normalized template images and caption overlays are cached by every process that
+# renders memes.
+normalized_template_cache = MemoryLRUCache(
+    max_bytes=settings.NORMALIZED_TEMPLATE_CACHE_MAX_BYTES,
+    sizeof=lambda img: img.width * img.height * 3,
+)
+caption_overlay_cache = MemoryLRUCache(
+    max_bytes=settings.CAPTION_OVERLAY_CACHE_MAX_BYTES,
+    sizeof=lambda overlay: overlay.width * overlay.height * 4,
+)
+
+# Variants of meme images are only derived from the rendered images, so they can be
+# evicted and generated again at any time.
+image_variant_cache = DiskLRUCache(
+    directory=settings.IMAGE_VARIANTS_DIR, max_bytes=settings.IMAGE_VARIANTS_MAX_BYTES
+)
@@ -1,14 +1,31 @@
+from django.conf import settings
+from django.urls import reverse
+from rest_framework.exceptions import ValidationError
 from rest_framework.fields import (
     CharField,
     ChoiceField,
     DecimalField,
+    DictField,
     EmailField,
     IntegerField,
+    ListField,
     URLField,
 )
-from rest_framework.serializers import ModelSerializer, Serializer
+from rest_framework.serializers import (
+    ModelSerializer,
+    Serializer,
+    SerializerMethodField,
+)
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.serializers import (
+    TokenObtainPairSerializer,
+    TokenRefreshSerializer,
+)
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import Token
 from typing_extensions import Any
 
+from api.consts import IMAGE_VARIANT_FORMATS, IMAGE_VARIANT_SIZES
 from api.enums import Score
 from api.models import Meme, MemeTemplate, User
 from core.exceptions import BadRequestError
@@ -38,16 +55,41 @@ class ShortUserSerializer(ModelSerializer):
 class MemeTemplateSerializer(ModelSerializer):
     class Meta:
         model = MemeTemplate
-        fields = "__all__"
+        exclude = (
+            "status",
+            "content_length",
+            "width",
+            "height",
+            "last_checked_at",
+            "check_failures",
+            "next_check_at",
+        )
 
 
 class MemeSerializer(ModelSerializer):
     template = MemeTemplateSerializer()
     created_by = ShortUserSerializer()
+    images = SerializerMethodField()
 
     class Meta:
         model = Meme
-        fields = "__all__"
+        exclude = ("rating_count", "rating_sum", "average_score", "updated_at")
+
+    def get_images(self, meme: Meme) -> dict[str, dict[str, str]]:
+        """
+        This method is used to get the URLs of the image of the meme in every size and
+        format, so that clients can pick the smallest one that fits their needs.
+        """
+        url = reverse("meme_image", kwargs={"id": meme.id})
+        if (request := self.context.get("request")) is not None:
+            url = request.build_absolute_uri(url)
+        return {
+            size: {
+                image_format: f"{url}?size={size}&format={image_format}"
+                for image_format in IMAGE_VARIANT_FORMATS
+            }
+            for size in IMAGE_VARIANT_SIZES
+        }
 
 
 class RatedMemeSerializer(ModelSerializer):
@@ -71,18 +113,84 @@ class RatedMemeSerializer(ModelSerializer):
 class ShortMemeSerializer(ModelSerializer):
     class Meta:
         model = Meme
-        fields = "__all__"
+        exclude = ("rating_count", "rating_sum", "average_score", "updated_at")
 
 
 class CreateMemeSerializer(Serializer):
     template_id = IntegerField()
-    top_text = CharField(required=False)
-    bottom_text = CharField(required=False)
+    top_text = CharField(required=False, max_length=100)
+    bottom_text = CharField(required=False, max_length=100)
+
+
+def _validate_batch_size(items: list, max_size: int) -> list:
+    if len(items) > max_size:
+        raise ValidationError(
+            f"Ensure this field has no more than {max_size} elements."
+        )
+    return items
+
+
+class BatchCreateMemeSerializer(Serializer):
+    memes = ListField(child=DictField(), allow_empty=False)
+
+    def validate_memes(self, memes: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        return _validate_batch_size(memes, settings.MEMES_BATCH_MAX_SIZE)
 
 
 class RateMemeSerializer(Serializer):
     score = ChoiceField(choices=Score)
 
 
+class BatchRateMemeItemSerializer(RateMemeSerializer):
+    meme_id = IntegerField()
+
+
+class BatchRateMemeSerializer(Serializer):
+    ratings = ListField(child=DictField(), allow_empty=False)
+
+    def validate_ratings(self, ratings: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        return _validate_batch_size(ratings, settings.RATINGS_BATCH_MAX_SIZE)
+
+
 class SurpriseMemeSerializer(Serializer):
     url = URLField()
+
+
+def _set_user_claims(token: Token, user: User) -> None:
+    # The claims are used by the stateless authentication instead of the database.
+    token["is_staff"] = user.is_staff
+
+
+class TokenObtainPairWithClaimsSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user: User) -> Token:
+        token = super().get_token(user)
+        _set_user_claims(token, user)
+        return token
+
+
+class TokenRefreshWithClaimsSerializer(TokenRefreshSerializer):
+    def validate(self, attrs: dict[str, Any]) -> dict[str, str]:
+        """
+        The claims of the new access token are taken from the user rather than copied
+        from the refresh token, so that changes of the user since the login reach the
+        tokens, and tokens of deleted users can't be refreshed. The access token gets
+        a new issue time, so that it isn't mistaken for a revoked token.
+        """
+        refresh = self.token_class(attrs["refresh"])
+        user = User.objects.filter(
+            **{api_settings.USER_ID_FIELD: refresh[api_settings.USER_ID_CLAIM]}
+        ).first()
+        if user is None:
+            raise InvalidToken()
+        _set_user_claims(refresh, user)
+
+        access = refresh.access_token
+        access.set_iat()
+        data = {"access": str(access)}
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            data["refresh"] = str(refresh)
+        return data
@@ -1,17 +1,70 @@
+import asyncio
+import hashlib
+import itertools
+import json
 import random
-import uuid
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from dataclasses import asdict
-from io import BytesIO
+from datetime import datetime, timedelta
+from typing import Any, Iterable, Optional, Union
 
-import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.core.files.base import ContentFile
-from django.db.transaction import atomic
-from PIL import Image, ImageDraw, ImageFont
+from django.core.files.storage import default_storage
+from django.db.models import (
+    Avg,
+    Count,
+    F,
+    FloatField,
+    OuterRef,
+    Q,
+    Subquery,
+    Sum,
+    Value,
+)
+from django.db.models.functions import Cast, Coalesce
+from django.db.transaction import atomic, on_commit
+from django.utils import timezone
+from PIL import Image
 
-from api.consts import BOTTOM_TEXTS, TOP_TEXTS
+from api.consts import (
+    BOTTOM_TEXTS,
+    DEFAULT_IMAGE_VARIANT_FORMAT,
+    DEFAULT_IMAGE_VARIANT_SIZE,
+    IMAGE_VARIANT_FORMATS,
+    IMAGE_VARIANT_SIZES,
+    TOP_TEXTS,
+)
 from api.dto import MemeDTO, RateMemeDTO
-from api.models import Meme, MemeTemplate, Rating
-from core.exceptions import NotFoundError
+from api.enums import TemplateStatus
+from api.models import Meme, MemeTemplate, PrerenderedMeme, Rating
+from api.registry import template_registry
+from api.rendering import (
+    get_meme_image_name,
+    image_variant_cache,
+    open_template_image,
+    render_engine,
+    render_image_variant,
+)
+from api.template_cache import CachedTemplateImage, template_image_cache
+from core.concurrency import SingleFlight
+from core.exceptions import NotFoundError, ServiceUnavailableError
+
+
+def _fill_default_texts(meme_data: MemeDTO, template: MemeTemplate) -> MemeDTO:
+    top_text = meme_data.top_text if meme_data.top_text else template.default_top_text
+    bottom_text = (
+        meme_data.bottom_text if meme_data.bottom_text else template.default_bottom_text
+    )
+    return MemeDTO(
+        template_id=template.id,
+        created_by_id=meme_data.created_by_id,
+        top_text=top_text,
+        bottom_text=bottom_text,
+    )
 
 
 class CreateMemeService:
@@ -19,23 +72,8 @@ class CreateMemeService:
         self._meme_data = meme_data
 
     def _get_full_meme_data(self) -> MemeDTO:
-        template = MemeTemplate.objects.get_template_or_404(self._meme_data.template_id)
-        top_text = (
-            self._meme_data.top_text
-            if self._meme_data.top_text
-            else template.default_top_text
-        )
-        bottom_text = (
-            self._meme_data.bottom_text
-            if self._meme_data.bottom_text
-            else template.default_bottom_text
-        )
-        return MemeDTO(
-            template_id=template.id,
-            created_by_id=self._meme_data.created_by_id,
-            top_text=top_text,
-            bottom_text=bottom_text,
-        )
+        template = template_registry.get_or_404(self._meme_data.template_id)
+        return _fill_default_texts(self._meme_data, template)
 
     def _create_meme(self, full_meme_info: MemeDTO) -> int:
         return Meme.objects.create(**asdict(full_meme_info)).id
@@ -46,12 +84,84 @@ class CreateMemeService:
             return self._create_meme(full_meme_info)
 
 
+class BatchCreateMemeService:
+    """
+    Creates many memes at once. All the referenced templates are taken from the
+    template registry, and the memes are inserted with a single bulk insert. A meme
+    that references a missing template doesn't fail the whole batch, it gets an error
+    instead of an id.
+    """
+
+    def __init__(self, memes_data: list[MemeDTO]):
+        self._memes_data = memes_data
+
+    def _get_templates(self) -> dict[int, MemeTemplate]:
+        return template_registry.get_many(
+            {meme_data.template_id for meme_data in self._memes_data}
+        )
+
+    def execute(self) -> list[dict[str, Any]]:
+        templates = self._get_templates()
+        results: list[Union[Meme, dict[str, Any]]] = []
+        for meme_data in self._memes_data:
+            if (template := templates.get(meme_data.template_id)) is None:
+                results.append({"errors": {"template_id": ["Template not found."]}})
+                continue
+            results.append(Meme(**asdict(_fill_default_texts(meme_data, template))))
+
+        with atomic():
+            Meme.objects.bulk_create(
+                [result for result in results if isinstance(result, Meme)]
+            )
+            # The bulk insert doesn't send the post_save signals.
+            on_commit(Meme.objects.invalidate_list_version)
+        return [
+            {"meme_id": result.id} if isinstance(result, Meme) else result
+            for result in results
+        ]
+
+
+RATING_AGGREGATE_FIELDS = ("rating_count", "rating_sum", "average_score")
+
+
+def _apply_rating_to_meme(
+    meme: Meme, score: int, previous_score: Optional[int]
+) -> None:
+    """
+    This function is used to apply a rating to the aggregates of the meme. A new rating
+    increases the number of ratings, while a changed rating only replaces its previous
+    score in the sum. The meme must be locked by the caller.
+    """
+    if previous_score is None:
+        meme.rating_count += 1
+        meme.rating_sum += score
+    else:
+        meme.rating_sum += score - previous_score
+    meme.average_score = meme.rating_sum / meme.rating_count
+
+
 class RateMemeService:
     def __init__(self, rate_meme_info: RateMemeDTO):
         self._rate_meme_info = rate_meme_info
 
-    def _check_meme(self) -> None:
-        Meme.objects.get_meme_or_404(meme_id=self._rate_meme_info.meme_id)
+    def _lock_meme(self) -> Meme:
+        """
+        This method is used to lock the meme row until the end of the transaction, so
+        that concurrent ratings of the same meme update its aggregates one by one.
+        """
+        return Meme.objects.get_meme_for_update_or_404(
+            meme_id=self._rate_meme_info.meme_id
+        )
+
+    def _get_previous_score(self) -> Optional[int]:
+        return (
+            Rating.objects.filter(
+                meme_id=self._rate_meme_info.meme_id,
+                user_id=self._rate_meme_info.user_id,
+            )
+            .values_list("score", flat=True)
+            .first()
+        )
 
     def _update_or_create_rating(self) -> int:
         """
@@ -66,84 +176,589 @@ class RateMemeService:
         )
         return rating.id
 
+    def _update_meme_aggregates(
+        self, meme: Meme, previous_score: Optional[int]
+    ) -> None:
+        _apply_rating_to_meme(meme, self._rate_meme_info.score, previous_score)
+        meme.save(update_fields=RATING_AGGREGATE_FIELDS)
+
     def execute(self) -> int:
         with atomic():
-            self._check_meme()
-            return self._update_or_create_rating()
+            meme = self._lock_meme()
+            previous_score = self._get_previous_score()
+            rating_id = self._update_or_create_rating()
+            self._update_meme_aggregates(meme, previous_score)
+            return rating_id
+
+
+class BatchRateMemesService:
+    """
+    Rates many memes on behalf of a user at once. The memes are checked and locked with
+    a single query, the ratings are written with a single INSERT ... ON CONFLICT DO
+    UPDATE, and the aggregates of the memes are updated with a single bulk update, so
+    the number of queries doesn't depend on the size of the batch. If a meme is rated
+    several times in the batch, the last score wins.
+    """
+
+    def __init__(self, user_id: int, ratings: list[RateMemeDTO]):
+        self._user_id = user_id
+        self._ratings = ratings
+
+    def _lock_memes(self, meme_ids: Iterable[int]) -> dict[int, Meme]:
+        # The rows are locked in the order of their ids to avoid deadlocks with other
+        # batches rating the same memes.
+        return {
+            meme.id: meme
+            for meme in Meme.objects.select_for_update()
+            .filter(id__in=meme_ids)
+            .order_by("id")
+        }
+
+    def _get_previous_scores(self, meme_ids: Iterable[int]) -> dict[int, int]:
+        return dict(
+            Rating.objects.filter(
+                user_id=self._user_id, meme_id__in=meme_ids
+            ).values_list("meme_id", "score")
+        )
+
+    def _upsert_ratings(self, scores: dict[int, int]) -> None:
+        Rating.objects.bulk_create(
+            [
+                Rating(meme_id=meme_id, user_id=self._user_id, score=score)
+                for meme_id, score in scores.items()
+            ],
+            update_conflicts=True,
+            unique_fields=("meme", "user"),
+            update_fields=("score",),
+        )
+
+    def execute(self) -> list[dict[str, Any]]:
+        scores = {rating.meme_id: rating.score for rating in self._ratings}
+        with atomic():
+            memes = self._lock_memes(scores)
+            scores = {meme_id: scores[meme_id] for meme_id in memes}
+            previous_scores = self._get_previous_scores(memes)
+            self._upsert_ratings(scores)
+            for meme_id, meme in memes.items():
+                _apply_rating_to_meme(
+                    meme, scores[meme_id], previous_scores.get(meme_id)
+                )
+            Meme.objects.bulk_update(memes.values(), fields=RATING_AGGREGATE_FIELDS)
+
+        results = []
+        for rating in self._ratings:
+            if rating.meme_id not in memes:
+                outcome = "not_found"
+            elif rating.meme_id in previous_scores:
+                outcome = "updated"
+            else:
+                outcome = "created"
+            results.append({"meme_id": rating.meme_id, "status": outcome})
+        return results
+
+
+class ReconcileRatingAggregatesService:
+    """
+    Recomputes the rating aggregates of the memes from the ratings table and fixes the
+    memes whose aggregates have drifted, e.g. because ratings were changed bypassing
+    the rating services.
+    """
+
+    def _get_actual_aggregates(self) -> dict[str, Coalesce]:
+        ratings = Rating.objects.filter(meme_id=OuterRef("id")).values("meme_id")
+        return {
+            "actual_count": Coalesce(
+                Subquery(ratings.annotate(value=Count("id")).values("value")),
+                Value(0),
+            ),
+            "actual_sum": Coalesce(
+                Subquery(ratings.annotate(value=Sum("score")).values("value")),
+                Value(0),
+            ),
+            "actual_average": Coalesce(
+                Subquery(
+                    ratings.annotate(value=Cast(Avg("score"), FloatField())).values(
+                        "value"
+                    )
+                ),
+                Value(0.0),
+            ),
+        }
+
+    def execute(self) -> int:
+        aggregates = self._get_actual_aggregates()
+        drifted_memes = (
+            Meme.objects.annotate(**aggregates)
+            .exclude(
+                rating_count=F("actual_count"),
+                rating_sum=F("actual_sum"),
+                average_score=F("actual_average"),
+            )
+            .values("id")
+        )
+        with atomic():
+            return Meme.objects.filter(id__in=drifted_memes).update(
+                rating_count=aggregates["actual_count"],
+                rating_sum=aggregates["actual_sum"],
+                average_score=aggregates["actual_average"],
+            )
+
+
+class RenderMemeImageService:
+    """
+    Renders a meme image and stores it under a content key derived from the template
+    image, the texts and the render parameters. If the same meme has already been
+    rendered, the stored file is reused and nothing is rendered at all.
+    """
+
+    def __init__(
+        self, template_image: CachedTemplateImage, top_text: str, bottom_text: str
+    ):
+        self._template_image = template_image
+        self._top_text = top_text
+        self._bottom_text = bottom_text
+
+    def _construct_meme_image(self) -> ContentFile:
+        return ContentFile(
+            render_engine.render(
+                self._template_image.content, self._top_text, self._bottom_text
+            )
+        )
+
+    def execute(self) -> str:
+        image_name = get_meme_image_name(
+            self._template_image.digest, self._top_text, self._bottom_text
+        )
+        if default_storage.exists(image_name):
+            return image_name
+
+        saved_name = default_storage.save(image_name, self._construct_meme_image())
+        if saved_name != image_name:
+            # Another request has stored the same image while we were rendering it.
+            default_storage.delete(saved_name)
+        return image_name
+
+
+class MemeImageService:
+    """
+    Returns the image of a meme, rendering it on the first access. Concurrent first
+    requests for the same meme are coalesced within a process by a single flight. The
+    image is rendered outside of any transaction, and the meme row is only locked
+    briefly to set the image if it's still empty. Processes that render the same meme
+    concurrently produce the same file, since it's stored under a content key, and
+    the first one to set it wins.
+    """
+
+    _single_flight = SingleFlight()
+
+    def __init__(self, meme_id: int):
+        self._meme_id = meme_id
+
+    def _read_template_file(self, meme: Meme) -> CachedTemplateImage:
+        template = template_registry.get_or_404(meme.template_id)
+        if (template_image := template_image_cache.get(template)) is None:
+            raise ServiceUnavailableError()
+        return template_image
+
+    def _render_image(self, meme: Meme) -> str:
+        image_name = RenderMemeImageService(
+            self._read_template_file(meme), meme.top_text, meme.bottom_text
+        ).execute()
+        with atomic():
+            meme = Meme.objects.get_meme_for_update_or_404(self._meme_id)
+            if meme.image:
+                return meme.image.name
+            meme.image = image_name
+            meme.save(update_fields=("image", "updated_at"))
+            return meme.image.name
+
+    def execute(self) -> str:
+        meme = Meme.objects.get_meme_or_404(self._meme_id)
+        if meme.image:
+            return meme.image.name
+        return self._single_flight.do(self._meme_id, lambda: self._render_image(meme))
+
+
+class MemeImageVariantService:
+    """
+    Returns an image of a meme in the given size and format. Variants are generated
+    from the rendered image of the meme on the first access and cached on disk. The
+    key of a variant includes the name of the rendered image, which changes whenever
+    the image does, so variants never have to be invalidated.
+    """
+
+    _single_flight = SingleFlight()
+
+    def __init__(self, meme_id: int, size: str, image_format: str):
+        self._meme_id = meme_id
+        self._max_width = IMAGE_VARIANT_SIZES[size]
+        self._content_type = IMAGE_VARIANT_FORMATS[image_format]["content_type"]
+        self._save_options = IMAGE_VARIANT_FORMATS[image_format]["save_options"]
+        self._is_original = (
+            size == DEFAULT_IMAGE_VARIANT_SIZE
+            and image_format == DEFAULT_IMAGE_VARIANT_FORMAT
+        )
+
+    def _get_key(self, image_name: str) -> str:
+        return hashlib.sha256(
+            json.dumps([image_name, self._max_width, self._save_options]).encode()
+        ).hexdigest()
+
+    def _render_variant(self, image_name: str, key: str) -> bytes:
+        with default_storage.open(image_name, "rb") as image_file:
+            image_content = image_file.read()
+        content = render_engine.run(
+            render_image_variant, image_content, self._max_width, self._save_options
+        )
+        image_variant_cache.set(key, content)
+        return content
+
+    def execute(self) -> tuple[bytes, str]:
+        image_name = MemeImageService(self._meme_id).execute()
+        if self._is_original:
+            with default_storage.open(image_name, "rb") as image_file:
+                return image_file.read(), self._content_type
+
+        key = self._get_key(image_name)
+        if (content := image_variant_cache.get(key)) is None:
+            content = self._single_flight.do(
+                key, lambda: self._render_variant(image_name, key)
+            )
+        return content, self._content_type
 
 
 class SurpriseMeMemeService:
+    # Cold template images are downloaded by a pool of threads shared by all requests.
+    _fetch_executor = ThreadPoolExecutor(
+        max_workers=settings.SURPRISE_FETCH_WORKERS,
+        thread_name_prefix="surprise-fetch",
+    )
+
     def __init__(self, user_id: int):
         self._user_id = user_id
         self._top_text = random.choice(TOP_TEXTS)
         self._bottom_text = random.choice(BOTTOM_TEXTS)
 
-    def _read_template_file(self) -> tuple[MemeTemplate, BytesIO]:
+    def _race_template_files(
+        self, templates: list[MemeTemplate]
+    ) -> tuple[MemeTemplate, CachedTemplateImage]:
+        """
+        This method is used to download the images of the first few templates at the
+        same time and take the first one that succeeds. Whenever a download fails, the
+        next template takes its place, so that the number of downloads in flight stays
+        the same. The total time is bounded by a deadline, and once we have an image,
+        the downloads that are still in flight are cancelled.
+        """
+        deadline = time.monotonic() + settings.SURPRISE_FETCH_DEADLINE_SECONDS
+        cancelled = threading.Event()
+        remaining = iter(templates)
+        pending: dict[Future, MemeTemplate] = {}
+
+        def submit_next() -> None:
+            if (template := next(remaining, None)) is not None:
+                future = self._fetch_executor.submit(
+                    template_image_cache.get, template, cancelled
+                )
+                pending[future] = template
+
+        for _ in range(settings.SURPRISE_FETCH_RACE_SIZE):
+            submit_next()
+        try:
+            while pending:
+                if (timeout := deadline - time.monotonic()) <= 0:
+                    raise ServiceUnavailableError()
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    template = pending.pop(future)
+                    if future.exception() is None and future.result() is not None:
+                        return template, future.result()
+                    submit_next()
+        finally:
+            cancelled.set()
+            for future in pending:
+                future.cancel()
+        raise NotFoundError()
+
+    def _read_template_file(self) -> tuple[MemeTemplate, CachedTemplateImage]:
         """
-        This method is used to get a random meme template from the database and read
-        the image file from the URL. If the image file from the template's URL is not
-        found, we iterate over the templates until we find a valid image file. If no
-        valid image file is found, we raise a NotFoundError.
+        This method is used to get a random meme template from the registry and read
+        its image file. At first, we look for a template whose image is already in the
+        cache, so that a warm request doesn't touch the network at all. Otherwise, we
+        race the downloads of the images of several templates. If no valid image file
+        is found, we raise a NotFoundError.
         """
-        templates = list(MemeTemplate.objects.get_random_order_templates())
+        templates = template_registry.get_random_order_templates()
+        if (found := self._find_cached_template_file(templates)) is not None:
+            return found
+        return self._race_template_files(templates)
+
+    @staticmethod
+    def _find_cached_template_file(
+        templates: list[MemeTemplate],
+    ) -> Optional[tuple[MemeTemplate, CachedTemplateImage]]:
         for template in templates:
-            response = requests.get(template.image_url)
-            if response.status_code == 200:
-                return template, BytesIO(response.content)
+            if (
+                template_image := template_image_cache.get_cached(template)
+            ) is not None:
+                return template, template_image
+        return None
+
+    async def _arace_template_files(
+        self, templates: list[MemeTemplate]
+    ) -> tuple[MemeTemplate, CachedTemplateImage]:
+        """
+        This method is the asynchronous counterpart of _race_template_files. The
+        downloads are tasks of the event loop instead of jobs of the thread pool, and
+        the ones that are still in flight when we have an image are cancelled.
+        """
+        remaining = iter(templates)
+        pending: dict[asyncio.Task, MemeTemplate] = {}
+
+        def start_next() -> None:
+            if (template := next(remaining, None)) is not None:
+                task = asyncio.create_task(template_image_cache.aget(template))
+                pending[task] = template
+
+        for _ in range(settings.SURPRISE_FETCH_RACE_SIZE):
+            start_next()
+        try:
+            async with asyncio.timeout(settings.SURPRISE_FETCH_DEADLINE_SECONDS):
+                while pending:
+                    done, _ = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for task in done:
+                        template = pending.pop(task)
+                        if task.exception() is None and task.result() is not None:
+                            return template, task.result()
+                        start_next()
+        except TimeoutError:
+            raise ServiceUnavailableError()
+        finally:
+            for task in pending:
+                task.cancel()
         raise NotFoundError()
 
-    def _get_width_height(
-        self, text: str, draw: ImageDraw, font: ImageFont
-    ) -> tuple[int, int]:
-        left, top, right, bottom = draw.textbbox((0, 0), text, font=font)
-        return abs(right - left), abs(bottom - top)
-
-    def _construct_meme_image(self, meme_template_io: BytesIO) -> ContentFile:
-        img = Image.open(meme_template_io)
-        draw = ImageDraw.Draw(img)
-        font = ImageFont.load_default()
-
-        text_width, text_height = self._get_width_height(self._top_text, draw, font)
-        top_position = ((img.width - text_width) / 2, 0)
-        draw.text(
-            top_position,
-            self._top_text,
-            fill="white",
-            font=font,
-            stroke_width=2,
-            stroke_fill="black",
-        )
-
-        text_width, text_height = self._get_width_height(self._bottom_text, draw, font)
-        bottom_position = ((img.width - text_width) / 2, img.height - text_height)
-        draw.text(
-            bottom_position,
-            self._bottom_text,
-            fill="white",
-            font=font,
-            stroke_width=2,
-            stroke_fill="black",
-        )
-
-        meme_img_io = BytesIO()
-        img.save(meme_img_io, format="JPEG")
-        return ContentFile(meme_img_io.getvalue())
-
-    def _create_meme(
-        self, template: MemeTemplate, meme_image: ContentFile
-    ) -> dict[str, str]:
-        meme = Meme(
+    def _create_meme(self, template: MemeTemplate, image_name: str) -> dict[str, str]:
+        meme = Meme.objects.create(
             template=template,
             created_by_id=self._user_id,
             top_text=self._top_text,
             bottom_text=self._bottom_text,
+            image=image_name,
+        )
+        return {"url": meme.image.url}
+
+    def _create_meme_from_pool(self) -> Optional[dict[str, str]]:
+        """
+        This method is used to create a meme from an image that has been rendered in
+        advance. The image file is handed over to the new meme, so the only work left
+        is a couple of queries. If the pool is empty, we return None.
+        """
+        if not (prerendered_meme := PrerenderedMeme.objects.pop()):
+            return None
+        meme = Meme.objects.create(
+            template_id=prerendered_meme.template_id,
+            created_by_id=self._user_id,
+            top_text=prerendered_meme.top_text,
+            bottom_text=prerendered_meme.bottom_text,
+            image=prerendered_meme.image.name,
         )
-        file_name = f"{template.name}_{uuid.uuid4()}.jpeg"
-        meme.image.save(file_name, meme_image)
+        prerendered_meme.delete()
         return {"url": meme.image.url}
 
+    def _take_from_pool(self) -> Optional[dict[str, str]]:
+        with atomic():
+            return self._create_meme_from_pool()
+
     def execute(self) -> dict[str, str]:
+        if meme_data := self._take_from_pool():
+            return meme_data
+        if not settings.SURPRISE_POOL_INLINE_FALLBACK:
+            raise ServiceUnavailableError()
+
+        template, template_image = self._read_template_file()
+        image_name = RenderMemeImageService(
+            template_image, self._top_text, self._bottom_text
+        ).execute()
         with atomic():
-            template, template_io = self._read_template_file()
-            meme_image = self._construct_meme_image(template_io)
-            return self._create_meme(template, meme_image)
+            return self._create_meme(template, image_name)
+
+    async def aexecute(self) -> dict[str, str]:
+        """
+        This method is the asynchronous counterpart of execute. Taking a meme from the
+        pool needs a transaction, which the async ORM doesn't support, so it runs in a
+        thread, and so do the reads of the cache and the rendering. Template images
+        are downloaded in the event loop.
+        """
+        if meme_data := await sync_to_async(self._take_from_pool)():
+            return meme_data
+        if not settings.SURPRISE_POOL_INLINE_FALLBACK:
+            raise ServiceUnavailableError()
+
+        templates = await sync_to_async(template_registry.get_random_order_templates)()
+        found = await sync_to_async(
+            self._find_cached_template_file, thread_sensitive=False
+        )(templates)
+        template, template_image = found or await self._arace_template_files(templates)
+        image_name = await sync_to_async(
+            RenderMemeImageService(
+                template_image, self._top_text, self._bottom_text
+            ).execute,
+            thread_sensitive=False,
+        )()
+        meme = await Meme.objects.acreate(
+            template=template,
+            created_by_id=self._user_id,
+            top_text=self._top_text,
+            bottom_text=self._bottom_text,
+            image=image_name,
+        )
+        return {"url": meme.image.url}
+
+
+class RefillSurprisePoolService:
+    """
+    Keeps a pool of prerendered memes for every template, which is used by the
+    surprise-me feature. When the number of prerendered memes of a template drops
+    below the low watermark, the pool of the template is refilled up to its full size.
+    """
+
+    def __init__(
+        self,
+        pool_size: Optional[int] = None,
+        low_watermark: Optional[int] = None,
+    ):
+        self._pool_size = (
+            settings.SURPRISE_POOL_SIZE if pool_size is None else pool_size
+        )
+        self._low_watermark = (
+            settings.SURPRISE_POOL_LOW_WATERMARK
+            if low_watermark is None
+            else low_watermark
+        )
+
+    def _get_text_combinations(
+        self, template: MemeTemplate, count: int
+    ) -> list[tuple[str, str]]:
+        """
+        This method is used to pick text combinations for a template, preferring the
+        ones that are not in the pool yet, so that the pool stays diverse.
+        """
+        pooled = set(
+            PrerenderedMeme.objects.filter(template=template).values_list(
+                "top_text", "bottom_text"
+            )
+        )
+        combinations = list(itertools.product(TOP_TEXTS, BOTTOM_TEXTS))
+        random.shuffle(combinations)
+        combinations.sort(key=lambda combination: combination in pooled)
+        return list(itertools.islice(itertools.cycle(combinations), count))
+
+    def _refill_template(self, template: MemeTemplate, count: int) -> int:
+        if (template_image := template_image_cache.get(template)) is None:
+            return 0
+        for top_text, bottom_text in self._get_text_combinations(template, count):
+            image_name = RenderMemeImageService(
+                template_image, top_text, bottom_text
+            ).execute()
+            PrerenderedMeme.objects.create(
+                template=template,
+                top_text=top_text,
+                bottom_text=bottom_text,
+                image=image_name,
+            )
+        return count
+
+    def execute(self) -> int:
+        counts = PrerenderedMeme.objects.count_by_template()
+        rendered = 0
+        for template in template_registry.all():
+            count = counts.get(template.id, 0)
+            if count < self._low_watermark:
+                rendered += self._refill_template(template, self._pool_size - count)
+        return rendered
+
+
+class CheckTemplatesService:
+    """
+    Probes the images of the templates that are due for a check and records their
+    health, so that requests don't discover dead images by trying them one by one.
+    The images are probed concurrently, and probing also keeps the template image
+    cache warm. A healthy template is checked again after the check interval, while
+    a failing one is retried with an exponential backoff.
+    """
+
+    def __init__(self, concurrency: Optional[int] = None, check_all: bool = False):
+        self._concurrency = (
+            settings.TEMPLATE_CHECK_CONCURRENCY if concurrency is None else concurrency
+        )
+        self._check_all = check_all
+
+    def _get_due_templates(self, now: datetime) -> list[MemeTemplate]:
+        templates = MemeTemplate.objects.order_by("id")
+        if not self._check_all:
+            templates = templates.filter(
+                Q(next_check_at__isnull=True) | Q(next_check_at__lte=now)
+            )
+        return list(templates)
+
+    @staticmethod
+    def _probe(template: MemeTemplate) -> Optional[tuple[int, int, int]]:
+        """
+        This method is used to download (or revalidate) the image of the template and
+        read its size from the header. It returns the content length and the
+        dimensions of the image, or None if the image is not available.
+        """
+        if (template_image := template_image_cache.refresh(template)) is None:
+            return None
+        try:
+            img = open_template_image(template_image.content)
+        except (Image.DecompressionBombError, OSError):
+            return None
+        return len(template_image.content), img.width, img.height
+
+    @staticmethod
+    def _get_backoff(failures: int) -> timedelta:
+        seconds = settings.TEMPLATE_CHECK_BACKOFF_BASE_SECONDS * 2 ** (failures - 1)
+        return timedelta(
+            seconds=min(seconds, settings.TEMPLATE_CHECK_BACKOFF_MAX_SECONDS)
+        )
+
+    def _record_result(
+        self,
+        template: MemeTemplate,
+        result: Optional[tuple[int, int, int]],
+        now: datetime,
+    ) -> None:
+        template.last_checked_at = now
+        if result is None:
+            template.status = TemplateStatus.UNHEALTHY
+            template.check_failures += 1
+            template.next_check_at = now + self._get_backoff(template.check_failures)
+        else:
+            template.status = TemplateStatus.HEALTHY
+            template.content_length, template.width, template.height = result
+            template.check_failures = 0
+            template.next_check_at = now + timedelta(
+                seconds=settings.TEMPLATE_CHECK_INTERVAL_SECONDS
+            )
+
+    def execute(self) -> dict[str, int]:
+        now = timezone.now()
+        templates = self._get_due_templates(now)
+        with ThreadPoolExecutor(max_workers=max(1, self._concurrency)) as executor:
+            results = list(executor.map(self._probe, templates))
+
+        statuses = {template.id: template.status for template in templates}
+        for template, result in zip(templates, results):
+            self._record_result(template, result, now)
+        MemeTemplate.objects.bulk_update(templates, fields=MemeTemplate.HEALTH_FIELDS)
+        if any(template.status != statuses[template.id] for template in templates):
+            # Bulk updates don't send signals, so the registry is invalidated here.
+            template_registry.invalidate()
+
+        return {
+            status: sum(template.status == status for template in templates)
+            for status in (TemplateStatus.HEALTHY, TemplateStatus.UNHEALTHY)
+        }
@@ -0,0 +1,60 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from api.authentication import revoke_user_tokens
+from api.models import Meme, MemeTemplate, User
+from api.registry import template_registry
+from api.serializers import MemeSerializer, MemeTemplateSerializer
+
+HIDDEN_MEME_FIELDS = frozenset(MemeSerializer.Meta.exclude)
+HIDDEN_TEMPLATE_FIELDS = frozenset(MemeTemplateSerializer.Meta.exclude)
+
+
+@receiver(post_save, sender=MemeTemplate)
+@receiver(post_delete, sender=MemeTemplate)
+def invalidate_template_registry(sender, **kwargs):
+    transaction.on_commit(template_registry.invalidate)
+
+
+def _is_last_login_update(**kwargs) -> bool:
+    return kwargs.get("update_fields") == frozenset({"last_login"})
+
+
+@receiver(post_save, sender=Meme)
+@receiver(post_delete, sender=Meme)
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+@receiver(post_save, sender=MemeTemplate)
+@receiver(post_delete, sender=MemeTemplate)
+def invalidate_memes_list_version(sender, created=False, **kwargs):
+    """
+    The memes list shows the authors and the templates of the memes, so a change of
+    a user or a template changes the list as well. New users and templates don't have
+    memes yet, and neither the rating aggregates of a meme nor the health of a
+    template are shown in the list.
+    """
+    if sender in (User, MemeTemplate) and created:
+        return
+    if sender is User and _is_last_login_update(**kwargs):
+        return
+    update_fields = kwargs.get("update_fields")
+    hidden_fields = {Meme: HIDDEN_MEME_FIELDS, MemeTemplate: HIDDEN_TEMPLATE_FIELDS}
+    if update_fields and update_fields <= hidden_fields.get(sender, frozenset()):
+        return
+    transaction.on_commit(Meme.objects.invalidate_list_version)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def revoke_changed_user_tokens(sender, instance, created=False, **kwargs):
+    """
+    The tokens of a user carry its claims, so they are revoked whenever the user is
+    changed or deleted. Logging into the admin site only updates the last login, which
+    doesn't affect the claims.
+    """
+    if created or _is_last_login_update(**kwargs):
+        return
+    transaction.on_commit(partial(revoke_user_tokens, instance.id))
@@ -0,0 +1,280 @@
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from dataclasses import asdict, dataclass
+from functools import cached_property
+from pathlib import Path
+from typing import Optional
+
+from django.conf import settings
+from PIL import Image
+
+from api.models import MemeTemplate
+from api.rendering import open_template_image
+from core.cache import DiskLRUCache, MemoryLRUCache
+from core.http import AsyncHttpFetcher, FetchError, FetchResponse, HttpFetcher
+
+# Statuses that tell that the image of a template is gone. Other errors may be
+# temporary, so the cached copy of the image is kept.
+GONE_STATUS_CODES = frozenset({404, 410})
+
+# Images of templates are downloaded from arbitrary hosts, so every request is bounded
+# in time and size, and connections to the hosts are reused.
+template_fetcher = HttpFetcher(
+    connect_timeout=settings.OUTBOUND_HTTP_CONNECT_TIMEOUT_SECONDS,
+    read_timeout=settings.OUTBOUND_HTTP_READ_TIMEOUT_SECONDS,
+    total_timeout=settings.OUTBOUND_HTTP_TOTAL_TIMEOUT_SECONDS,
+    max_bytes=settings.OUTBOUND_HTTP_MAX_RESPONSE_BYTES,
+    pool_maxsize=settings.OUTBOUND_HTTP_POOL_MAXSIZE,
+    failure_threshold=settings.OUTBOUND_HTTP_CIRCUIT_FAILURE_THRESHOLD,
+    reset_timeout=settings.OUTBOUND_HTTP_CIRCUIT_RESET_SECONDS,
+)
+# The asynchronous views download template images with their own client, which shares
+# the circuit breaker and the metrics with the synchronous one.
+async_template_fetcher = AsyncHttpFetcher(
+    connect_timeout=settings.OUTBOUND_HTTP_CONNECT_TIMEOUT_SECONDS,
+    read_timeout=settings.OUTBOUND_HTTP_READ_TIMEOUT_SECONDS,
+    total_timeout=settings.OUTBOUND_HTTP_TOTAL_TIMEOUT_SECONDS,
+    max_bytes=settings.OUTBOUND_HTTP_MAX_RESPONSE_BYTES,
+    pool_maxsize=settings.OUTBOUND_HTTP_POOL_MAXSIZE,
+    failure_threshold=settings.OUTBOUND_HTTP_CIRCUIT_FAILURE_THRESHOLD,
+    reset_timeout=settings.OUTBOUND_HTTP_CIRCUIT_RESET_SECONDS,
+    shared_with=template_fetcher,
+)
+
+
+@dataclass
+class CachedTemplateImage:
+    content: bytes
+    fetched_at: float
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+    @cached_property
+    def digest(self) -> str:
+        return hashlib.sha256(self.content).hexdigest()
+
+    def to_bytes(self) -> bytes:
+        meta = asdict(self)
+        del meta["content"]
+        header = json.dumps(meta).encode()
+        return len(header).to_bytes(4, "big") + header + self.content
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "CachedTemplateImage":
+        header_length = int.from_bytes(data[:4], "big")
+        meta = json.loads(data[4 : 4 + header_length])
+        return cls(content=data[4 + header_length :], **meta)
+
+
+class TemplateImageCache:
+    """
+    Two-tier cache for the images of meme templates. The first tier is an in-process
+    LRU cache, the second one is an on-disk LRU cache shared by all the workers of the
+    host. Entries are keyed by the template id and its URL, so changing the URL of a
+    template invalidates its image. When an entry is older than the TTL, it is
+    revalidated with a conditional request using its ETag and Last-Modified values.
+    """
+
+    def __init__(
+        self,
+        *,
+        ttl: Optional[int] = None,
+        memory_max_bytes: Optional[int] = None,
+        disk_directory: Optional[Path] = None,
+        disk_max_bytes: Optional[int] = None,
+        fetcher: Optional[HttpFetcher] = None,
+        async_fetcher: Optional[AsyncHttpFetcher] = None,
+    ):
+        self._fetcher = fetcher or template_fetcher
+        self._async_fetcher = async_fetcher or async_template_fetcher
+        self._ttl = settings.TEMPLATE_CACHE_TTL_SECONDS if ttl is None else ttl
+        self._memory = MemoryLRUCache(
+            max_bytes=memory_max_bytes or settings.TEMPLATE_CACHE_MEMORY_MAX_BYTES,
+            sizeof=lambda entry: len(entry.content),
+        )
+        self._disk = DiskLRUCache(
+            directory=disk_directory or settings.TEMPLATE_CACHE_DIR,
+            max_bytes=disk_max_bytes or settings.TEMPLATE_CACHE_DISK_MAX_BYTES,
+        )
+
+    @staticmethod
+    def _get_key(template: MemeTemplate) -> str:
+        return hashlib.sha256(
+            f"{template.id}:{template.image_url}".encode()
+        ).hexdigest()
+
+    def _is_fresh(self, entry: CachedTemplateImage) -> bool:
+        return time.time() - entry.fetched_at < self._ttl
+
+    def _load(self, key: str) -> Optional[CachedTemplateImage]:
+        if (entry := self._memory.get(key)) is not None:
+            return entry
+        if (data := self._disk.get(key)) is None:
+            return None
+        entry = CachedTemplateImage.from_bytes(data)
+        self._memory.set(key, entry)
+        return entry
+
+    def _store(self, key: str, entry: CachedTemplateImage) -> None:
+        self._memory.set(key, entry)
+        self._disk.set(key, entry.to_bytes())
+
+    def _discard(self, key: str) -> None:
+        self._memory.delete(key)
+        self._disk.delete(key)
+
+    @staticmethod
+    def _is_valid_image(content: bytes) -> bool:
+        """
+        This method is used to check that the downloaded file is an image which is
+        small enough to be rendered. Only the header of the image is parsed.
+        """
+        try:
+            open_template_image(content)
+        except (Image.DecompressionBombError, OSError):
+            return False
+        return True
+
+    @staticmethod
+    def _get_request_headers(entry: Optional[CachedTemplateImage]) -> dict[str, str]:
+        headers = {}
+        if entry is not None and entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry is not None and entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+        return headers
+
+    def _get_new_entry(
+        self, entry: Optional[CachedTemplateImage], response: FetchResponse
+    ) -> Optional[CachedTemplateImage]:
+        """
+        This method is used to build the entry of the template from the response of
+        its host. It returns None when the image is gone or isn't a valid image, and
+        raises a FetchError when the host failed to answer, e.g. with a 5xx status.
+        """
+        if response.status_code == 304 and entry is not None:
+            return CachedTemplateImage(
+                content=entry.content,
+                fetched_at=time.time(),
+                etag=response.headers.get("ETag", entry.etag),
+                last_modified=response.headers.get(
+                    "Last-Modified", entry.last_modified
+                ),
+            )
+        if response.status_code == 200:
+            if not self._is_valid_image(response.content):
+                return None
+            return CachedTemplateImage(
+                content=response.content,
+                fetched_at=time.time(),
+                etag=response.headers.get("ETag"),
+                last_modified=response.headers.get("Last-Modified"),
+            )
+        if response.status_code in GONE_STATUS_CODES:
+            return None
+        raise FetchError(f"Unexpected status {response.status_code}.")
+
+    def _fetch(
+        self,
+        template: MemeTemplate,
+        entry: Optional[CachedTemplateImage],
+        cancelled: Optional[threading.Event] = None,
+    ) -> Optional[CachedTemplateImage]:
+        """
+        This method is used to download the image of the template. If we have a stale
+        entry, we send a conditional request, and the host can answer with 304 Not
+        Modified instead of sending the whole image again. A FetchError is raised when
+        the host can't be reached (or its circuit is open) or fails to answer.
+        """
+        response = self._fetcher.get(
+            template.image_url,
+            headers=self._get_request_headers(entry),
+            cancelled=cancelled,
+        )
+        return self._get_new_entry(entry, response)
+
+    def _save(
+        self,
+        key: str,
+        entry: Optional[CachedTemplateImage],
+        new_entry: Optional[CachedTemplateImage],
+    ) -> Optional[CachedTemplateImage]:
+        if new_entry is None:
+            self._discard(key)
+        elif new_entry is not entry:
+            self._store(key, new_entry)
+        return new_entry
+
+    def get_cached(self, template: MemeTemplate) -> Optional[CachedTemplateImage]:
+        """
+        This method is used to get the image of the template only if we have a fresh
+        copy of it, without making any network requests.
+        """
+        entry = self._load(self._get_key(template))
+        if entry is not None and self._is_fresh(entry):
+            return entry
+        return None
+
+    def _update(
+        self,
+        template: MemeTemplate,
+        serve_stale: bool,
+        cancelled: Optional[threading.Event] = None,
+    ) -> Optional[CachedTemplateImage]:
+        key = self._get_key(template)
+        entry = self._load(key)
+        if serve_stale and entry is not None and self._is_fresh(entry):
+            return entry
+
+        try:
+            new_entry = self._fetch(template, entry, cancelled)
+        except FetchError:
+            # The stale entry is kept, and served unless the caller asked for a fresh
+            # one, until the host tells that the image is gone.
+            return entry if serve_stale else None
+        return self._save(key, entry, new_entry)
+
+    def get(
+        self, template: MemeTemplate, cancelled: Optional[threading.Event] = None
+    ) -> Optional[CachedTemplateImage]:
+        return self._update(template, serve_stale=True, cancelled=cancelled)
+
+    def refresh(self, template: MemeTemplate) -> Optional[CachedTemplateImage]:
+        """
+        This method is used to revalidate the image of the template no matter how old
+        the cached copy is. Unlike get, it returns None when the host can't be reached
+        or fails to answer, so it tells whether the image is available right now. The
+        cached copy is only discarded when the image is gone.
+        """
+        return self._update(template, serve_stale=False)
+
+    async def aget(self, template: MemeTemplate) -> Optional[CachedTemplateImage]:
+        """
+        This method is used to get the image of the template like get does, but the
+        image is downloaded by the asynchronous fetcher, and the disk reads and writes
+        are done in a thread, so the event loop is never blocked by the network or the
+        disk. Images that are in memory are returned without a thread switch.
+        """
+        key = self._get_key(template)
+        if (entry := self._memory.get(key)) is None:
+            entry = await asyncio.to_thread(self._load, key)
+        if entry is not None and self._is_fresh(entry):
+            return entry
+
+        try:
+            response = await self._async_fetcher.get(
+                template.image_url, headers=self._get_request_headers(entry)
+            )
+            new_entry = self._get_new_entry(entry, response)
+        except FetchError:
+            return entry
+        return await asyncio.to_thread(self._save, key, entry, new_entry)
+
+    def invalidate(self, template: MemeTemplate) -> None:
+        self._discard(self._get_key(template))
+
+
+template_image_cache = TemplateImageCache()
@@ -1,13 +1,84 @@
-from django.test import TestCase
+import asyncio
+import os
+import runpy
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO, StringIO
+from types import SimpleNamespace
+from typing import Optional
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection, router, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from PIL import Image
 from rest_framework import status
 from rest_framework.response import Response
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.consts import IMAGE_VARIANT_SIZES
+from api.enums import TemplateStatus
+from api.models import Meme, MemeTemplate, PrerenderedMeme, User
+from api.registry import template_registry
+from api.rendering import (
+    RenderEngine,
+    caption_overlay_cache,
+    get_caption_overlay,
+    get_normalized_template_image,
+    normalized_template_cache,
+    render_image_variant,
+    render_meme_image,
+)
+from api.services import (
+    CheckTemplatesService,
+    MemeImageService,
+    ReconcileRatingAggregatesService,
+    RefillSurprisePoolService,
+    RenderMemeImageService,
+    SurpriseMeMemeService,
+)
+from api.template_cache import CachedTemplateImage, TemplateImageCache
+from api.text_layout import MIN_FONT_SIZE, get_text_layout
+from api.warmup import preload_process_state
+from core.cache import DiskLRUCache, MemoryLRUCache
+from core.concurrency import SingleFlight
+from core.db_routing import ReplicaRoutingMiddleware
+from core.exceptions import NotFoundError, ServiceUnavailableError
+from core.http import (
+    AsyncHttpFetcher,
+    CircuitOpenError,
+    FetchCancelledError,
+    FetchError,
+    FetchResponse,
+    HttpFetcher,
+    ResponseTooLargeError,
+)
+
 
-from api.models import Meme
+def create_image_content(width: int = 200, height: int = 100) -> bytes:
+    image_io = BytesIO()
+    Image.new("RGB", (width, height), color="gray").save(image_io, format="JPEG")
+    return image_io.getvalue()
 
 
-class MemeGeneratorApiTest(TestCase):
+# The numbers of queries expected by the tests don't include loading the user.
+@override_settings(STATELESS_JWT_AUTHENTICATION=True)
+class BaseApiTest(TestCase):
     fixtures = ["fixtures/initial_test_data.json"]
 
+    def setUp(self):
+        template_registry.clear()
+
     def _assertResponseIsOk(self, response: Response) -> None:
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
@@ -23,6 +94,9 @@ class MemeGeneratorApiTest(TestCase):
     def _assertResponseIsNotFound(self, response: Response) -> None:
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
+    def _assertResponseIsServiceUnavailable(self, response: Response) -> None:
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
     def _authenticate(
         self,
         *,
@@ -50,6 +124,39 @@ class MemeGeneratorApiTest(TestCase):
             data={"email": email, "password_1": password, "password_2": password},
         )
 
+
+class RenderingTestMixin:
+    def _set_up_rendering(self, template_content: Optional[bytes] = None) -> str:
+        """
+        This method is used to render memes in the test thread into a temporary media
+        root, from a generated template image instead of a downloaded one. It returns
+        the media root.
+        """
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = self.settings(MEDIA_ROOT=media_root.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        self._template_image = CachedTemplateImage(
+            content=template_content or create_image_content(), fetched_at=0
+        )
+        for patcher in (
+            mock.patch(
+                "api.services.template_image_cache.get",
+                return_value=self._template_image,
+            ),
+            mock.patch(
+                "api.services.render_engine",
+                RenderEngine(workers=0, queue_size=0, timeout=10),
+            ),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        return media_root.name
+
+
+class MemeGeneratorApiTest(BaseApiTest):
     def test_register_success(self):
         self._assertResponseIsCreated(self._register_user())
 
@@ -179,3 +286,1462 @@ class MemeGeneratorApiTest(TestCase):
     def test_surprise_me_success(self):
         self._authenticate()
         self._assertResponseIsOk(self.client.get(path="/api/memes/surprise-me/"))
+
+
+class TemplateRegistryTest(BaseApiTest):
+    def test_templates_are_served_from_memory(self):
+        template_registry.all()
+        with self.assertNumQueries(0):
+            self.assertEqual(template_registry.get_or_404(1).name, "test_name")
+            self.assertEqual(len(template_registry.get_random_order_templates()), 1)
+
+    def test_registry_is_invalidated_on_template_change(self):
+        template_registry.all()
+        with self.captureOnCommitCallbacks(execute=True):
+            template = MemeTemplate.objects.create(
+                name="new_template", image_url="https://example.com/new.jpg"
+            )
+        self.assertEqual(template_registry.get_or_404(template.id).name, "new_template")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            template.delete()
+        with self.assertRaises(NotFoundError):
+            template_registry.get_or_404(template.id)
+
+
+class ConditionalGetTest(BaseApiTest):
+    def setUp(self):
+        super().setUp()
+        self._authenticate()
+
+    def _assertResponseIsNotModified(self, response: Response) -> None:
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertFalse(response.content)
+
+    def test_memes_list_not_modified(self):
+        etag = self.client.get(path="/api/memes/")["ETag"]
+        self._assertResponseIsNotModified(
+            self.client.get(path="/api/memes/", HTTP_IF_NONE_MATCH=etag)
+        )
+        self._assertResponseIsOk(
+            self.client.get(path="/api/memes/?page=2", HTTP_IF_NONE_MATCH=etag)
+        )
+
+    def _assertMemesListIsModified(self, etag: str) -> None:
+        response = self.client.get(path="/api/memes/", HTTP_IF_NONE_MATCH=etag)
+        self._assertResponseIsOk(response)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_memes_list_not_modified_without_queries(self):
+        etag = self.client.get(path="/api/memes/?pagination=cursor")["ETag"]
+        with self.assertNumQueries(0):
+            self._assertResponseIsNotModified(
+                self.client.get(
+                    path="/api/memes/?pagination=cursor", HTTP_IF_NONE_MATCH=etag
+                )
+            )
+
+    def test_memes_list_modified_after_meme_creation(self):
+        etag = self.client.get(path="/api/memes/")["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(path="/api/memes/", data={"template_id": 1})
+        self._assertMemesListIsModified(etag)
+
+    def test_memes_list_modified_after_batch_creation(self):
+        etag = self.client.get(path="/api/memes/")["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                path="/api/memes/batch/",
+                data={"memes": [{"template_id": 1}]},
+                content_type="application/json",
+            )
+        self._assertMemesListIsModified(etag)
+
+    def test_memes_list_not_modified_after_rating(self):
+        etag = self.client.get(path="/api/memes/")["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(path="/api/memes/1/rate/", data={"score": 5})
+        self._assertResponseIsNotModified(
+            self.client.get(path="/api/memes/", HTTP_IF_NONE_MATCH=etag)
+        )
+
+    def test_memes_list_modified_after_author_change(self):
+        etag = self.client.get(path="/api/memes/")["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.filter(meme__isnull=False).first().save()
+        self._assertMemesListIsModified(etag)
+
+    def test_meme_not_modified_since(self):
+        last_modified = self.client.get(path="/api/memes/1/")["Last-Modified"]
+        self._assertResponseIsNotModified(
+            self.client.get(path="/api/memes/1/", HTTP_IF_MODIFIED_SINCE=last_modified)
+        )
+
+    def test_meme_modified_after_author_change(self):
+        etag = self.client.get(path="/api/memes/1/")["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            author = User.objects.get(meme__id=1)
+            author.email = "renamed@example.com"
+            author.save()
+        response = self.client.get(path="/api/memes/1/", HTTP_IF_NONE_MATCH=etag)
+        self._assertResponseIsOk(response)
+        self.assertEqual(response.json()["created_by"]["email"], "renamed@example.com")
+
+    def test_meme_modified_since_template_change(self):
+        last_modified = self.client.get(path="/api/memes/1/")["Last-Modified"]
+        # If-Modified-Since has a resolution of a second.
+        with mock.patch(
+            "django.utils.timezone.now",
+            return_value=timezone.now() + timedelta(seconds=2),
+        ), self.captureOnCommitCallbacks(execute=True):
+            template = MemeTemplate.objects.get(meme__id=1)
+            template.name = "renamed_template"
+            template.save()
+        response = self.client.get(
+            path="/api/memes/1/", HTTP_IF_MODIFIED_SINCE=last_modified
+        )
+        self._assertResponseIsOk(response)
+        self.assertEqual(response.json()["template"]["name"], "renamed_template")
+
+    def test_templates_not_modified_without_queries(self):
+        etag = self.client.get(path="/api/templates/")["ETag"]
+        # The authentication is stateless, so no queries are left.
+        with self.assertNumQueries(0):
+            self._assertResponseIsNotModified(
+                self.client.get(path="/api/templates/", HTTP_IF_NONE_MATCH=etag)
+            )
+
+    def test_top_memes_modified_after_rating(self):
+        etag = self.client.get(path="/api/memes/top/")["ETag"]
+        self.client.post(path="/api/memes/1/rate/", data={"score": 5})
+        self._assertResponseIsOk(
+            self.client.get(path="/api/memes/top/", HTTP_IF_NONE_MATCH=etag)
+        )
+
+    def test_top_memes_modified_after_author_change(self):
+        response = self.client.get(path="/api/memes/top/")
+        with self.captureOnCommitCallbacks(execute=True):
+            author = User.objects.get(id=response.json()[0]["created_by"]["id"])
+            author.email = "renamed@example.com"
+            author.save()
+        self._assertResponseIsOk(
+            self.client.get(path="/api/memes/top/", HTTP_IF_NONE_MATCH=response["ETag"])
+        )
+
+
+class MemesCursorPaginationTest(BaseApiTest):
+    def setUp(self):
+        super().setUp()
+        self._authenticate()
+
+    def test_walk_pages_forward_and_back(self):
+        ids = []
+        url = "/api/memes/?pagination=cursor&page_size=5"
+        pages = []
+        while url:
+            response = self.client.get(path=url)
+            self._assertResponseIsOk(response)
+            pages.append(response.json())
+            ids += [meme["id"] for meme in pages[-1]["results"]]
+            url = pages[-1]["next"]
+        self.assertEqual(ids, list(range(12, 0, -1)))
+        self.assertNotIn("count", pages[0])
+
+        response = self.client.get(path=pages[1]["previous"])
+        self.assertEqual(response.json()["results"], pages[0]["results"])
+        self.assertIsNone(response.json()["previous"])
+
+    def test_count_is_optional(self):
+        response = self.client.get(path="/api/memes/?pagination=cursor&with_count=true")
+        self.assertEqual(response.json()["count"], 12)
+
+    def test_page_size_is_capped(self):
+        with self.settings(MEMES_MAX_PAGE_SIZE=3):
+            response = self.client.get(
+                path="/api/memes/?pagination=cursor&page_size=50"
+            )
+        self.assertEqual(len(response.json()["results"]), 3)
+
+    def test_invalid_cursor(self):
+        self._assertResponseIsBadRequest(self.client.get(path="/api/memes/?cursor=abc"))
+
+
+class RandomMemesTest(BaseApiTest):
+    def setUp(self):
+        super().setUp()
+        self._authenticate()
+
+    def test_random_memes_are_distinct(self):
+        response = self.client.get(path="/api/memes/random/?count=5")
+        self._assertResponseIsOk(response)
+        self.assertEqual(len({meme["id"] for meme in response.json()}), 5)
+
+    def test_random_memes_with_sparse_ids(self):
+        Meme.objects.exclude(id__in=(3, 7)).delete()
+        memes = Meme.objects.get_random_memes(5)
+        self.assertEqual(sorted(meme.id for meme in memes), [3, 7])
+
+    def test_random_memes_failure_count_too_large(self):
+        with self.settings(RANDOM_MEMES_MAX_COUNT=3):
+            self._assertResponseIsBadRequest(
+                self.client.get(path="/api/memes/random/?count=4")
+            )
+
+
+class BatchCreateMemesTest(BaseApiTest):
+    def setUp(self):
+        super().setUp()
+        self._authenticate()
+
+    def _post_batch(self, memes: list) -> Response:
+        return self.client.post(
+            path="/api/memes/batch/",
+            data={"memes": memes},
+            content_type="application/json",
+        )
+
+    def test_batch_create_success(self):
+        response = self._post_batch(
+            [{"template_id": 1, "top_text": "Top"}, {"template_id": 1}]
+        )
+        self._assertResponseIsCreated(response)
+        meme_ids = [result["meme_id"] for result in response.json()["results"]]
+        memes = Meme.objects.in_bulk(meme_ids)
+        self.assertEqual(
+            [(memes[id].top_text, memes[id].bottom_text) for id in meme_ids],
+            [("Top", "bottom_text"), ("top_text", "bottom_text")],
+        )
+
+    def test_batch_create_reports_errors_per_meme(self):
+        response = self._post_batch(
+            [{"template_id": 100}, {"template_id": "wrong"}, {"template_id": 1}]
+        )
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        results = response.json()["results"]
+        self.assertIn("template_id", results[0]["errors"])
+        self.assertIn("template_id", results[1]["errors"])
+        self.assertTrue(Meme.objects.filter(id=results[2]["meme_id"]).exists())
+
+    def test_batch_create_reports_too_long_text_per_meme(self):
+        response = self._post_batch(
+            [{"template_id": 1, "top_text": "x" * 101}, {"template_id": 1}]
+        )
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        results = response.json()["results"]
+        self.assertIn("top_text", results[0]["errors"])
+        self.assertTrue(Meme.objects.filter(id=results[1]["meme_id"]).exists())
+
+    def test_batch_create_uses_constant_number_of_queries(self):
+        # Templates lookup, savepoint, insert and savepoint release.
+        with self.assertNumQueries(4):
+            self._post_batch([{"template_id": 1}] * 20)
+
+    def test_batch_create_failure_batch_too_large(self):
+        with self.settings(MEMES_BATCH_MAX_SIZE=2):
+            self._assertResponseIsBadRequest(self._post_batch([{"template_id": 1}] * 3))
+
+
+class RatingAggregatesTest(BaseApiTest):
+    def _assertAggregatesEqual(
+        self, meme_id: int, count: int, total: int, average: float
+    ) -> None:
+        meme = Meme.objects.get(id=meme_id)
+        self.assertEqual(
+            (meme.rating_count, meme.rating_sum, meme.average_score),
+            (count, total, average),
+        )
+
+    def test_rate_meme_updates_aggregates(self):
+        self._authenticate()
+        self.client.post(path="/api/memes/1/rate/", data={"score": 5})
+        self._assertAggregatesEqual(1, 2, 6, 3.0)
+        self.client.post(path="/api/memes/1/rate/", data={"score": 3})
+        self._assertAggregatesEqual(1, 2, 4, 2.0)
+
+    def test_top_memes_ordered_by_average_score(self):
+        self._authenticate()
+        response = self.client.get(path="/api/memes/top/")
+        self.assertEqual(
+            [meme["id"] for meme in response.json()[:3]],
+            [10, 5, 9],
+        )
+
+    def test_reconcile_fixes_drifted_aggregates(self):
+        Meme.objects.filter(id=1).update(rating_count=3, average_score=4)
+        self.assertEqual(ReconcileRatingAggregatesService().execute(), 1)
+        self._assertAggregatesEqual(1, 1, 1, 1.0)
+
+
+class TemplateImageCacheTest(SimpleTestCase):
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self._directory.cleanup)
+        self._template = MemeTemplate(id=1, image_url="https://example.com/a.jpg")
+        self._content = create_image_content()
+        self._fetcher = mock.Mock()
+
+    def _create_cache(self, ttl: int = 60) -> TemplateImageCache:
+        return TemplateImageCache(
+            ttl=ttl,
+            memory_max_bytes=64 * 1024,
+            disk_directory=self._directory.name,
+            disk_max_bytes=64 * 1024,
+            fetcher=self._fetcher,
+        )
+
+    @staticmethod
+    def _response(status_code: int, content: bytes = b"", **headers) -> FetchResponse:
+        return FetchResponse(status_code=status_code, content=content, headers=headers)
+
+    def test_warm_get_does_not_touch_network(self):
+        self._fetcher.get.return_value = self._response(200, self._content)
+        cache = self._create_cache()
+        self.assertEqual(cache.get(self._template).content, self._content)
+        self.assertEqual(cache.get(self._template).content, self._content)
+        self.assertEqual(
+            self._create_cache().get_cached(self._template).content, self._content
+        )
+        self.assertEqual(self._fetcher.get.call_count, 1)
+
+    def test_stale_entry_is_revalidated(self):
+        self._fetcher.get.return_value = self._response(200, self._content, ETag='"v1"')
+        cache = self._create_cache(ttl=0)
+        cache.get(self._template)
+
+        self._fetcher.get.return_value = self._response(304)
+        self.assertEqual(cache.get(self._template).content, self._content)
+        self.assertEqual(
+            self._fetcher.get.call_args.kwargs["headers"], {"If-None-Match": '"v1"'}
+        )
+
+    def test_invalid_image_is_not_cached(self):
+        self._fetcher.get.return_value = self._response(200, b"not an image")
+        self.assertIsNone(self._create_cache().get(self._template))
+
+        self._fetcher.get.return_value = self._response(200, self._content)
+        with self.settings(TEMPLATE_MAX_PIXELS=100):
+            self.assertIsNone(self._create_cache().get(self._template))
+
+    def test_unreachable_host_serves_stale_entry(self):
+        self._fetcher.get.return_value = self._response(200, self._content)
+        cache = self._create_cache(ttl=0)
+        cache.get(self._template)
+
+        self._fetcher.get.side_effect = CircuitOpenError("example.com")
+        self.assertEqual(cache.get(self._template).content, self._content)
+        self.assertIsNone(cache.refresh(self._template))
+
+    def test_server_error_serves_stale_entry(self):
+        self._fetcher.get.return_value = self._response(200, self._content)
+        cache = self._create_cache(ttl=0)
+        cache.get(self._template)
+
+        self._fetcher.get.return_value = self._response(502)
+        self.assertEqual(cache.get(self._template).content, self._content)
+        self.assertIsNone(cache.refresh(self._template))
+        self.assertEqual(cache.get(self._template).content, self._content)
+
+    def test_gone_image_is_discarded(self):
+        self._fetcher.get.return_value = self._response(200, self._content)
+        cache = self._create_cache(ttl=0)
+        cache.get(self._template)
+
+        self._fetcher.get.return_value = self._response(410)
+        self.assertIsNone(cache.get(self._template))
+        self._fetcher.get.side_effect = CircuitOpenError("example.com")
+        self.assertIsNone(cache.get(self._template))
+
+    def test_missing_image_is_not_cached(self):
+        self._fetcher.get.return_value = self._response(404)
+        cache = self._create_cache()
+        self.assertIsNone(cache.get(self._template))
+        self.assertIsNone(cache.get_cached(self._template))
+
+    def test_memory_lru_cache_evicts_least_recently_used(self):
+        cache = MemoryLRUCache(max_bytes=4)
+        cache.set("a", b"aa")
+        cache.set("b", b"bb")
+        cache.get("a")
+        cache.set("c", b"cc")
+        self.assertEqual(cache.get("a"), b"aa")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.size, 4)
+
+    def test_disk_lru_cache_overwrite_replaces_size(self):
+        cache = DiskLRUCache(self._directory.name, max_bytes=64)
+        cache.set("a", b"aa")
+        cache.set("b", b"bb")
+        cache.set("a", b"aa")
+        self.assertEqual(cache.size, 4)
+        cache.set("a", b"a")
+        self.assertEqual(cache.size, 3)
+        self.assertEqual(cache.get("b"), b"bb")
+
+    def test_disk_lru_cache_limit_is_shared_by_instances(self):
+        # Every worker process has its own instance of the cache.
+        first = DiskLRUCache(self._directory.name, max_bytes=4)
+        second = DiskLRUCache(self._directory.name, max_bytes=4)
+        first.set("a", b"aa")
+        second.set("b", b"bb")
+        os.utime(first.path("a"), (0, 0))
+        first.set("c", b"cc")
+        self.assertIsNone(second.get("a"))
+        self.assertEqual(first.size, 4)
+
+
+class StubHTTPRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    client_ports: list[int] = []
+
+    def _send(self, status_code: int, body: bytes, **headers) -> None:
+        self.send_response(status_code)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client has given up on the response.
+            pass
+
+    def do_GET(self):
+        self.client_ports.append(self.client_address[1])
+        if self.path == "/image":
+            self._send(200, b"image", **{"Content-Length": "5", "ETag": '"v1"'})
+        elif self.path == "/large":
+            self._send(200, b"x" * 2048, **{"Content-Length": "2048"})
+        elif self.path == "/large-stream":
+            # Without the length, the body ends when the connection is closed.
+            self.close_connection = True
+            self._send(200, b"x" * 2048, Connection="close")
+        elif self.path == "/slow":
+            time.sleep(1)
+            self._send(200, b"slow", **{"Content-Length": "4"})
+        elif self.path == "/trickle":
+            # Every byte arrives within the read timeout, the whole body doesn't.
+            self._send(200, b"", **{"Content-Length": "100"})
+            for _ in range(100):
+                time.sleep(0.1)
+                try:
+                    self.wfile.write(b"x")
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    break
+        else:
+            self._send(500, b"", **{"Content-Length": "0"})
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HttpFetcherTest(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls._server = ThreadingHTTPServer(("127.0.0.1", 0), StubHTTPRequestHandler)
+        threading.Thread(target=cls._server.serve_forever, daemon=True).start()
+        cls._base_url = f"http://127.0.0.1:{cls._server.server_address[1]}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._server.shutdown()
+        cls._server.server_close()
+        super().tearDownClass()
+
+    def _create_fetcher(self, **options) -> HttpFetcher:
+        fetcher = HttpFetcher(
+            **{
+                "connect_timeout": 1,
+                "read_timeout": 0.5,
+                "total_timeout": 5,
+                "max_bytes": 1024,
+                "pool_maxsize": 2,
+                "failure_threshold": 2,
+                "reset_timeout": 60,
+                **options,
+            }
+        )
+        self.addCleanup(fetcher.close)
+        return fetcher
+
+    def _async_fetch(self, *paths: str, **options) -> list[FetchResponse]:
+        fetcher = AsyncHttpFetcher(
+            **{
+                "connect_timeout": 1,
+                "read_timeout": 0.5,
+                "total_timeout": 5,
+                "max_bytes": 1024,
+                "pool_maxsize": 2,
+                "failure_threshold": 2,
+                "reset_timeout": 60,
+                **options,
+            }
+        )
+
+        async def fetch():
+            try:
+                return [await fetcher.get(f"{self._base_url}{path}") for path in paths]
+            finally:
+                await fetcher.aclose()
+
+        return async_to_sync(fetch)()
+
+    def test_connections_are_reused(self):
+        fetcher = self._create_fetcher()
+        StubHTTPRequestHandler.client_ports.clear()
+        for _ in range(3):
+            response = fetcher.get(f"{self._base_url}/image")
+            self.assertEqual((response.status_code, response.content), (200, b"image"))
+        self.assertEqual(response.headers["etag"], '"v1"')
+        self.assertEqual(len(set(StubHTTPRequestHandler.client_ports)), 1)
+
+    def test_fetch_failure_response_too_large(self):
+        fetcher = self._create_fetcher()
+        for path in ("/large", "/large-stream"):
+            with self.assertRaises(ResponseTooLargeError):
+                fetcher.get(f"{self._base_url}{path}")
+
+    def test_fetch_failure_cancelled(self):
+        fetcher = self._create_fetcher()
+        cancelled = threading.Event()
+        cancelled.set()
+        with self.assertRaises(FetchCancelledError):
+            fetcher.get(f"{self._base_url}/image", cancelled=cancelled)
+        self.assertEqual(fetcher.get_metrics()["hosts"], {})
+
+    def test_fetch_failure_read_timeout(self):
+        with self.assertRaises(FetchError):
+            self._create_fetcher().get(f"{self._base_url}/slow")
+
+    def test_fetch_failure_total_timeout_while_trickling(self):
+        started_at = time.monotonic()
+        with self.assertRaises(FetchError):
+            self._create_fetcher(total_timeout=1).get(f"{self._base_url}/trickle")
+        self.assertLess(time.monotonic() - started_at, 1.5)
+
+    def test_circuit_opens_after_consecutive_failures(self):
+        fetcher = self._create_fetcher()
+        for _ in range(2):
+            self.assertEqual(fetcher.get(f"{self._base_url}/error").status_code, 500)
+        with self.assertRaises(CircuitOpenError):
+            fetcher.get(f"{self._base_url}/image")
+
+        metrics = fetcher.get_metrics()["hosts"][self._base_url[len("http://") :]]
+        self.assertTrue(metrics["circuit_open"])
+        self.assertEqual((metrics["failures"], metrics["rejected"]), (2, 1))
+
+    def test_circuit_is_closed_after_successful_trial(self):
+        fetcher = self._create_fetcher(reset_timeout=0)
+        for _ in range(2):
+            fetcher.get(f"{self._base_url}/error")
+        self.assertEqual(fetcher.get(f"{self._base_url}/image").status_code, 200)
+        self.assertFalse(
+            fetcher.get_metrics()["hosts"][self._base_url[len("http://") :]][
+                "circuit_open"
+            ]
+        )
+
+    def test_async_fetcher_shares_circuit_with_sync_fetcher(self):
+        fetcher = self._create_fetcher()
+        responses = self._async_fetch("/image", "/error", "/error", shared_with=fetcher)
+        self.assertEqual(
+            [(response.status_code, response.content) for response in responses],
+            [(200, b"image"), (500, b""), (500, b"")],
+        )
+        with self.assertRaises(CircuitOpenError):
+            fetcher.get(f"{self._base_url}/image")
+
+    def test_async_fetch_failure_response_too_large(self):
+        for path in ("/large", "/large-stream"):
+            with self.assertRaises(ResponseTooLargeError):
+                self._async_fetch(path)
+
+
+class OutboundHttpMetricsTest(BaseApiTest):
+    def test_metrics_success_admin(self):
+        self._register_user()
+        User.objects.filter(email="test@gmail.com").update(is_staff=True)
+        self._authenticate(register=False)
+        response = self.client.get(path="/api/metrics/outbound-http/")
+        self._assertResponseIsOk(response)
+        self.assertIn("hosts", response.json())
+
+    def test_metrics_failure_not_admin(self):
+        self._authenticate()
+        self.assertEqual(
+            self.client.get(path="/api/metrics/outbound-http/").status_code,
+            status.HTTP_403_FORBIDDEN,
+        )
+
+
+class StatelessAuthenticationTest(BaseApiTest):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self._refresh = self._authenticate()
+        self._user = User.objects.get(email="test@gmail.com")
+
+    def _backdate_access_token(self) -> None:
+        # Tokens issued in the second of a revocation are accepted.
+        access = AccessToken(self.client.defaults["HTTP_AUTHORIZATION"].split()[1])
+        access.set_iat(at_time=timezone.now() - timedelta(seconds=5))
+        self.client.defaults["HTTP_AUTHORIZATION"] = f"Bearer {access}"
+
+    def test_authentication_without_queries(self):
+        template_registry.all()
+        with self.assertNumQueries(0):
+            self._assertResponseIsOk(self.client.get(path="/api/templates/"))
+
+    def test_authentication_failure_user_changed(self):
+        self._backdate_access_token()
+        with self.captureOnCommitCallbacks(execute=True):
+            self._user.is_staff = True
+            self._user.save()
+        self._assertResponseIsUnauthorized(self.client.get(path="/api/templates/"))
+        self._assertResponseIsUnauthorized(
+            self.client.get(path="/api/async/templates/")
+        )
+
+    def test_authentication_failure_user_deleted(self):
+        self._backdate_access_token()
+        with self.captureOnCommitCallbacks(execute=True):
+            self._user.delete()
+        self._assertResponseIsUnauthorized(self.client.get(path="/api/templates/"))
+
+    def test_authentication_success_after_last_login_update(self):
+        self._backdate_access_token()
+        with self.captureOnCommitCallbacks(execute=True):
+            self._user.last_login = timezone.now()
+            self._user.save(update_fields=["last_login"])
+        self._assertResponseIsOk(self.client.get(path="/api/templates/"))
+
+    def test_refreshed_token_has_current_claims(self):
+        self._backdate_access_token()
+        with self.captureOnCommitCallbacks(execute=True):
+            self._user.is_staff = True
+            self._user.save()
+        response = self.client.post(
+            path="/api/token/refresh/", data={"refresh": self._refresh}
+        )
+        self._assertResponseIsOk(response)
+        self.client.defaults["HTTP_AUTHORIZATION"] = (
+            f"Bearer {response.json()['access']}"
+        )
+        self._assertResponseIsOk(self.client.get(path="/api/metrics/outbound-http/"))
+
+    def test_authentication_from_database_failure_user_deleted(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self._user.delete()
+        # Without the stateless authentication, the revocation isn't needed.
+        cache.clear()
+        with self.settings(STATELESS_JWT_AUTHENTICATION=False):
+            self._assertResponseIsUnauthorized(self.client.get(path="/api/templates/"))
+            self._assertResponseIsUnauthorized(
+                self.client.get(path="/api/async/templates/")
+            )
+            self._assertResponseIsUnauthorized(
+                self.client.post(path="/api/memes/", data={"template_id": 1})
+            )
+
+    def test_refresh_failure_user_deleted(self):
+        self._user.delete()
+        self._assertResponseIsUnauthorized(
+            self.client.post(
+                path="/api/token/refresh/", data={"refresh": self._refresh}
+            )
+        )
+
+
+class ReadinessTest(BaseApiTest):
+    # The readiness check queries the replicas as well.
+    databases = "__all__"
+
+    def test_readiness_success_unauthenticated(self):
+        response = self.client.get(path="/api/health/ready/")
+        self._assertResponseIsOk(response)
+        self.assertEqual(response.json(), {"status": "ready"})
+
+    def test_readiness_failure_database_unavailable(self):
+        with mock.patch(
+            "django.db.backends.base.base.BaseDatabaseWrapper.cursor",
+            side_effect=DatabaseError("unavailable"),
+        ):
+            self._assertResponseIsServiceUnavailable(
+                self.client.get(path="/api/health/ready/")
+            )
+
+
+class GunicornConfigTest(SimpleTestCase):
+    def _load_config(self, **environ) -> dict:
+        # The settings that aren't in the environment are read from the shipped .env.
+        with mock.patch.dict(os.environ, environ):
+            for name in ("SERVER_MODE", "GUNICORN_MODE", "RENDER_POOL_WORKERS"):
+                if name not in environ:
+                    os.environ.pop(name, None)
+            return runpy.run_path(str(settings.BASE_DIR / "gunicorn.conf.py"))
+
+    def test_config_loads_with_shipped_env(self):
+        config = self._load_config()
+        self.assertEqual(config["wsgi_app"], "meme_generator_api.wsgi:application")
+        self.assertEqual(config["worker_class"], "gthread")
+
+    def test_config_asgi_mode(self):
+        config = self._load_config(GUNICORN_MODE="asgi")
+        self.assertEqual(config["wsgi_app"], "meme_generator_api.asgi:application")
+        self.assertEqual(config["worker_class"], "uvicorn.workers.UvicornWorker")
+
+
+class WarmupCommandTest(BaseApiTest):
+    # The warmup connects to the replicas as well.
+    databases = "__all__"
+
+    def test_warmup_reports_every_step(self):
+        stdout = StringIO()
+        call_command("warmup", stdout=stdout)
+        self.assertEqual(
+            [line.split()[0] for line in stdout.getvalue().splitlines()],
+            ["checks", "connections", "migrations", "total"],
+        )
+
+    def test_preload_process_state_loads_templates(self):
+        preload_process_state()
+        with self.assertNumQueries(0):
+            template_registry.all()
+
+    def test_warmup_failure_unapplied_migrations(self):
+        migration = SimpleNamespace(app_label="api", name="9999_pending")
+        with mock.patch(
+            "api.warmup.MigrationExecutor.migration_plan",
+            return_value=[(migration, False)],
+        ), mock.patch("api.management.commands.warmup.os.execvp") as execvp:
+            with self.assertRaisesMessage(CommandError, "api.9999_pending"):
+                call_command("warmup", "poe", "serve", stdout=StringIO())
+        execvp.assert_not_called()
+
+    def test_warmup_hands_off_to_server_command(self):
+        with mock.patch(
+            "api.management.commands.warmup.close_connections"
+        ) as close_connections, mock.patch(
+            "api.management.commands.warmup.os.execvp"
+        ) as execvp:
+            call_command("warmup", "poe", "serve", stdout=StringIO())
+        close_connections.assert_called_once()
+        execvp.assert_called_once_with("poe", ["poe", "serve"])
+
+
+class CheckTemplatesTest(BaseApiTest):
+    def setUp(self):
+        super().setUp()
+        self._dead_template = MemeTemplate.objects.create(
+            name="dead", image_url="https://example.com/dead.jpg"
+        )
+        patcher = mock.patch(
+            "api.services.template_image_cache.refresh",
+            side_effect=lambda template: (
+                CachedTemplateImage(content=create_image_content(), fetched_at=0)
+                if template.id == 1
+                else None
+            ),
+        )
+        self._refresh = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_check_records_health_of_templates(self):
+        counts = CheckTemplatesService(concurrency=2).execute()
+        self.assertEqual(counts, {"healthy": 1, "unhealthy": 1})
+
+        template = MemeTemplate.objects.get(id=1)
+        self.assertEqual(template.status, TemplateStatus.HEALTHY)
+        self.assertEqual((template.width, template.height), (200, 100))
+        self.assertEqual(template.content_length, len(create_image_content()))
+        self.assertIsNotNone(template.last_checked_at)
+        self.assertEqual(
+            [
+                template.id
+                for template in template_registry.get_random_order_templates()
+            ],
+            [1],
+        )
+
+    @override_settings(TEMPLATE_CHECK_BACKOFF_BASE_SECONDS=60)
+    def test_failing_template_is_retried_with_backoff(self):
+        CheckTemplatesService().execute()
+        self.assertEqual(
+            CheckTemplatesService().execute(), {"healthy": 0, "unhealthy": 0}
+        )
+
+        MemeTemplate.objects.filter(id=self._dead_template.id).update(
+            next_check_at=timezone.now()
+        )
+        CheckTemplatesService().execute()
+        template = MemeTemplate.objects.get(id=self._dead_template.id)
+        self.assertEqual(template.check_failures, 2)
+        self.assertEqual(
+            template.next_check_at - template.last_checked_at, timedelta(seconds=120)
+        )
+
+    def test_health_is_reset_when_image_url_changes(self):
+        CheckTemplatesService().execute()
+        template = MemeTemplate.objects.get(id=self._dead_template.id)
+        template.name = "still dead"
+        template.save()
+        self.assertEqual(
+            MemeTemplate.objects.get(id=template.id).status, TemplateStatus.UNHEALTHY
+        )
+
+        template.image_url = "https://example.com/fixed.jpg"
+        template.save(update_fields=("image_url",))
+        template = MemeTemplate.objects.get(id=template.id)
+        self.assertEqual(template.status, TemplateStatus.UNKNOWN)
+        self.assertEqual(template.check_failures, 0)
+        self.assertIsNone(template.next_check_at)
+
+    def test_check_templates_command(self):
+        stdout = StringIO()
+        call_command("check_templates", "--all", stdout=stdout)
+        self.assertEqual(
+            stdout.getvalue().strip(), "Checked 2 templates: 1 healthy, 1 unhealthy."
+        )
+
+
+class RenderEngineTest(SimpleTestCase):
+    def _assertIsJpeg(self, content: bytes, size: tuple[int, int]) -> None:
+        image = Image.open(BytesIO(content))
+        self.assertEqual(image.format, "JPEG")
+        self.assertEqual(image.size, size)
+
+    def test_render_inline(self):
+        engine = RenderEngine(workers=0, queue_size=0, timeout=10)
+        self._assertIsJpeg(
+            engine.render(create_image_content(), "Top", "Bottom"), (200, 100)
+        )
+
+    def test_render_in_process_pool(self):
+        engine = RenderEngine(workers=1, queue_size=1, timeout=60)
+        self.addCleanup(engine.shutdown)
+        self._assertIsJpeg(
+            engine.render(create_image_content(), "Top", "Bottom"), (200, 100)
+        )
+
+    def test_render_failure_queue_is_full(self):
+        engine = RenderEngine(workers=1, queue_size=0, timeout=60)
+        engine._slots.acquire()
+        with self.assertRaises(ServiceUnavailableError):
+            engine.render(create_image_content(), "Top", "Bottom")
+
+    def test_stuck_job_is_stopped_after_timeout(self):
+        engine = RenderEngine(workers=1, queue_size=0, timeout=3)
+        self.addCleanup(engine.shutdown)
+        # The pool is started first, so that only the stuck job runs out of time.
+        engine.run(bytes, 1)
+        with self.assertRaises(ServiceUnavailableError):
+            engine.run(time.sleep, 60)
+        self.assertEqual(engine.run(bytes, 2), b"\x00\x00")
+
+
+class SurprisePoolTest(RenderingTestMixin, BaseApiTest):
+    def setUp(self):
+        super().setUp()
+        self._set_up_rendering()
+
+    def test_refill_fills_pool_up_to_size(self):
+        service = RefillSurprisePoolService(pool_size=3, low_watermark=1)
+        self.assertEqual(service.execute(), 3)
+        self.assertEqual(PrerenderedMeme.objects.count(), 3)
+        self.assertEqual(service.execute(), 0)
+
+    def test_surprise_me_success_from_pool(self):
+        RefillSurprisePoolService(pool_size=2, low_watermark=1).execute()
+        image_names = set(PrerenderedMeme.objects.values_list("image", flat=True))
+        self._authenticate()
+        self._assertResponseIsOk(self.client.get(path="/api/memes/surprise-me/"))
+        self.assertEqual(PrerenderedMeme.objects.count(), 1)
+        self.assertIn(Meme.objects.latest("id").image.name, image_names)
+
+    @override_settings(SURPRISE_POOL_INLINE_FALLBACK=False)
+    def test_surprise_me_failure_empty_pool_without_fallback(self):
+        self._authenticate()
+        self._assertResponseIsServiceUnavailable(
+            self.client.get(path="/api/memes/surprise-me/")
+        )
+
+
+@override_settings(SURPRISE_FETCH_RACE_SIZE=2, SURPRISE_FETCH_DEADLINE_SECONDS=2)
+class SurpriseMeTemplateRaceTest(SimpleTestCase):
+    def setUp(self):
+        self._templates = [
+            MemeTemplate(id=template_id, image_url=f"https://example.com/{template_id}")
+            for template_id in range(1, 5)
+        ]
+        self._cancelled_events = []
+        for patcher in (
+            mock.patch(
+                "api.services.template_registry.get_random_order_templates",
+                return_value=self._templates,
+            ),
+            mock.patch(
+                "api.services.template_image_cache.get_cached", return_value=None
+            ),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _get_template_image(self, delays: dict[int, float]):
+        def get(template, cancelled):
+            self._cancelled_events.append(cancelled)
+            if (delay := delays.get(template.id)) is None:
+                return None
+            cancelled.wait(delay)
+            return CachedTemplateImage(content=b"image", fetched_at=0)
+
+        return get
+
+    def _read_template_file(self, delays: dict[int, float]):
+        with mock.patch(
+            "api.services.template_image_cache.get",
+            side_effect=self._get_template_image(delays),
+        ):
+            return SurpriseMeMemeService(user_id=1)._read_template_file()
+
+    def test_fastest_template_wins(self):
+        started_at = time.monotonic()
+        template, _ = self._read_template_file({1: 1.5, 2: 0.1})
+        self.assertEqual(template.id, 2)
+        self.assertLess(time.monotonic() - started_at, 1)
+        self.assertTrue(all(event.is_set() for event in self._cancelled_events))
+
+    def test_failed_template_is_replaced_by_next_one(self):
+        template, _ = self._read_template_file({3: 0})
+        self.assertEqual(template.id, 3)
+
+    def test_race_failure_deadline_exceeded(self):
+        with self.settings(SURPRISE_FETCH_DEADLINE_SECONDS=0.2):
+            with self.assertRaises(ServiceUnavailableError):
+                self._read_template_file({1: 5, 2: 5})
+
+    def test_race_failure_no_valid_templates(self):
+        with self.assertRaises(NotFoundError):
+            self._read_template_file({})
+
+    def _arace_template_files(self, delays: dict[int, float]):
+        started = []
+
+        async def aget(template):
+            started.append(template.id)
+            if (delay := delays.get(template.id)) is None:
+                return None
+            await asyncio.sleep(delay)
+            return CachedTemplateImage(content=b"image", fetched_at=0)
+
+        with mock.patch("api.services.template_image_cache.aget", side_effect=aget):
+            return async_to_sync(
+                SurpriseMeMemeService(user_id=1)._arace_template_files
+            )(self._templates)
+
+    def test_async_fastest_template_wins(self):
+        started_at = time.monotonic()
+        template, _ = self._arace_template_files({1: 1.5, 2: 0.1})
+        self.assertEqual(template.id, 2)
+        self.assertLess(time.monotonic() - started_at, 1)
+
+    def test_async_failed_template_is_replaced_by_next_one(self):
+        template, _ = self._arace_template_files({3: 0})
+        self.assertEqual(template.id, 3)
+
+    def test_async_race_failure_deadline_exceeded(self):
+        with self.settings(SURPRISE_FETCH_DEADLINE_SECONDS=0.2):
+            with self.assertRaises(ServiceUnavailableError):
+                self._arace_template_files({1: 5, 2: 5})
+
+    def test_async_race_failure_no_valid_templates(self):
+        with self.assertRaises(NotFoundError):
+            self._arace_template_files({})
+
+
+class AsyncViewsTest(RenderingTestMixin, BaseApiTest):
+    def test_list_memes_success(self):
+        self._authenticate()
+        response = self.client.get(path="/api/async/memes/?page=2")
+        self._assertResponseIsOk(response)
+        self.assertEqual(
+            response.json()["count"],
+            self.client.get(path="/api/memes/").json()["count"],
+        )
+        self.assertEqual(len(response.json()["results"]), 2)
+        self.assertTrue(response.json()["previous"].endswith("/api/async/memes/"))
+        self.assertTrue(response.json()["next"].endswith("/api/async/memes/?page=3"))
+
+    def test_list_memes_same_as_sync_view(self):
+        self._authenticate()
+        for query in ("", "?page=2", "?pagination=cursor&page_size=3"):
+            with self.subTest(query=query):
+                response = self.client.get(path=f"/api/async/memes/{query}")
+                sync_response = self.client.get(path=f"/api/memes/{query}")
+                self._assertResponseIsOk(response)
+                self.assertEqual(
+                    [meme["id"] for meme in response.json()["results"]],
+                    [meme["id"] for meme in sync_response.json()["results"]],
+                )
+
+    def test_list_memes_by_cursor_without_count(self):
+        self._authenticate()
+        response = self.client.get(path="/api/async/memes/?pagination=cursor")
+        self._assertResponseIsOk(response)
+        self.assertNotIn("count", response.json())
+        self.assertIn("/api/async/memes/?", response.json()["next"])
+
+    def test_list_memes_failure_non_existent_page(self):
+        self._authenticate()
+        self._assertResponseIsNotFound(
+            self.client.get(path="/api/async/memes/?page=10")
+        )
+
+    def test_list_memes_failure_unauthenticated(self):
+        response = self.client.get(path="/api/async/memes/")
+        self._assertResponseIsUnauthorized(response)
+        self.assertIn("Bearer", response["WWW-Authenticate"])
+
+    def test_list_memes_failure_invalid_token(self):
+        self.client.defaults["HTTP_AUTHORIZATION"] = "Bearer invalid"
+        self._assertResponseIsUnauthorized(self.client.get(path="/api/async/memes/"))
+
+    def test_get_meme_success(self):
+        self._authenticate()
+        response = self.client.get(path="/api/async/memes/1/")
+        self._assertResponseIsOk(response)
+        self.assertEqual(response.json(), self.client.get(path="/api/memes/1/").json())
+
+    def test_get_meme_failure_non_existent_meme(self):
+        self._authenticate()
+        self._assertResponseIsNotFound(self.client.get(path="/api/async/memes/1000/"))
+
+    def test_list_templates_success(self):
+        self._authenticate()
+        response = self.client.get(path="/api/async/templates/")
+        self._assertResponseIsOk(response)
+        self.assertEqual(
+            response.json(), self.client.get(path="/api/templates/").json()
+        )
+
+    def test_random_memes_success(self):
+        self._authenticate()
+        self._assertResponseIsOk(self.client.get(path="/api/async/memes/random/"))
+        response = self.client.get(path="/api/async/memes/random/?count=5")
+        self._assertResponseIsOk(response)
+        self.assertEqual(len({meme["id"] for meme in response.json()}), 5)
+
+    def test_random_memes_failure_invalid_count(self):
+        self._authenticate()
+        self._assertResponseIsBadRequest(
+            self.client.get(path="/api/async/memes/random/?count=zero")
+        )
+
+    def test_top_memes_success(self):
+        self._authenticate()
+        response = self.client.get(path="/api/async/memes/top/")
+        self._assertResponseIsOk(response)
+        self.assertEqual(
+            response.json(), self.client.get(path="/api/memes/top/").json()
+        )
+
+    def test_surprise_me_success_from_pool(self):
+        self._set_up_rendering()
+        RefillSurprisePoolService(pool_size=1, low_watermark=1).execute()
+        self._authenticate()
+        response = self.client.get(path="/api/async/memes/surprise-me/")
+        self._assertResponseIsOk(response)
+        self.assertFalse(PrerenderedMeme.objects.exists())
+        self.assertTrue(
+            response.json()["url"].endswith(Meme.objects.latest("id").image.url)
+        )
+
+
+class RenderMemeImageServiceTest(RenderingTestMixin, SimpleTestCase):
+    def setUp(self):
+        self._set_up_rendering()
+
+    @mock.patch("api.services.render_engine")
+    def test_same_meme_is_rendered_once(self, engine):
+        engine.render.return_value = b"meme"
+        first_name = RenderMemeImageService(
+            self._template_image, "Top", "Bottom"
+        ).execute()
+        second_name = RenderMemeImageService(
+            self._template_image, "Top", "Bottom"
+        ).execute()
+        self.assertEqual(first_name, second_name)
+        self.assertEqual(engine.render.call_count, 1)
+
+    @mock.patch("api.services.render_engine")
+    def test_different_texts_are_stored_separately(self, engine):
+        engine.render.return_value = b"meme"
+        first_name = RenderMemeImageService(
+            self._template_image, "Top", "Bottom"
+        ).execute()
+        second_name = RenderMemeImageService(
+            self._template_image, "Top", "Other"
+        ).execute()
+        self.assertNotEqual(first_name, second_name)
+
+
+class BatchRateMemesTest(BaseApiTest):
+    def setUp(self):
+        super().setUp()
+        self._authenticate()
+
+    def _post_batch(self, ratings: list) -> Response:
+        return self.client.post(
+            path="/api/memes/ratings/batch/",
+            data={"ratings": ratings},
+            content_type="application/json",
+        )
+
+    def test_batch_rate_success(self):
+        self.client.post(path="/api/memes/2/rate/", data={"score": 4})
+        response = self._post_batch(
+            [{"meme_id": 1, "score": 5}, {"meme_id": 2, "score": 2}]
+        )
+        self._assertResponseIsCreated(response)
+        self.assertEqual(
+            [result["status"] for result in response.json()["results"]],
+            ["created", "updated"],
+        )
+        memes = Meme.objects.in_bulk([1, 2])
+        self.assertEqual((memes[1].rating_count, memes[1].average_score), (2, 3.0))
+        self.assertEqual((memes[2].rating_count, memes[2].average_score), (2, 2.0))
+
+    def test_batch_rate_reports_errors_per_rating(self):
+        response = self._post_batch(
+            [{"meme_id": 100, "score": 5}, {"meme_id": 1, "score": 6}]
+        )
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        results = response.json()["results"]
+        self.assertEqual(results[0]["status"], "not_found")
+        self.assertIn("score", results[1]["errors"])
+
+    def test_batch_rate_uses_constant_number_of_queries(self):
+        # Savepoint, memes lock, previous scores, upsert, aggregates update and
+        # savepoint release.
+        with self.assertNumQueries(6):
+            self._post_batch(
+                [{"meme_id": meme_id, "score": 3} for meme_id in range(1, 13)]
+            )
+
+
+class MemeImageTest(RenderingTestMixin, BaseApiTest):
+    def setUp(self):
+        super().setUp()
+        self._set_up_rendering()
+        self._authenticate()
+
+    @mock.patch("api.services.render_engine")
+    def test_meme_image_is_rendered_on_first_access(self, engine):
+        engine.render.return_value = create_image_content()
+        for _ in range(2):
+            response = self.client.get(path="/api/memes/1/image/")
+            self._assertResponseIsOk(response)
+            self.assertEqual(response["Content-Type"], "image/jpeg")
+        self.assertEqual(engine.render.call_count, 1)
+        self.assertTrue(Meme.objects.get(id=1).image)
+
+    @mock.patch("api.services.render_engine")
+    def test_meme_image_is_rendered_outside_transaction(self, engine):
+        atomic_depths = []
+
+        def render(*args):
+            atomic_depths.append(len(connection.atomic_blocks))
+            return create_image_content()
+
+        engine.render.side_effect = render
+        # The test itself runs in transactions.
+        test_atomic_depth = len(connection.atomic_blocks)
+        self._assertResponseIsOk(self.client.get(path="/api/memes/1/image/"))
+        self.assertEqual(atomic_depths, [test_atomic_depth])
+
+    @mock.patch("api.services.render_engine")
+    def test_meme_image_rendered_concurrently_is_kept(self, engine):
+        def render(*args):
+            # Another process sets the image of the meme while we're rendering it.
+            Meme.objects.filter(id=1).update(image="memes/other.jpg")
+            return create_image_content()
+
+        engine.render.side_effect = render
+        self.assertEqual(MemeImageService(meme_id=1).execute(), "memes/other.jpg")
+        self.assertEqual(Meme.objects.get(id=1).image.name, "memes/other.jpg")
+
+    def test_meme_image_failure_non_existent_meme(self):
+        self._assertResponseIsNotFound(self.client.get(path="/api/memes/100/image/"))
+
+
+class MemeImageVariantTest(RenderingTestMixin, BaseApiTest):
+    def setUp(self):
+        super().setUp()
+        media_root = self._set_up_rendering(create_image_content(width=800, height=400))
+        patcher = mock.patch(
+            "api.services.image_variant_cache",
+            DiskLRUCache(directory=f"{media_root}/variants", max_bytes=1024 * 1024),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self._authenticate()
+
+    def test_meme_image_variant_by_query_params(self):
+        response = self.client.get(
+            path="/api/memes/1/image/", data={"size": "thumbnail", "format": "png"}
+        )
+        self._assertResponseIsOk(response)
+        self.assertEqual(response["Content-Type"], "image/png")
+        image = Image.open(BytesIO(response.content))
+        self.assertEqual(image.format, "PNG")
+        self.assertEqual(image.width, IMAGE_VARIANT_SIZES["thumbnail"])
+
+    def test_meme_image_variant_by_accept_header(self):
+        response = self.client.get(
+            path="/api/memes/1/image/",
+            data={"size": "medium"},
+            headers={"Accept": "image/avif,image/webp,*/*;q=0.8"},
+        )
+        self._assertResponseIsOk(response)
+        self.assertEqual(response["Content-Type"], "image/webp")
+        self.assertIn("Accept", response["Vary"])
+        self.assertEqual(Image.open(BytesIO(response.content)).format, "WEBP")
+
+        response = self.client.get(
+            path="/api/memes/1/image/", headers={"Accept": "image/webp;q=0, */*"}
+        )
+        self._assertResponseIsOk(response)
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+
+    def test_meme_image_variant_is_generated_once(self):
+        with mock.patch(
+            "api.services.render_image_variant", wraps=render_image_variant
+        ) as render:
+            for _ in range(2):
+                response = self.client.get(
+                    path="/api/memes/1/image/", data={"format": "webp"}
+                )
+                self._assertResponseIsOk(response)
+        self.assertEqual(render.call_count, 1)
+
+    def test_meme_image_variant_failure_unknown_size_or_format(self):
+        for params in ({"size": "huge"}, {"format": "gif"}):
+            self._assertResponseIsBadRequest(
+                self.client.get(path="/api/memes/1/image/", data=params)
+            )
+
+    def test_meme_images_url_map(self):
+        response = self.client.get(path="/api/memes/1/")
+        self._assertResponseIsOk(response)
+        images = response.json()["images"]
+        self.assertEqual(set(images), set(IMAGE_VARIANT_SIZES))
+        self.assertEqual(
+            images["thumbnail"]["webp"],
+            "http://testserver/api/memes/1/image/?size=thumbnail&format=webp",
+        )
+
+
+class TextLayoutTest(SimpleTestCase):
+    def test_long_text_is_wrapped_to_fit_the_width(self):
+        text = "when the code works on the first try and you don't know why"
+        layout = get_text_layout(text, 300, 100)
+        self.assertGreater(len(layout.lines), 1)
+        self.assertEqual(" ".join(layout.lines), text)
+        self.assertTrue(all(width <= 300 for width in layout.line_widths))
+        self.assertLessEqual(layout.height, 100)
+
+    def test_font_size_shrinks_for_longer_text(self):
+        short_layout = get_text_layout("Hello", 400, 100)
+        long_layout = get_text_layout("Hello " * 20, 400, 100)
+        self.assertGreater(short_layout.font_size, long_layout.font_size)
+        self.assertGreaterEqual(long_layout.font_size, MIN_FONT_SIZE)
+
+    def test_empty_text_has_no_lines(self):
+        self.assertEqual(get_text_layout("", 400, 100).lines, ())
+
+    def test_layouts_are_memoized(self):
+        get_text_layout.cache_clear()
+        for _ in range(3):
+            get_text_layout("Top text", 500, 150)
+        self.assertEqual(get_text_layout.cache_info().hits, 2)
+
+
+class TemplateNormalizationTest(SimpleTestCase):
+    def setUp(self):
+        normalized_template_cache.clear()
+
+    @override_settings(TEMPLATE_MAX_DIMENSION=500)
+    def test_large_template_is_downscaled(self):
+        img = get_normalized_template_image(create_image_content(2000, 1000))
+        self.assertEqual((img.size, img.mode), ((500, 250), "RGB"))
+        content = render_meme_image(create_image_content(2000, 1000), "Top", "Bottom")
+        self.assertEqual(Image.open(BytesIO(content)).size, (500, 250))
+
+    def test_transparent_template_is_converted_to_rgb(self):
+        png_io = BytesIO()
+        Image.new("RGBA", (100, 100), (0, 0, 0, 0)).save(png_io, format="PNG")
+        img = get_normalized_template_image(png_io.getvalue())
+        self.assertEqual(img.mode, "RGB")
+        self.assertEqual(img.getpixel((0, 0)), (255, 255, 255))
+
+    def test_normalized_template_is_cached(self):
+        content = create_image_content()
+        self.assertIs(
+            get_normalized_template_image(content),
+            get_normalized_template_image(content),
+        )
+
+    @override_settings(TEMPLATE_MAX_PIXELS=100)
+    def test_template_failure_too_many_pixels(self):
+        with self.assertRaises(Image.DecompressionBombError):
+            get_normalized_template_image(create_image_content())
+
+
+class CaptionOverlayTest(SimpleTestCase):
+    def setUp(self):
+        caption_overlay_cache.clear()
+
+    def test_overlay_is_shared_by_templates_of_similar_size(self):
+        overlay = get_caption_overlay("Top text", 600, 400, None)
+        self.assertEqual(overlay.mode, "RGBA")
+        self.assertLessEqual(overlay.width, 600)
+        self.assertIs(get_caption_overlay("Top text", 610, 405, None), overlay)
+        self.assertEqual(len(caption_overlay_cache), 1)
+
+    def test_empty_text_has_no_overlay(self):
+        self.assertIsNone(get_caption_overlay("", 600, 400, None))
+
+    def test_captions_are_composited_onto_template(self):
+        content = render_meme_image(create_image_content(600, 400), "Top", "Bottom")
+        image = Image.open(BytesIO(content))
+        self.assertEqual(image.size, (600, 400))
+        self.assertEqual(len(caption_overlay_cache), 2)
+
+
+class SingleFlightTest(SimpleTestCase):
+    def test_concurrent_calls_are_coalesced(self):
+        single_flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def function():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return "result"
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            leader = executor.submit(single_flight.do, "key", function)
+            started.wait(5)
+            followers = [
+                executor.submit(single_flight.do, "key", function) for _ in range(3)
+            ]
+            # Give the followers time to join the call of the leader.
+            time.sleep(0.2)
+            release.set()
+            results = [future.result() for future in (leader, *followers)]
+
+        self.assertEqual(results, ["result"] * 4)
+        self.assertEqual(len(calls), 1)
+
+
+@override_settings(DATABASE_REPLICAS=["replica_1"], READ_YOUR_WRITES_SECONDS=5)
+class ReplicaRoutingTest(SimpleTestCase):
+    # Unlike TestCase, SimpleTestCase doesn't run the tests in a transaction, which
+    # would send all the reads to the primary.
+    databases = {"default"}
+
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+
+    def _read_database(self, request) -> str:
+        databases = []
+
+        def get_response(request):
+            databases.append(router.db_for_read(Meme))
+            return HttpResponse()
+
+        ReplicaRoutingMiddleware(get_response)(request)
+        return databases[0]
+
+    def _request(self, method: str = "get", user_id: int = 1):
+        token = AccessToken.for_user(User(id=user_id))
+        return getattr(self.factory, method)(
+            "/api/memes/", HTTP_AUTHORIZATION=f"Bearer {token}"
+        )
+
+    def test_safe_request_reads_from_replica(self):
+        self.assertEqual(self._read_database(self._request()), "replica_1")
+
+    def test_unsafe_request_reads_from_primary(self):
+        self.assertEqual(self._read_database(self._request("post")), "default")
+
+    def test_reads_outside_requests_use_primary(self):
+        self.assertEqual(router.db_for_read(Meme), "default")
+        self.assertEqual(router.db_for_write(Meme), "default")
+
+    def test_reads_in_atomic_block_use_primary(self):
+        def get_response(request):
+            with transaction.atomic():
+                databases.append(router.db_for_read(Meme))
+            databases.append(router.db_for_read(Meme))
+            return HttpResponse()
+
+        databases = []
+        ReplicaRoutingMiddleware(get_response)(self.factory.get("/api/memes/"))
+        self.assertEqual(databases, ["default", "replica_1"])
+
+    def test_reads_after_write_use_primary(self):
+        self._read_database(self._request("post"))
+
+        self.assertEqual(self._read_database(self._request()), "default")
+        self.assertEqual(self._read_database(self._request(user_id=2)), "replica_1")
+
+    @override_settings(READ_YOUR_WRITES_SECONDS=0)
+    def test_reads_use_replica_after_window(self):
+        self._read_database(self._request("post"))
+
+        self.assertEqual(self._read_database(self._request()), "replica_1")
+
+    def test_reads_after_session_login_use_primary(self):
+        def login(request):
+            response = HttpResponse()
+            response.set_cookie(settings.SESSION_COOKIE_NAME, "new-session")
+            return response
+
+        ReplicaRoutingMiddleware(login)(self.factory.post("/admin/login/"))
+        request = self.factory.get("/admin/")
+        request.COOKIES[settings.SESSION_COOKIE_NAME] = "new-session"
+
+        self.assertEqual(self._read_database(request), "default")
+        self.assertEqual(self._read_database(self.factory.get("/admin/")), "replica_1")
+
+    def test_reads_after_write_in_safe_request_use_primary(self):
+        def get_response(request):
+            databases.append(router.db_for_read(Meme))
+            router.db_for_write(Meme)
+            databases.append(router.db_for_read(Meme))
+            return HttpResponse()
+
+        databases = []
+        ReplicaRoutingMiddleware(get_response)(self._request())
+        self.assertEqual(databases, ["replica_1", "default"])
+        self.assertEqual(self._read_database(self._request()), "default")
+
+    def test_async_safe_request_reads_from_replica(self):
+        async def get_response(request):
+            databases.append(router.db_for_read(Meme))
+            return HttpResponse()
+
+        databases = []
+        middleware = ReplicaRoutingMiddleware(get_response)
+        async_to_sync(middleware)(self._request())
+        async_to_sync(middleware)(self._request("post"))
+        async_to_sync(middleware)(self._request())
+        self.assertEqual(databases, ["replica_1", "default", "default"])
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_middleware_not_used_without_replicas(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            ReplicaRoutingMiddleware(lambda request: HttpResponse())
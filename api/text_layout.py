@@ -0,0 +1,132 @@
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+
+from django.conf import settings
+from PIL import ImageFont
+
+# Limits of the font size of captions in pixels. The largest size also depends on the
+# height of the image, so that captions stay proportional to it.
+MIN_FONT_SIZE = 10
+MAX_FONT_SIZE = 120
+# Captions take at most this share of the height of the image.
+MAX_CAPTION_HEIGHT_RATIO = 0.3
+# Layouts are memoized per worker process. Captions mostly come from a small fixed set
+# and templates have a few distinct widths, so the cache is usually hit.
+LAYOUT_CACHE_SIZE = 4096
+
+
+@dataclass(frozen=True)
+class TextLayout:
+    font_size: int
+    stroke_width: int
+    line_height: int
+    lines: tuple[str, ...]
+    line_widths: tuple[int, ...]
+
+    @property
+    def height(self) -> int:
+        return self.line_height * len(self.lines)
+
+
+def get_font_path() -> Optional[str]:
+    return settings.MEME_FONT_PATH or None
+
+
+@lru_cache(maxsize=None)
+def get_font(size: int, path: Optional[str] = None) -> ImageFont.FreeTypeFont:
+    """
+    This function is used to load the caption font of the given size. Fonts are loaded
+    once per process. Without a configured font file, the TrueType font bundled with
+    Pillow is used.
+    """
+    if path is None:
+        return ImageFont.load_default(size)
+    return ImageFont.truetype(path, size)
+
+
+@lru_cache(maxsize=LAYOUT_CACHE_SIZE * 16)
+def _get_text_width(
+    text: str, font_size: int, stroke_width: int, font_path: Optional[str]
+) -> int:
+    return round(get_font(font_size, font_path).getlength(text)) + 2 * stroke_width
+
+
+def _get_stroke_width(font_size: int) -> int:
+    return max(1, font_size // 15)
+
+
+def _wrap_words(
+    words: list[str], max_width: int, font_size: int, font_path: Optional[str]
+) -> Optional[list[str]]:
+    """
+    This function is used to greedily break the words into lines that fit the width.
+    If a single word doesn't fit the width, the words can't be wrapped with this font
+    size, and None is returned.
+    """
+    stroke_width = _get_stroke_width(font_size)
+    lines: list[str] = []
+    for word in words:
+        if _get_text_width(word, font_size, stroke_width, font_path) > max_width:
+            return None
+        candidate = f"{lines[-1]} {word}" if lines else word
+        if lines and (
+            _get_text_width(candidate, font_size, stroke_width, font_path) <= max_width
+        ):
+            lines[-1] = candidate
+        else:
+            lines.append(word)
+    return lines
+
+
+def _get_line_height(font_size: int, font_path: Optional[str]) -> int:
+    ascent, descent = get_font(font_size, font_path).getmetrics()
+    return ascent + descent + 2 * _get_stroke_width(font_size)
+
+
+def _build_layout(
+    lines: list[str], font_size: int, font_path: Optional[str]
+) -> TextLayout:
+    stroke_width = _get_stroke_width(font_size)
+    return TextLayout(
+        font_size=font_size,
+        stroke_width=stroke_width,
+        line_height=_get_line_height(font_size, font_path),
+        lines=tuple(lines),
+        line_widths=tuple(
+            _get_text_width(line, font_size, stroke_width, font_path) for line in lines
+        ),
+    )
+
+
+@lru_cache(maxsize=LAYOUT_CACHE_SIZE)
+def get_text_layout(
+    text: str, max_width: int, max_height: int, font_path: Optional[str] = None
+) -> TextLayout:
+    """
+    This function is used to lay out a caption in a box of the given size. The font
+    size is the largest one with which the wrapped caption fits the box, found by a
+    binary search. If the caption doesn't fit even with the smallest font size, it is
+    wrapped with the smallest size and may overflow the box.
+    """
+    words = text.split()
+    if not words:
+        return _build_layout([], MIN_FONT_SIZE, font_path)
+
+    best_lines, best_size = None, MIN_FONT_SIZE
+    low, high = MIN_FONT_SIZE, max(MIN_FONT_SIZE, min(MAX_FONT_SIZE, max_height))
+    while low <= high:
+        font_size = (low + high) // 2
+        lines = _wrap_words(words, max_width, font_size, font_path)
+        if (
+            lines is not None
+            and _get_line_height(font_size, font_path) * len(lines) <= max_height
+        ):
+            best_lines, best_size = lines, font_size
+            low = font_size + 1
+        else:
+            high = font_size - 1
+
+    if best_lines is None:
+        best_lines = _wrap_words(words, max_width, MIN_FONT_SIZE, font_path) or words
+    return _build_layout(best_lines, best_size, font_path)
@@ -1,12 +1,25 @@
 from django.urls import path
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
+from api.async_views import (
+    AsyncListTemplatesView,
+    AsyncMemesView,
+    AsyncMemeView,
+    AsyncRandomMemeView,
+    AsyncSurpriseMeMemeView,
+    AsyncTopMemesView,
+)
 from api.views import (
+    BatchCreateMemesView,
+    BatchRateMemesView,
     ListTemplatesView,
+    MemeImageView,
     MemesView,
     MemeView,
+    OutboundHttpMetricsView,
     RandomMemeView,
     RateMemeView,
+    ReadinessView,
     RegisterView,
     SurpriseMeMemeView,
     TopMemesView,
@@ -18,9 +31,32 @@ urlpatterns = [
     path("token/refresh/", TokenRefreshView.as_view(), name="token_refresh"),
     path("templates/", ListTemplatesView.as_view(), name="list_templates"),
     path("memes/", MemesView.as_view(), name="list_memes"),
+    path("memes/batch/", BatchCreateMemesView.as_view(), name="batch_create_memes"),
+    path("memes/ratings/batch/", BatchRateMemesView.as_view(), name="batch_rate_memes"),
     path("memes/<int:id>/", MemeView.as_view(), name="meme"),
+    path("memes/<int:id>/image/", MemeImageView.as_view(), name="meme_image"),
     path("memes/<int:id>/rate/", RateMemeView.as_view(), name="rate_meme"),
     path("memes/random/", RandomMemeView.as_view(), name="random_meme"),
     path("memes/top/", TopMemesView.as_view(), name="top_memes"),
     path("memes/surprise-me/", SurpriseMeMemeView.as_view(), name="surprise_me_meme"),
+    path(
+        "metrics/outbound-http/",
+        OutboundHttpMetricsView.as_view(),
+        name="outbound_http_metrics",
+    ),
+    path("health/ready/", ReadinessView.as_view(), name="readiness"),
+    # Asynchronous versions of the read endpoints, meant to be served by an ASGI
+    # server.
+    path("async/templates/", AsyncListTemplatesView.as_view(), name="async_templates"),
+    path("async/memes/", AsyncMemesView.as_view(), name="async_list_memes"),
+    path("async/memes/<int:id>/", AsyncMemeView.as_view(), name="async_meme"),
+    path(
+        "async/memes/random/", AsyncRandomMemeView.as_view(), name="async_random_meme"
+    ),
+    path("async/memes/top/", AsyncTopMemesView.as_view(), name="async_top_memes"),
+    path(
+        "async/memes/surprise-me/",
+        AsyncSurpriseMeMemeView.as_view(),
+        name="async_surprise_me_meme",
+    ),
 ]
@@ -1,12 +1,29 @@
+from datetime import datetime
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
 from rest_framework import status
 from rest_framework.generics import GenericAPIView, ListAPIView, RetrieveAPIView
 from rest_framework.pagination import PageNumberPagination
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAdminUser
 from rest_framework.response import Response
 
+from api.consts import (
+    DEFAULT_IMAGE_VARIANT_FORMAT,
+    DEFAULT_IMAGE_VARIANT_SIZE,
+    IMAGE_VARIANT_FORMATS,
+    IMAGE_VARIANT_SIZES,
+)
 from api.dto import MemeDTO, RateMemeDTO
-from api.models import Meme, MemeTemplate, User
+from api.models import Meme, User
+from api.pagination import MemeCursorPagination
+from api.registry import template_registry
 from api.serializers import (
+    BatchCreateMemeSerializer,
+    BatchRateMemeItemSerializer,
+    BatchRateMemeSerializer,
     CreateMemeSerializer,
     MemeSerializer,
     MemeTemplateSerializer,
@@ -17,10 +34,16 @@ from api.serializers import (
     SurpriseMemeSerializer,
 )
 from api.services import (
+    BatchCreateMemeService,
+    BatchRateMemesService,
     CreateMemeService,
+    MemeImageVariantService,
     RateMemeService,
     SurpriseMeMemeService,
 )
+from api.template_cache import template_fetcher
+from core.conditional import ConditionalGetMixin
+from core.exceptions import BadRequestError, ServiceUnavailableError
 
 
 class RegisterView(GenericAPIView):
@@ -38,16 +61,46 @@ class RegisterView(GenericAPIView):
         return Response(status=status.HTTP_201_CREATED)
 
 
-class ListTemplatesView(ListAPIView):
+class ListTemplatesView(ConditionalGetMixin, ListAPIView):
     serializer_class = MemeTemplateSerializer
-    queryset = MemeTemplate.objects.all()
+
+    def get_version_marker(self) -> str:
+        return template_registry.version
+
+    def get_queryset(self):
+        return template_registry.all()
 
 
-class MemesView(ListAPIView):
+class MemesView(ConditionalGetMixin, ListAPIView):
     serializer_class = MemeSerializer
     queryset = Meme.objects.all_with_joins()
     pagination_class = PageNumberPagination
 
+    def _get_list_version(self) -> tuple[str, datetime]:
+        if not hasattr(self, "_list_version"):
+            self._list_version = Meme.objects.get_list_version()
+        return self._list_version
+
+    def get_version_marker(self) -> str:
+        return f"{self._get_list_version()[0]}:{template_registry.version}"
+
+    def get_last_modified(self) -> datetime:
+        return self._get_list_version()[1]
+
+    @property
+    def paginator(self):
+        """
+        The memes can be paginated either by page numbers or by cursors. The cursor
+        mode is used when the client asks for it or sends a cursor.
+        """
+        if not hasattr(self, "_paginator"):
+            self._paginator = (
+                MemeCursorPagination()
+                if MemeCursorPagination.is_requested(self.request)
+                else self.pagination_class()
+            )
+        return self._paginator
+
     def post(self, request, *args, **kwargs):
         serializer = CreateMemeSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -58,13 +111,116 @@ class MemesView(ListAPIView):
         return Response(data={"meme_id": meme_id}, status=status.HTTP_201_CREATED)
 
 
-class MemeView(RetrieveAPIView):
+class BatchCreateMemesView(GenericAPIView):
+    serializer_class = BatchCreateMemeSerializer
+
+    def post(self, request, *args, **kwargs):
+        """
+        Every meme of the batch is validated on its own, and the invalid ones get their
+        errors in the results instead of failing the whole batch. The results are in
+        the same order as the memes in the request.
+        """
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        results = []
+        memes_data = []
+        for meme in serializer.validated_data["memes"]:
+            meme_serializer = CreateMemeSerializer(data=meme)
+            if meme_serializer.is_valid():
+                memes_data.append(
+                    MemeDTO(
+                        created_by_id=request.user.id, **meme_serializer.validated_data
+                    )
+                )
+                results.append(None)
+            else:
+                results.append({"errors": meme_serializer.errors})
+
+        created = iter(BatchCreateMemeService(memes_data).execute())
+        results = [result or next(created) for result in results]
+        response_status = (
+            status.HTTP_201_CREATED
+            if all("meme_id" in result for result in results)
+            else status.HTTP_207_MULTI_STATUS
+        )
+        return Response(data={"results": results}, status=response_status)
+
+
+class MemeView(ConditionalGetMixin, RetrieveAPIView):
     serializer_class = MemeSerializer
 
+    def _get_updated_at(self) -> datetime:
+        if not hasattr(self, "_updated_at"):
+            self._updated_at = Meme.objects.get_meme_version_or_404(self.kwargs["id"])
+        return self._updated_at
+
+    def _get_list_version(self) -> tuple[str, datetime]:
+        if not hasattr(self, "_list_version"):
+            self._list_version = Meme.objects.get_list_version()
+        return self._list_version
+
+    def get_last_modified(self) -> datetime:
+        """
+        The meme is shown with its template and its author, which are changed apart
+        from the meme itself. Their changes are covered by the version of the memes
+        list.
+        """
+        return max(self._get_updated_at(), self._get_list_version()[1])
+
+    def get_version_marker(self) -> str:
+        return (
+            f"{self._get_updated_at()}:{self._get_list_version()[0]}:"
+            f"{template_registry.version}"
+        )
+
     def get_object(self):
         return Meme.objects.get_meme_with_joins_or_404(self.kwargs["id"])
 
 
+class MemeImageView(GenericAPIView):
+    def perform_content_negotiation(self, request, force=False):
+        # The response is an image, so it must not be rejected by the JSON renderer.
+        return super().perform_content_negotiation(request, force=True)
+
+    @staticmethod
+    def _get_size(request) -> str:
+        size = request.query_params.get("size", DEFAULT_IMAGE_VARIANT_SIZE)
+        if size not in IMAGE_VARIANT_SIZES:
+            raise BadRequestError()
+        return size
+
+    @staticmethod
+    def _get_format(request) -> str:
+        """
+        This method is used to get the format of the image. An explicit format query
+        parameter wins, otherwise we serve WebP to the clients that accept it, and
+        JPEG to everyone else.
+        """
+        if (image_format := request.query_params.get("format")) is not None:
+            if image_format not in IMAGE_VARIANT_FORMATS:
+                raise BadRequestError()
+            return image_format
+
+        accepted_types = set()
+        for media_range in request.headers.get("Accept", "").split(","):
+            media_type, *params = (part.strip() for part in media_range.split(";"))
+            if "q=0" not in params and "q=0.0" not in params:
+                accepted_types.add(media_type.lower())
+        if IMAGE_VARIANT_FORMATS["webp"]["content_type"] in accepted_types:
+            return "webp"
+        return DEFAULT_IMAGE_VARIANT_FORMAT
+
+    def get(self, request, *args, **kwargs):
+        content, content_type = MemeImageVariantService(
+            kwargs["id"], self._get_size(request), self._get_format(request)
+        ).execute()
+        response = HttpResponse(content, content_type=content_type)
+        response["Cache-Control"] = "private, max-age=86400"
+        patch_vary_headers(response, ("Accept",))
+        return response
+
+
 class RateMemeView(GenericAPIView):
     serializer_class = RateMemeSerializer
 
@@ -76,26 +232,115 @@ class RateMemeView(GenericAPIView):
             RateMemeDTO(
                 meme_id=kwargs["id"],
                 user_id=request.user.id,
-                **serializer.validated_data
+                **serializer.validated_data,
             )
         ).execute()
         return Response(data={"rating_id": rating_id}, status=status.HTTP_201_CREATED)
 
 
+class BatchRateMemesView(GenericAPIView):
+    serializer_class = BatchRateMemeSerializer
+
+    def post(self, request, *args, **kwargs):
+        """
+        Every rating of the batch is validated on its own, and the invalid ones get
+        their errors in the results instead of failing the whole batch. The results
+        are in the same order as the ratings in the request.
+        """
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        results = []
+        ratings = []
+        for rating in serializer.validated_data["ratings"]:
+            rating_serializer = BatchRateMemeItemSerializer(data=rating)
+            if rating_serializer.is_valid():
+                ratings.append(
+                    RateMemeDTO(
+                        user_id=request.user.id, **rating_serializer.validated_data
+                    )
+                )
+                results.append(None)
+            else:
+                results.append({"errors": rating_serializer.errors})
+
+        rated = iter(BatchRateMemesService(request.user.id, ratings).execute())
+        results = [result or next(rated) for result in results]
+        response_status = (
+            status.HTTP_201_CREATED
+            if all(result.get("status") in ("created", "updated") for result in results)
+            else status.HTTP_207_MULTI_STATUS
+        )
+        return Response(data={"results": results}, status=response_status)
+
+
 class RandomMemeView(RetrieveAPIView):
     serializer_class = ShortMemeSerializer
 
     def get_object(self):
         return Meme.objects.get_random_meme()
 
+    def _get_count(self) -> int:
+        try:
+            count = int(self.request.query_params["count"])
+        except ValueError:
+            raise BadRequestError()
+        if not 1 <= count <= settings.RANDOM_MEMES_MAX_COUNT:
+            raise BadRequestError()
+        return count
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        A single random meme is returned by default. If the count parameter is passed,
+        we return a list of that many distinct random memes instead.
+        """
+        if "count" not in request.query_params:
+            return super().retrieve(request, *args, **kwargs)
+        memes = Meme.objects.get_random_memes(self._get_count())
+        return Response(self.get_serializer(memes, many=True).data)
+
 
-class TopMemesView(ListAPIView):
+class TopMemesView(ConditionalGetMixin, ListAPIView):
     serializer_class = RatedMemeSerializer
     queryset = Meme.objects.get_top_memes()
 
+    def get_version_marker(self) -> str:
+        # The version of the memes list covers the authors and the templates.
+        return (
+            f"{Meme.objects.get_top_memes_version()}:"
+            f"{Meme.objects.get_list_version()[0]}:{template_registry.version}"
+        )
+
 
 class SurpriseMeMemeView(RetrieveAPIView):
     serializer_class = SurpriseMemeSerializer
 
     def get_object(self):
         return SurpriseMeMemeService(user_id=self.request.user.id).execute()
+
+
+class OutboundHttpMetricsView(GenericAPIView):
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request, *args, **kwargs):
+        return Response(data=template_fetcher.get_metrics())
+
+
+class ReadinessView(GenericAPIView):
+    permission_classes = (AllowAny,)
+    authentication_classes = ()
+
+    def get(self, request, *args, **kwargs):
+        """
+        The worker is ready to serve when it can query the databases, including the
+        read replicas, and its template registry is loaded. Load balancers send traffic
+        only to ready workers.
+        """
+        try:
+            for database in connections.all():
+                with database.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+            template_registry.all()
+        except DatabaseError:
+            raise ServiceUnavailableError()
+        return Response(data={"status": "ready"})
@@ -0,0 +1,85 @@
+import time
+from importlib import import_module
+from typing import Callable
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.migrations.executor import MigrationExecutor
+from PIL import Image
+
+from api.registry import template_registry
+from api.text_layout import MAX_FONT_SIZE, MIN_FONT_SIZE, get_font, get_font_path
+
+
+class UnappliedMigrationsError(Exception):
+    pass
+
+
+def check_migrations() -> None:
+    """
+    This function is used to make sure that the database schema is up to date. The
+    server must not start against an old schema, and migrating is a separate step of
+    a deployment, so we only check and raise an UnappliedMigrationsError.
+    """
+    executor = MigrationExecutor(connections[DEFAULT_DB_ALIAS])
+    if plan := executor.migration_plan(executor.loader.graph.leaf_nodes()):
+        raise UnappliedMigrationsError(
+            "Unapplied migrations: "
+            + ", ".join(
+                f"{migration.app_label}.{migration.name}" for migration, _ in plan
+            )
+        )
+
+
+def preload_process_state() -> None:
+    """
+    This function is used to load the state that every worker would otherwise load on
+    its first requests: the views and everything they import, the image plugins of
+    Pillow, the caption font in every size and the template registry. It's called in
+    the master process of gunicorn before the workers are forked, so that the workers
+    share this memory copy-on-write.
+    """
+    import_module(settings.ROOT_URLCONF)
+    Image.init()
+    font_path = get_font_path()
+    for size in range(MIN_FONT_SIZE, MAX_FONT_SIZE + 1):
+        get_font(size, font_path)
+    template_registry.all()
+
+
+def open_connections() -> None:
+    for connection in connections.all():
+        connection.ensure_connection()
+
+
+def close_connections() -> None:
+    """
+    This function is used to close the connections opened while warming up. Sockets
+    must not be shared by forked workers, so they open their own connections. The
+    pools of connections are closed as well, because their threads don't survive a
+    fork.
+    """
+    connections.close_all()
+    for connection in connections.all():
+        if hasattr(connection, "close_pool"):
+            connection.close_pool()
+    caches.close_all()
+
+
+def run_startup_checks() -> dict[str, float]:
+    """
+    This function is used to make sure that the server can start: the databases are
+    reachable and the schema is up to date. It returns the time in seconds that every
+    step has taken, so that slow starts can be spotted.
+    """
+    steps: dict[str, Callable[[], None]] = {
+        "connections": open_connections,
+        "migrations": check_migrations,
+    }
+    timings = {}
+    for name, step in steps.items():
+        started_at = time.perf_counter()
+        step()
+        timings[name] = time.perf_counter() - started_at
+    return timings
@@ -0,0 +1,68 @@
+from typing import Any
+
+from django.contrib.auth import get_user_model
+from django.http import HttpRequest, HttpResponse, JsonResponse
+from django.views import View
+from rest_framework.settings import api_settings as drf_settings
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+
+from core.exceptions import ExceptionHandlerError, UnauthorizedError
+
+
+async def authenticate_async(request: HttpRequest):
+    """
+    This function is used to authenticate a request by its JWT access token with the
+    default authentication class of DRF. Validating the token is pure CPU work, so
+    it's done in the event loop. Classes that can build the user without blocking
+    provide an aget_user method, otherwise the user is loaded with the async ORM.
+    """
+    authentication = drf_settings.DEFAULT_AUTHENTICATION_CLASSES[0]()
+    if (header := authentication.get_header(request)) is None:
+        raise UnauthorizedError()
+    if (raw_token := authentication.get_raw_token(header)) is None:
+        raise UnauthorizedError()
+    try:
+        validated_token = authentication.get_validated_token(raw_token)
+        if hasattr(authentication, "aget_user"):
+            return await authentication.aget_user(validated_token)
+        user_id = validated_token[api_settings.USER_ID_CLAIM]
+    except (InvalidToken, TokenError, KeyError):
+        raise UnauthorizedError()
+
+    user = (
+        await get_user_model()
+        .objects.filter(**{api_settings.USER_ID_FIELD: user_id})
+        .afirst()
+    )
+    if user is None or not user.is_active:
+        raise UnauthorizedError()
+    return user
+
+
+class AsyncAPIView(View):
+    """
+    Base class of asynchronous JSON views, which are served without DRF, because DRF
+    views are synchronous. Requests are authenticated by their JWT access token unless
+    the view allows anonymous access, and the errors of the ExceptionHandlerError
+    family are turned into empty responses with their status, like the exception
+    handler of the synchronous views does.
+    """
+
+    authentication_required = True
+
+    async def dispatch(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        try:
+            if self.authentication_required:
+                request.user = await authenticate_async(request)
+            return await super().dispatch(request, *args, **kwargs)
+        except UnauthorizedError as error:
+            response = HttpResponse(status=error.status)
+            response["WWW-Authenticate"] = 'Bearer realm="api"'
+            return response
+        except ExceptionHandlerError as error:
+            return HttpResponse(status=error.status)
+
+    @staticmethod
+    def json(data: Any, status: int = 200) -> JsonResponse:
+        return JsonResponse(data, status=status, safe=False)
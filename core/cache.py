@@ -0,0 +1,145 @@
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Hashable, Optional
+
+
+class MemoryLRUCache:
+    """
+    Thread-safe in-process LRU cache. The cache is bounded by the total size of the
+    stored values (as reported by the sizeof callable) rather than by the number of
+    entries, so that a few large values cannot blow up the memory of the worker.
+    """
+
+    def __init__(self, max_bytes: int, sizeof: Callable[[Any], int] = len):
+        self._max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._entries: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            if (entry := self._entries.get(key)) is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        size = self._sizeof(value)
+        with self._lock:
+            self._pop(key)
+            if size > self._max_bytes:
+                return
+            self._entries[key] = (value, size)
+            self._size += size
+            while self._size > self._max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._pop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _pop(self, key: Hashable) -> None:
+        if (entry := self._entries.pop(key, None)) is not None:
+            self._size -= entry[1]
+
+
+class DiskLRUCache:
+    """
+    On-disk LRU cache that stores every value as a separate file in a directory. The
+    modification time of a file is used as its last access time, so the cache can be
+    shared between the worker processes of the same host. Writes are atomic, and the
+    directory is trimmed to the configured size limit after every write. The size of
+    the directory is taken from the disk rather than counted by every process, so that
+    the writes of all processes count towards the limit.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self._directory = Path(directory)
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        return sum(file_size for _, _, file_size in self._scan())
+
+    def path(self, key: str) -> Path:
+        return self._directory / key
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self.path(key)
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        self.touch(key)
+        return data
+
+    def touch(self, key: str) -> None:
+        try:
+            os.utime(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def set(self, key: str, data: bytes) -> Path:
+        self._directory.mkdir(parents=True, exist_ok=True)
+        path = self.path(key)
+        tmp_path = path.with_name(f".{key}.{os.getpid()}.{threading.get_ident()}")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+        # Writes are rare compared to reads, which don't scan the directory.
+        with self._lock:
+            self._evict()
+        return path
+
+    def delete(self, key: str) -> None:
+        try:
+            self.path(key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def _scan(self) -> list[tuple[float, Path, int]]:
+        if not self._directory.exists():
+            return []
+        files = []
+        for entry in os.scandir(self._directory):
+            if entry.name.startswith(".") or not entry.is_file():
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, Path(entry.path), stat.st_size))
+        return files
+
+    def _evict(self) -> None:
+        """
+        This method is used to remove the least recently used files until the
+        directory fits into the size limit. The directory is scanned every time,
+        because other processes may have written to it since our last write.
+        """
+        files = sorted(self._scan())
+        size = sum(file_size for _, _, file_size in files)
+        for _, path, file_size in files:
+            if size <= self._max_bytes:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            size -= file_size
@@ -0,0 +1,59 @@
+import hashlib
+from datetime import datetime
+from typing import Optional
+
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+from rest_framework import status
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+
+class ConditionalGetMixin:
+    """
+    Adds support of conditional GET requests to a view. The view provides a cheap
+    version marker of its response, which is hashed together with the requested URL
+    into a strong ETag. If the client already has the current version, it gets
+    304 Not Modified, and neither the main query nor the serializer is run.
+    """
+
+    def get_version_marker(self) -> str:
+        raise NotImplementedError()
+
+    def get_last_modified(self) -> Optional[datetime]:
+        return None
+
+    @staticmethod
+    def _is_not_modified(
+        request: Request, etag: str, last_modified: Optional[datetime]
+    ) -> bool:
+        """
+        This method is used to evaluate the preconditions of the request. According
+        to RFC 9110, If-Modified-Since is ignored when If-None-Match is present.
+        """
+        if if_none_match := request.headers.get("If-None-Match"):
+            etags = parse_etags(if_none_match)
+            return "*" in etags or etag in etags
+        if_modified_since = parse_http_date_safe(
+            request.headers.get("If-Modified-Since", "")
+        )
+        return (
+            if_modified_since is not None
+            and last_modified is not None
+            and int(last_modified.timestamp()) <= if_modified_since
+        )
+
+    def get(self, request: Request, *args, **kwargs) -> Response:
+        marker = f"{request.get_full_path()}:{self.get_version_marker()}"
+        etag = f'"{hashlib.sha256(marker.encode()).hexdigest()[:32]}"'
+        last_modified = self.get_last_modified()
+
+        if self._is_not_modified(request, etag, last_modified):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = super().get(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+        response["ETag"] = etag
+        if last_modified is not None:
+            response["Last-Modified"] = http_date(last_modified.timestamp())
+        return response
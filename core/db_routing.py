@@ -0,0 +1,188 @@
+import random
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Optional
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.http import HttpRequest, HttpResponse
+from rest_framework_simplejwt.exceptions import TokenBackendError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.state import token_backend
+
+SAFE_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+PINNED_CLIENT_CACHE_KEY = "primary_pinned:{client}"
+
+
+@dataclass
+class RequestRouting:
+    use_replicas: bool
+    has_written: bool = False
+
+
+# The routing of the current request. There is none outside of requests, so management
+# commands and background jobs always use the primary.
+_request_routing: ContextVar[Optional[RequestRouting]] = ContextVar(
+    "request_routing", default=None
+)
+
+
+class ReplicaRouter:
+    """
+    Sends the reads of safe requests to a random replica (settings.DATABASE_REPLICAS)
+    and everything else to the primary: writes, the reads of unsafe requests, of
+    requests that have written and of clients that have written recently, the reads
+    inside atomic() blocks and the reads outside of requests. The decision for a
+    request is made by ReplicaRoutingMiddleware.
+    """
+
+    def db_for_read(self, model, **hints) -> str:
+        if (
+            (routing := _request_routing.get()) is None
+            or not routing.use_replicas
+            # A transaction must see its own writes and a consistent snapshot.
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return DEFAULT_DB_ALIAS
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints) -> str:
+        # Some safe requests write as well, e.g. surprise-me creates a meme. The rest
+        # of the request and the following requests of the client must see the write.
+        if (routing := _request_routing.get()) is not None:
+            routing.use_replicas = False
+            routing.has_written = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints) -> bool:
+        # The replicas hold the same data as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints) -> bool:
+        # The schema reaches the replicas through the replication.
+        return db == DEFAULT_DB_ALIAS
+
+
+def _get_token_user_id(request: HttpRequest) -> Optional[str]:
+    header = request.headers.get("Authorization", "").split()
+    if len(header) != 2 or header[0] not in api_settings.AUTH_HEADER_TYPES:
+        return None
+    # The token is only used to pick a database, so its signature doesn't need to be
+    # verified: the view authenticates the request anyway.
+    try:
+        payload = token_backend.decode(header[1], verify=False)
+    except TokenBackendError:
+        return None
+    return payload.get(api_settings.USER_ID_CLAIM)
+
+
+def _get_client_key(
+    request: HttpRequest, response: Optional[HttpResponse] = None
+) -> Optional[str]:
+    """
+    This function is used to identify the client of a request by the user of its
+    access token or, for the admin, by its session. The session key changes when a
+    user logs in, so the key set by the response is preferred.
+    """
+    if (user_id := _get_token_user_id(request)) is not None:
+        return f"user:{user_id}"
+    session_key = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if response is not None and settings.SESSION_COOKIE_NAME in response.cookies:
+        session_key = (
+            response.cookies[settings.SESSION_COOKIE_NAME].value or session_key
+        )
+    return f"session:{session_key}" if session_key else None
+
+
+def pin_to_primary(client_key: str) -> None:
+    """
+    This function is used to send the reads of the client to the primary for
+    settings.READ_YOUR_WRITES_SECONDS, so that the client sees its own writes while the
+    replicas catch up. The pins are kept in the shared cache, so they apply to all
+    workers.
+    """
+    cache.set(
+        PINNED_CLIENT_CACHE_KEY.format(client=client_key),
+        True,
+        timeout=settings.READ_YOUR_WRITES_SECONDS,
+    )
+
+
+async def apin_to_primary(client_key: str) -> None:
+    await cache.aset(
+        PINNED_CLIENT_CACHE_KEY.format(client=client_key),
+        True,
+        timeout=settings.READ_YOUR_WRITES_SECONDS,
+    )
+
+
+def is_pinned_to_primary(client_key: str) -> bool:
+    return cache.get(PINNED_CLIENT_CACHE_KEY.format(client=client_key), False)
+
+
+async def ais_pinned_to_primary(client_key: str) -> bool:
+    return await cache.aget(PINNED_CLIENT_CACHE_KEY.format(client=client_key), False)
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Lets the reads of safe requests go to the replicas, unless the client is pinned
+    to the primary, and pins the clients of requests that have written. It supports
+    both the synchronous and the asynchronous request handling, and it's left out of
+    the middleware chain when there are no replicas.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.DATABASE_REPLICAS:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    @staticmethod
+    def _get_pinned_client_key(
+        request: HttpRequest, response: HttpResponse, routing: RequestRouting
+    ) -> Optional[str]:
+        # Failed requests may have written as well, so they pin the client too.
+        if request.method in SAFE_METHODS and not routing.has_written:
+            return None
+        return _get_client_key(request, response)
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        use_replicas = request.method in SAFE_METHODS and not (
+            (client_key := _get_client_key(request))
+            and is_pinned_to_primary(client_key)
+        )
+        routing = RequestRouting(use_replicas=use_replicas)
+        context_token = _request_routing.set(routing)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_routing.reset(context_token)
+        if client_key := self._get_pinned_client_key(request, response, routing):
+            pin_to_primary(client_key)
+        return response
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponse:
+        use_replicas = request.method in SAFE_METHODS and not (
+            (client_key := _get_client_key(request))
+            and await ais_pinned_to_primary(client_key)
+        )
+        routing = RequestRouting(use_replicas=use_replicas)
+        context_token = _request_routing.set(routing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_routing.reset(context_token)
+        if client_key := self._get_pinned_client_key(request, response, routing):
+            await apin_to_primary(client_key)
+        return response
@@ -17,3 +17,15 @@ class BadRequestError(ExceptionHandlerError, status=http_status.HTTP_400_BAD_REQ
 
 class NotFoundError(ExceptionHandlerError, status=http_status.HTTP_404_NOT_FOUND):
     pass
+
+
+class ServiceUnavailableError(
+    ExceptionHandlerError, status=http_status.HTTP_503_SERVICE_UNAVAILABLE
+):
+    pass
+
+
+class UnauthorizedError(
+    ExceptionHandlerError, status=http_status.HTTP_401_UNAUTHORIZED
+):
+    pass
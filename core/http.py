@@ -0,0 +1,345 @@
+import asyncio
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Mapping, Optional
+from urllib.parse import urlsplit
+from weakref import WeakKeyDictionary
+
+import httpx
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+CHUNK_SIZE = 64 * 1024
+
+
+class FetchError(Exception):
+    pass
+
+
+class CircuitOpenError(FetchError):
+    pass
+
+
+class ResponseTooLargeError(FetchError):
+    pass
+
+
+class FetchCancelledError(FetchError):
+    pass
+
+
+@dataclass
+class FetchResponse:
+    status_code: int
+    content: bytes
+    headers: Mapping[str, str] = field(default_factory=dict)
+
+
+class CircuitBreaker:
+    """
+    Per-host circuit breaker. After the given number of consecutive failures, requests
+    to the host are rejected right away for the reset timeout. Then a single trial
+    request is let through: if it succeeds, the circuit is closed again, otherwise it
+    stays open for another reset timeout.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._failures: dict[str, int] = defaultdict(int)
+        self._opened_at: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def is_open(self, host: str) -> bool:
+        with self._lock:
+            return host in self._opened_at
+
+    def allow(self, host: str) -> bool:
+        with self._lock:
+            if (opened_at := self._opened_at.get(host)) is None:
+                return True
+            if time.monotonic() - opened_at < self._reset_timeout:
+                return False
+            # Let a trial request through and keep rejecting the others until it ends.
+            self._opened_at[host] = time.monotonic()
+            return True
+
+    def record_success(self, host: str) -> None:
+        with self._lock:
+            self._failures.pop(host, None)
+            self._opened_at.pop(host, None)
+
+    def record_failure(self, host: str) -> None:
+        with self._lock:
+            self._failures[host] += 1
+            if self._failures[host] >= self._failure_threshold:
+                self._opened_at[host] = time.monotonic()
+
+
+class BaseHttpFetcher:
+    """
+    Common part of the outbound HTTP clients: the limits of the requests, the circuit
+    breaker and the per-host metrics. A fetcher can share the circuit breaker and the
+    metrics with another one, so that a host that is down for the synchronous client
+    is down for the asynchronous one as well.
+    """
+
+    def __init__(
+        self,
+        *,
+        total_timeout: float,
+        max_bytes: int,
+        failure_threshold: int,
+        reset_timeout: float,
+        shared_with: Optional["BaseHttpFetcher"] = None,
+    ):
+        self._total_timeout = total_timeout
+        self._max_bytes = max_bytes
+        if shared_with is not None:
+            self._circuit_breaker = shared_with._circuit_breaker
+            self._metrics = shared_with._metrics
+            self._lock = shared_with._lock
+        else:
+            self._circuit_breaker = CircuitBreaker(failure_threshold, reset_timeout)
+            self._metrics: dict[str, dict[str, float]] = defaultdict(
+                lambda: defaultdict(int)
+            )
+            self._lock = threading.Lock()
+
+    def _count(self, host: str, **values: float) -> None:
+        with self._lock:
+            for name, value in values.items():
+                self._metrics[host][name] += value
+
+    def _check_content_length(self, headers: Mapping[str, str]) -> None:
+        content_length = headers.get("Content-Length")
+        if content_length is not None and content_length.isdigit():
+            if int(content_length) > self._max_bytes:
+                raise ResponseTooLargeError()
+
+    def _check_circuit(self, host: str) -> None:
+        if not self._circuit_breaker.allow(host):
+            self._count(host, rejected=1)
+            raise CircuitOpenError(host)
+
+    def _record_response(
+        self, host: str, status_code: int, size: int, started_at: float
+    ) -> None:
+        if status_code >= 500:
+            self._circuit_breaker.record_failure(host)
+            self._count(host, failures=1)
+        else:
+            self._circuit_breaker.record_success(host)
+        self._count(
+            host,
+            requests=1,
+            bytes_received=size,
+            seconds=time.monotonic() - started_at,
+        )
+
+    def _record_error(self, host: str, error: FetchError) -> None:
+        if isinstance(error, FetchCancelledError):
+            self._count(host, requests=1, cancelled=1)
+        elif isinstance(error, ResponseTooLargeError):
+            # The host works, it's the file that we don't want.
+            self._circuit_breaker.record_success(host)
+            self._count(host, requests=1, too_large=1)
+        else:
+            self._circuit_breaker.record_failure(host)
+            self._count(host, requests=1, failures=1)
+
+    def get_hosts_metrics(self) -> dict[str, dict[str, Any]]:
+        with self._lock:
+            return {
+                host: {
+                    **metrics,
+                    "circuit_open": self._circuit_breaker.is_open(host),
+                }
+                for host, metrics in self._metrics.items()
+            }
+
+
+class HttpFetcher(BaseHttpFetcher):
+    """
+    Shared client for outbound GET requests. Connections are kept alive in a pool per
+    host and reused across requests. Every request is bounded: by the connect and read
+    timeouts, by the total time of the request, and by the size of the response body,
+    which is streamed and abandoned as soon as it exceeds the limit. Hosts that keep
+    failing are short-circuited by a circuit breaker.
+    """
+
+    def __init__(
+        self,
+        *,
+        connect_timeout: float,
+        read_timeout: float,
+        pool_maxsize: int,
+        **options: Any,
+    ):
+        super().__init__(**options)
+        self._read_timeout = read_timeout
+        # The headers must arrive within the total timeout as well.
+        self._timeout = (connect_timeout, min(read_timeout, self._total_timeout))
+        self._adapter = HTTPAdapter(pool_maxsize=pool_maxsize, max_retries=0)
+        self._session = requests.Session()
+        self._session.mount("http://", self._adapter)
+        self._session.mount("https://", self._adapter)
+
+    def _set_read_timeout(self, response: requests.Response, timeout: float) -> None:
+        if (sock := getattr(response.raw.connection, "sock", None)) is not None:
+            sock.settimeout(timeout)
+
+    def _read_content(
+        self,
+        response: requests.Response,
+        started_at: float,
+        cancelled: Optional[threading.Event],
+    ) -> bytes:
+        """
+        This method is used to read the body of the response before the total timeout.
+        Every read returns as soon as some bytes have arrived and may wait for the read
+        timeout at most, or for the time left if it's shorter, so a server that sends
+        the body byte by byte can't keep us past the deadline.
+        """
+        self._check_content_length(response.headers)
+        deadline = started_at + self._total_timeout
+        chunks, size = [], 0
+        while True:
+            if cancelled is not None and cancelled.is_set():
+                raise FetchCancelledError()
+            if (remaining := deadline - time.monotonic()) <= 0:
+                raise FetchError("The response took too long.")
+            self._set_read_timeout(response, min(self._read_timeout, remaining))
+            if not (chunk := response.raw.read1(CHUNK_SIZE, decode_content=True)):
+                return b"".join(chunks)
+            size += len(chunk)
+            if size > self._max_bytes:
+                raise ResponseTooLargeError()
+            chunks.append(chunk)
+
+    def get(
+        self,
+        url: str,
+        headers: Optional[dict[str, str]] = None,
+        cancelled: Optional[threading.Event] = None,
+    ) -> FetchResponse:
+        """
+        This method is used to make a GET request. Server errors, timeouts and network
+        errors count as failures of the host. Network errors, timeouts, too large
+        responses and requests to hosts with an open circuit raise a FetchError. When
+        the cancelled event is set, the download of the body is abandoned.
+        """
+        host = urlsplit(url).netloc
+        if cancelled is not None and cancelled.is_set():
+            raise FetchCancelledError()
+        self._check_circuit(host)
+
+        started_at = time.monotonic()
+        try:
+            with self._session.get(
+                url, headers=headers, timeout=self._timeout, stream=True
+            ) as response:
+                content = self._read_content(response, started_at, cancelled)
+        except FetchError as error:
+            self._record_error(host, error)
+            raise
+        except (requests.RequestException, urllib3.exceptions.HTTPError) as error:
+            self._record_error(host, FetchError(str(error)))
+            raise FetchError(str(error)) from error
+
+        self._record_response(host, response.status_code, len(content), started_at)
+        return FetchResponse(
+            status_code=response.status_code,
+            content=content,
+            headers=response.headers,
+        )
+
+    def close(self) -> None:
+        self._session.close()
+
+    def get_metrics(self) -> dict[str, Any]:
+        return {
+            "connection_pools": len(self._adapter.poolmanager.pools),
+            "hosts": self.get_hosts_metrics(),
+        }
+
+
+class AsyncHttpFetcher(BaseHttpFetcher):
+    """
+    Asynchronous counterpart of HttpFetcher based on httpx. A client, with its pool of
+    connections, is created for every event loop, because connections can't be shared
+    between loops. Cancelling the task that awaits a request abandons the request.
+    """
+
+    def __init__(
+        self,
+        *,
+        connect_timeout: float,
+        read_timeout: float,
+        pool_maxsize: int,
+        **options: Any,
+    ):
+        super().__init__(**options)
+        self._timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self._limits = httpx.Limits(max_keepalive_connections=pool_maxsize)
+        self._clients: WeakKeyDictionary[
+            asyncio.AbstractEventLoop, httpx.AsyncClient
+        ] = WeakKeyDictionary()
+
+    def _get_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if (client := self._clients.get(loop)) is None:
+            client = httpx.AsyncClient(timeout=self._timeout, limits=self._limits)
+            self._clients[loop] = client
+        return client
+
+    async def _read_content(self, response: httpx.Response) -> bytes:
+        self._check_content_length(response.headers)
+        chunks, size = [], 0
+        async for chunk in response.aiter_bytes(chunk_size=CHUNK_SIZE):
+            size += len(chunk)
+            if size > self._max_bytes:
+                raise ResponseTooLargeError()
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    async def get(
+        self, url: str, headers: Optional[dict[str, str]] = None
+    ) -> FetchResponse:
+        """
+        This method is used to make a GET request with the same limits and failure
+        accounting as HttpFetcher.get.
+        """
+        host = urlsplit(url).netloc
+        self._check_circuit(host)
+
+        started_at = time.monotonic()
+        try:
+            async with asyncio.timeout(self._total_timeout):
+                async with self._get_client().stream(
+                    "GET", url, headers=headers
+                ) as response:
+                    content = await self._read_content(response)
+        except asyncio.CancelledError:
+            self._record_error(host, FetchCancelledError())
+            raise
+        except FetchError as error:
+            self._record_error(host, error)
+            raise
+        except (httpx.HTTPError, TimeoutError) as error:
+            self._record_error(host, FetchError(str(error)))
+            raise FetchError(str(error)) from error
+
+        self._record_response(host, response.status_code, len(content), started_at)
+        return FetchResponse(
+            status_code=response.status_code,
+            content=content,
+            headers=response.headers,
+        )
+
+    async def aclose(self) -> None:
+        if (client := self._clients.pop(asyncio.get_running_loop(), None)) is not None:
+            await client.aclose()
@@ -0,0 +1,79 @@
+"""
+Gunicorn configuration of the production server, run with `poe prod`.
+
+The mode is selected with GUNICORN_MODE. In the wsgi mode, the synchronous views are served by threaded workers. In the asgi
+mode, all views (including the asynchronous ones under /api/async/) are served by
+uvicorn workers. Every setting can be overridden with an environment variable.
+"""
+
+import multiprocessing
+import os
+import time
+
+import decouple
+
+cpu_count = multiprocessing.cpu_count()
+
+# Either "wsgi" or "asgi". It's kept apart from SERVER_MODE, which also selects the
+# development server; `poe serve` passes SERVER_MODE on when it runs gunicorn.
+server_mode = decouple.config("GUNICORN_MODE", default="wsgi")
+if server_mode not in ("wsgi", "asgi"):
+    raise ValueError(f"Unknown server mode for gunicorn: {server_mode}.")
+
+wsgi_app = f"meme_generator_api.{server_mode}:application"
+bind = decouple.config("GUNICORN_BIND", default="0.0.0.0:8080")
+
+# Threaded workers block on the database and the downloads of template images, so
+# there are more of them than cores. Event loop workers don't block, so one per core is
+# enough.
+workers = decouple.config(
+    "WEB_CONCURRENCY",
+    default=cpu_count * 2 + 1 if server_mode == "wsgi" else cpu_count,
+    cast=int,
+)
+if server_mode == "wsgi":
+    worker_class = "gthread"
+    threads = decouple.config("GUNICORN_THREADS", default=4, cast=int)
+else:
+    worker_class = "uvicorn.workers.UvicornWorker"
+
+# Every worker has its own pool of render processes, so by default the cores are split
+# between the pools instead of giving every pool all of them.
+os.environ.setdefault("RENDER_POOL_WORKERS", str(max(1, cpu_count // workers)))
+
+# The application is imported, and its shared state loaded, once in the master process,
+# so that the workers share the memory copy-on-write and start serving right away.
+preload_app = decouple.config("GUNICORN_PRELOAD", default=True, cast=bool)
+
+# Workers are recycled after a number of requests, which bounds the growth of their
+# memory. The jitter keeps the workers from restarting all at once.
+max_requests = decouple.config("GUNICORN_MAX_REQUESTS", default=1000, cast=int)
+max_requests_jitter = decouple.config(
+    "GUNICORN_MAX_REQUESTS_JITTER", default=100, cast=int
+)
+
+# Workers that don't respond for this many seconds are killed and restarted.
+timeout = decouple.config("GUNICORN_TIMEOUT", default=30, cast=int)
+# Time given to a worker to finish its requests after it's asked to stop.
+graceful_timeout = decouple.config("GUNICORN_GRACEFUL_TIMEOUT", default=30, cast=int)
+keepalive = decouple.config("GUNICORN_KEEPALIVE", default=5, cast=int)
+
+accesslog = "-"
+
+
+def when_ready(server):
+    """
+    This hook is used to load the shared state of the application in the master
+    process right before the workers are forked.
+    """
+    if not preload_app:
+        return
+    from api.warmup import close_connections, preload_process_state
+
+    started_at = time.perf_counter()
+    preload_process_state()
+    close_connections()
+    server.log.info(
+        "Preloaded the application in %.1f ms",
+        (time.perf_counter() - started_at) * 1000,
+    )
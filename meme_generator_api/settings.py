@@ -10,11 +10,12 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from datetime import timedelta
 from pathlib import Path
 
 import dj_database_url
-from decouple import config
+from decouple import Csv, config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -22,6 +23,111 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 MEDIA_ROOT = BASE_DIR / "media"
 MEDIA_URL = "/media/"
 
+# Images of meme templates are cached in memory and on disk, so that the surprise-me
+# feature doesn't download them on every request.
+TEMPLATE_CACHE_DIR = MEDIA_ROOT / "template_cache"
+TEMPLATE_CACHE_TTL_SECONDS = config(
+    "TEMPLATE_CACHE_TTL_SECONDS", 24 * 60 * 60, cast=int
+)
+TEMPLATE_CACHE_MEMORY_MAX_BYTES = config(
+    "TEMPLATE_CACHE_MEMORY_MAX_BYTES", 64 * 1024 * 1024, cast=int
+)
+TEMPLATE_CACHE_DISK_MAX_BYTES = config(
+    "TEMPLATE_CACHE_DISK_MAX_BYTES", 512 * 1024 * 1024, cast=int
+)
+
+# Outbound requests for the images of templates. Connections are pooled per host, and
+# hosts that keep failing are skipped for a while by a circuit breaker.
+OUTBOUND_HTTP_CONNECT_TIMEOUT_SECONDS = config(
+    "OUTBOUND_HTTP_CONNECT_TIMEOUT_SECONDS", 3, cast=float
+)
+OUTBOUND_HTTP_READ_TIMEOUT_SECONDS = config(
+    "OUTBOUND_HTTP_READ_TIMEOUT_SECONDS", 5, cast=float
+)
+OUTBOUND_HTTP_TOTAL_TIMEOUT_SECONDS = config(
+    "OUTBOUND_HTTP_TOTAL_TIMEOUT_SECONDS", 15, cast=float
+)
+OUTBOUND_HTTP_MAX_RESPONSE_BYTES = config(
+    "OUTBOUND_HTTP_MAX_RESPONSE_BYTES", 20 * 1024 * 1024, cast=int
+)
+OUTBOUND_HTTP_POOL_MAXSIZE = config("OUTBOUND_HTTP_POOL_MAXSIZE", 10, cast=int)
+OUTBOUND_HTTP_CIRCUIT_FAILURE_THRESHOLD = config(
+    "OUTBOUND_HTTP_CIRCUIT_FAILURE_THRESHOLD", 5, cast=int
+)
+OUTBOUND_HTTP_CIRCUIT_RESET_SECONDS = config(
+    "OUTBOUND_HTTP_CIRCUIT_RESET_SECONDS", 30, cast=float
+)
+
+# The images of templates are probed by the check_templates management command. Healthy
+# templates are checked again after the interval, failing ones are retried with an
+# exponential backoff.
+TEMPLATE_CHECK_CONCURRENCY = config("TEMPLATE_CHECK_CONCURRENCY", 8, cast=int)
+TEMPLATE_CHECK_INTERVAL_SECONDS = config(
+    "TEMPLATE_CHECK_INTERVAL_SECONDS", 60 * 60, cast=int
+)
+TEMPLATE_CHECK_BACKOFF_BASE_SECONDS = config(
+    "TEMPLATE_CHECK_BACKOFF_BASE_SECONDS", 60, cast=int
+)
+TEMPLATE_CHECK_BACKOFF_MAX_SECONDS = config(
+    "TEMPLATE_CHECK_BACKOFF_MAX_SECONDS", 24 * 60 * 60, cast=int
+)
+TEMPLATE_CHECK_POLL_SECONDS = config("TEMPLATE_CHECK_POLL_SECONDS", 30, cast=float)
+
+# Sizes and formats of meme images are generated from the rendered images on demand
+# and cached on disk.
+IMAGE_VARIANTS_DIR = MEDIA_ROOT / "variants"
+IMAGE_VARIANTS_MAX_BYTES = config(
+    "IMAGE_VARIANTS_MAX_BYTES", 1024 * 1024 * 1024, cast=int
+)
+
+# Template images are downscaled to the maximum dimension before rendering, and images
+# with more pixels than the limit are rejected without being decoded. Normalized
+# images are cached in memory by every render worker.
+TEMPLATE_MAX_DIMENSION = config("TEMPLATE_MAX_DIMENSION", 1600, cast=int)
+TEMPLATE_MAX_PIXELS = config("TEMPLATE_MAX_PIXELS", 40_000_000, cast=int)
+NORMALIZED_TEMPLATE_CACHE_MAX_BYTES = config(
+    "NORMALIZED_TEMPLATE_CACHE_MAX_BYTES", 64 * 1024 * 1024, cast=int
+)
+
+# TrueType font of the captions of memes. The font bundled with Pillow is used by
+# default.
+MEME_FONT_PATH = config("MEME_FONT_PATH", "")
+# Rasterized captions are cached in memory by every render worker.
+CAPTION_OVERLAY_CACHE_MAX_BYTES = config(
+    "CAPTION_OVERLAY_CACHE_MAX_BYTES", 32 * 1024 * 1024, cast=int
+)
+
+# Meme images are rendered in a pool of worker processes. Setting the number of
+# workers to 0 renders them in the request thread. Every server process has its own
+# pool, so by default the cores are split between the WEB_CONCURRENCY server processes
+# instead of giving every pool all of them (gunicorn.conf.py does the same for the
+# number of processes it derives).
+RENDER_POOL_WORKERS = config(
+    "RENDER_POOL_WORKERS",
+    max(1, (os.cpu_count() or 1) // config("WEB_CONCURRENCY", 1, cast=int)),
+    cast=int,
+)
+RENDER_QUEUE_SIZE = config("RENDER_QUEUE_SIZE", 32, cast=int)
+RENDER_TIMEOUT_SECONDS = config("RENDER_TIMEOUT_SECONDS", 10, cast=float)
+
+# Surprise-me memes are served from a pool of prerendered images, which is refilled by
+# the refill_surprise_pool management command. If the pool is empty, memes are rendered
+# inline unless the fallback is disabled.
+SURPRISE_POOL_SIZE = config("SURPRISE_POOL_SIZE", 20, cast=int)
+SURPRISE_POOL_LOW_WATERMARK = config("SURPRISE_POOL_LOW_WATERMARK", 5, cast=int)
+SURPRISE_POOL_INLINE_FALLBACK = config("SURPRISE_POOL_INLINE_FALLBACK", True, cast=bool)
+# When no template image is cached, the images of this many templates are downloaded
+# at the same time, and the first one to succeed is used. If none succeeds before the
+# deadline, the request fails.
+SURPRISE_FETCH_RACE_SIZE = config("SURPRISE_FETCH_RACE_SIZE", 4, cast=int)
+SURPRISE_FETCH_DEADLINE_SECONDS = config(
+    "SURPRISE_FETCH_DEADLINE_SECONDS", 10, cast=float
+)
+SURPRISE_FETCH_WORKERS = config("SURPRISE_FETCH_WORKERS", 16, cast=int)
+SURPRISE_POOL_REFILL_INTERVAL_SECONDS = config(
+    "SURPRISE_POOL_REFILL_INTERVAL_SECONDS", 5, cast=float
+)
+
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.1/howto/deployment/checklist/
 
@@ -31,7 +137,9 @@ SECRET_KEY = config("SECRET_KEY")
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = config("DEBUG", default=False, cast=bool)
 
-ALLOWED_HOSTS = []
+# Comma-separated host names the server answers to. With DEBUG off (e.g. under the
+# production server), requests to other hosts are rejected.
+ALLOWED_HOSTS = config("ALLOWED_HOSTS", default="", cast=Csv())
 
 
 # Application definition
@@ -51,6 +159,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "core.db_routing.ReplicaRoutingMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -86,7 +195,81 @@ WSGI_APPLICATION = "meme_generator_api.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {"default": dj_database_url.parse(url=config("DATABASE_URL"))}
+# Connections are kept open for DB_CONN_MAX_AGE seconds and reused by the following
+# requests of the same thread, which saves a TCP and authentication handshake per
+# request. Under ASGI, connections can't be reused this way, so they are not kept by
+# default, and the pool should be used instead. With health checks, a connection that
+# was closed by the server is replaced instead of failing the request.
+DB_CONN_MAX_AGE = config(
+    "DB_CONN_MAX_AGE", 0 if config("GUNICORN_MODE", "wsgi") == "asgi" else 60, cast=int
+)
+DB_CONN_HEALTH_CHECKS = config("DB_CONN_HEALTH_CHECKS", True, cast=bool)
+# With DB_POOL, connections are taken from a pool of psycopg per worker process, which
+# is shared by its threads (and by the async views), instead of being kept by every
+# thread. The pool doesn't work together with DB_CONN_MAX_AGE, which is ignored then.
+DB_POOL = config("DB_POOL", False, cast=bool)
+DB_POOL_MIN_SIZE = config("DB_POOL_MIN_SIZE", 2, cast=int)
+DB_POOL_MAX_SIZE = config("DB_POOL_MAX_SIZE", 10, cast=int)
+# Time a request waits for a free connection of the pool before failing.
+DB_POOL_TIMEOUT_SECONDS = config("DB_POOL_TIMEOUT_SECONDS", 10, cast=float)
+# Connections of the pool that stay unused this long are closed, down to the minimum.
+DB_POOL_MAX_IDLE_SECONDS = config("DB_POOL_MAX_IDLE_SECONDS", 600, cast=float)
+
+# The reads of safe requests (GET, HEAD, OPTIONS) are spread across the read replicas,
+# if there are any, while the writes and the other reads go to the primary. The
+# replicas are the comma-separated DATABASE_REPLICA_URLS, which can point to the
+# primary itself to try the routing locally.
+DATABASE_REPLICA_URLS = config("DATABASE_REPLICA_URLS", "", cast=Csv())
+# After a write, the reads of the same client go to the primary for this many seconds,
+# so that the client sees its own changes while the replicas catch up.
+READ_YOUR_WRITES_SECONDS = config("READ_YOUR_WRITES_SECONDS", 5, cast=float)
+
+
+def _parse_database_url(url: str) -> dict:
+    database = dj_database_url.parse(
+        url=url,
+        conn_max_age=0 if DB_POOL else DB_CONN_MAX_AGE,
+        conn_health_checks=DB_CONN_HEALTH_CHECKS,
+    )
+    if DB_POOL:
+        database.setdefault("OPTIONS", {})["pool"] = {
+            "min_size": DB_POOL_MIN_SIZE,
+            "max_size": DB_POOL_MAX_SIZE,
+            "timeout": DB_POOL_TIMEOUT_SECONDS,
+            "max_idle": DB_POOL_MAX_IDLE_SECONDS,
+        }
+    return database
+
+
+DATABASES = {"default": _parse_database_url(config("DATABASE_URL"))}
+DATABASE_REPLICAS = []
+for index, url in enumerate(DATABASE_REPLICA_URLS, start=1):
+    DATABASE_REPLICAS.append(alias := f"replica_{index}")
+    # The tests use the database of the primary for the replicas.
+    DATABASES[alias] = {**_parse_database_url(url), "TEST": {"MIRROR": "default"}}
+DATABASE_ROUTERS = ["core.db_routing.ReplicaRouter"]
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# The cache should be shared by all the workers in production (e.g. Redis), because it
+# is used to propagate the invalidation of the in-process template registry and the
+# revocation of access tokens.
+
+CACHES = {
+    "default": {
+        "BACKEND": config(
+            "CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"
+        ),
+        "LOCATION": config("CACHE_LOCATION", ""),
+    }
+}
+
+# Every worker keeps the meme templates in memory and checks whether they have changed
+# at most once per this interval.
+TEMPLATE_REGISTRY_CHECK_INTERVAL_SECONDS = config(
+    "TEMPLATE_REGISTRY_CHECK_INTERVAL_SECONDS", 5, cast=float
+)
 
 
 # Password validation
@@ -132,9 +315,26 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 SILENCED_SYSTEM_CHECKS = ["rest_framework.W001"]
 
+# With stateless authentication, the user of a request is built from the claims of its
+# access token instead of being loaded from the database on every request. Tokens
+# issued before a user was changed or deleted are rejected by the revocation checks,
+# which look the user up in the shared cache. Without a shared cache, a revocation only
+# reaches the worker that made the change, so the stateless authentication is only
+# enabled by default when the cache is shared by all processes.
+PROCESS_LOCAL_CACHE_BACKENDS = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+STATELESS_JWT_AUTHENTICATION = config(
+    "STATELESS_JWT_AUTHENTICATION",
+    CACHES["default"]["BACKEND"] not in PROCESS_LOCAL_CACHE_BACKENDS,
+    cast=bool,
+)
+JWT_REVOCATION_CHECKS = config("JWT_REVOCATION_CHECKS", True, cast=bool)
+
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "api.authentication.ConfiguredJWTAuthentication",
     ),
     "EXCEPTION_HANDLER": "core.exception_handler.common_exception_handler",
     "DEFAULT_PERMISSION_CLASSES": ("rest_framework.permissions.IsAuthenticated",),
@@ -142,6 +342,21 @@ REST_FRAMEWORK = {
     "DATE_INPUT_FORMATS": ("iso-8601",),
 }
 
+# The maximum page size a client can ask for in the cursor mode of the memes list.
+MEMES_MAX_PAGE_SIZE = config("MEMES_MAX_PAGE_SIZE", 100, cast=int)
+
+# Random memes are picked from the range of the meme ids, which is cached for a while.
+RANDOM_MEME_ID_RANGE_TTL_SECONDS = config(
+    "RANDOM_MEME_ID_RANGE_TTL_SECONDS", 60, cast=int
+)
+RANDOM_MEMES_MAX_COUNT = config("RANDOM_MEMES_MAX_COUNT", 100, cast=int)
+
+# The maximum number of memes that can be created with a single batch request.
+MEMES_BATCH_MAX_SIZE = config("MEMES_BATCH_MAX_SIZE", 100, cast=int)
+
+# The maximum number of ratings that can be sent with a single batch request.
+RATINGS_BATCH_MAX_SIZE = config("RATINGS_BATCH_MAX_SIZE", 500, cast=int)
+
 AUTH_USER_MODEL = "api.User"
 
 SIMPLE_JWT = {
@@ -151,4 +366,6 @@ SIMPLE_JWT = {
     "REFRESH_TOKEN_LIFETIME": timedelta(
         days=int(config("REFRESH_TOKEN_LIFETIME_DAYS", 365))
     ),
+    "TOKEN_OBTAIN_SERIALIZER": "api.serializers.TokenObtainPairWithClaimsSerializer",
+    "TOKEN_REFRESH_SERIALIZER": "api.serializers.TokenRefreshWithClaimsSerializer",
 }